@@ -0,0 +1,137 @@
+"""
+Stateless signed bearer tokens for API clients.
+
+A token is the user id, a random token id and the issue time, signed with SECRET_KEY and
+valid for API_TOKEN_MAX_AGE seconds. Verifying it needs no database query: users are cached
+for API_TOKEN_USER_CACHE_SECONDS and revoked tokens are listed in Redis until they expire.
+Unlike the rate limits of images_api_app, revocations fail closed: while Redis is unreachable
+bearer tokens are refused, and tokens cannot be revoked, with 503.
+
+The user cache is local to each process, so other changes of an user reach every process only
+within API_TOKEN_USER_CACHE_SECONDS. Changing the password of an user, deactivating or deleting
+it therefore also revokes all of its tokens in Redis, which applies everywhere at once.
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from images_api_app.redis_client import RedisUnavailable, run
+
+TOKEN_SALT = 'authorization.api-token'
+KEYWORD = 'Bearer'
+
+
+def user_cache_key(user_id):
+    return f"api_token_user_{user_id}"
+
+
+def revoked_key(token_id):
+    return f"auth:revoked:{token_id}"
+
+
+def revoked_before_key(user_id):
+    return f"auth:revoked-before:{user_id}"
+
+
+def issue_token(user):
+    """
+    Return a new signed token of an user.
+    """
+    return signing.dumps({'uid': user.id, 'jti': uuid.uuid4().hex, 'iat': int(time.time())}, salt=TOKEN_SALT)
+
+
+def read_token(token):
+    """
+    Return the payload of a token with a valid signature which has not expired, raising
+    AuthenticationFailed otherwise. Revocation is not checked.
+    """
+    try:
+        return signing.loads(token, salt=TOKEN_SALT, max_age=settings.API_TOKEN_MAX_AGE)
+    except signing.SignatureExpired:
+        raise exceptions.AuthenticationFailed('Token expired.')
+    except signing.BadSignature:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+
+
+class RevocationUnavailable(exceptions.APIException):
+    status_code = 503
+    default_detail = 'Token revocation cannot be checked, try again later.'
+    default_code = 'revocation_unavailable'
+
+
+def run_revocation_command(command):
+    """
+    Run a Redis command of the revocation list, raising RevocationUnavailable when Redis does not answer.
+    """
+    try:
+        return run(command, fail_closed=True)
+    except RedisUnavailable:
+        raise RevocationUnavailable()
+
+
+def is_revoked(payload):
+    """
+    Check the token id and the user's revoke-all timestamp in one Redis round trip,
+    raising RevocationUnavailable while Redis is unreachable.
+    """
+    token_revoked, revoked_before = run_revocation_command(
+        lambda client: client.mget(revoked_key(payload['jti']), revoked_before_key(payload['uid']))
+    )
+    return token_revoked is not None or (revoked_before is not None and payload['iat'] <= int(revoked_before))
+
+
+def revoke_token(payload):
+    run_revocation_command(lambda client: client.set(revoked_key(payload['jti']), 1, ex=settings.API_TOKEN_MAX_AGE))
+
+
+def revoke_user_tokens(user_id):
+    """
+    Revoke every token of an user issued until now, e.g. after a password change.
+    """
+    run_revocation_command(
+        lambda client: client.set(revoked_before_key(user_id), int(time.time()), ex=settings.API_TOKEN_MAX_AGE)
+    )
+
+
+def get_cached_user(user_id):
+    user = cache.get(user_cache_key(user_id))
+    if user is None:
+        user = User.objects.filter(id=user_id).first()
+        if user is not None:
+            cache.set(user_cache_key(user_id), user, settings.API_TOKEN_USER_CACHE_SECONDS)
+    return user
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Authenticate requests with an `Authorization: Bearer <token>` header.
+    The validated token payload is available as `request.auth`.
+    """
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != KEYWORD.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+        payload = read_token(token)
+        if is_revoked(payload):
+            raise exceptions.AuthenticationFailed('Token revoked.')
+        user = get_cached_user(payload['uid'])
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return user, payload
+
+    def authenticate_header(self, request):
+        return KEYWORD
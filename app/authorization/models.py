@@ -1,3 +1,40 @@
 from django.db import models
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .authentication import revoke_user_tokens, user_cache_key
 
 # Create your models here.
+
+
+@receiver(pre_save, sender=User)
+def revoke_tokens_of_changed_user(sender, instance, update_fields=None, **kwargs):
+    """
+    Signal handler to revoke the tokens of an user whose password changes or which is deactivated.
+    Runs before the save, so a change is never stored while its revocation could not be written.
+    """
+    if instance.pk is None or (update_fields is not None and not {'password', 'is_active'} & set(update_fields)):
+        return
+    stored = User.objects.filter(pk=instance.pk).values('password', 'is_active').first()
+    if stored is None:
+        return
+    if instance.password != stored['password'] or (stored['is_active'] and not instance.is_active):
+        revoke_user_tokens(instance.id)
+
+
+@receiver(pre_delete, sender=User)
+def revoke_tokens_of_deleted_user(sender, instance, **kwargs):
+    revoke_user_tokens(instance.id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_token_user(sender, instance, **kwargs):
+    """
+    Signal handler to drop the user cached for token authentication when the user changes.
+    Caches of other processes keep it until API_TOKEN_USER_CACHE_SECONDS, so the changes which
+    must apply at once revoke the user's tokens as well.
+    """
+    cache.delete(user_cache_key(instance.id))
@@ -1,3 +1,127 @@
-from django.test import TestCase
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import signing
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APIRequestFactory
+
+from images_api_app import redis_client
+from images_api_app.redis_client import RedisUnavailable
+from .authentication import RevocationUnavailable, SignedTokenAuthentication, TOKEN_SALT, issue_token
+
+
+def redis_available():
+    try:
+        return redis_client.get_redis().ping()
+    except Exception:
+        return False
+
+
+class TokenAuthenticationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="testuser1", password="very-strong-password")
+        if not redis_available():
+            # Revocations fail closed; without Redis no token is revoked.
+            no_revocations = patch('authorization.authentication.run', return_value=[None, None])
+            no_revocations.start()
+            self.addCleanup(no_revocations.stop)
+
+    def authenticate(self, token):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f"Bearer {token}")
+        return SignedTokenAuthentication().authenticate(request)
+
+    def test_token_is_issued_for_valid_credentials_only(self):
+        response = self.client.post(reverse('token'), {'username': 'testuser1', 'password': 'very-strong-password'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['token_type'], 'Bearer')
+        response = self.client.post(reverse('token'), {'username': 'testuser1', 'password': 'wrong-password'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_bearer_token_authenticates_api_requests_without_session(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {issue_token(self.user)}")
+        response = self.client.get(reverse('list-create-images'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('sessionid', response.cookies)
+
+    def test_verifying_token_of_cached_user_needs_no_query(self):
+        token = issue_token(self.user)
+        with patch('authorization.authentication.run', return_value=[None, None]):
+            self.authenticate(token)
+            with self.assertNumQueries(0):
+                user, payload = self.authenticate(token)
+        self.assertEqual((user, payload['uid']), (self.user, self.user.id))
+
+    def test_invalid_and_expired_tokens_are_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer not-a-token")
+        self.assertEqual(self.client.get(reverse('list-create-images')).status_code, status.HTTP_403_FORBIDDEN)
+
+        forged = signing.dumps({'uid': self.user.id, 'jti': 'x', 'iat': 0}, salt=TOKEN_SALT, key='other-key')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {forged}")
+        self.assertEqual(self.client.get(reverse('list-create-images')).status_code, status.HTTP_403_FORBIDDEN)
+
+        token = issue_token(self.user)
+        with override_settings(API_TOKEN_MAX_AGE=-1):
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+            self.assertEqual(self.client.get(reverse('list-create-images')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_deactivated_user_is_rejected(self):
+        token = issue_token(self.user)
+        self.user.is_active = False
+        self.user.save()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(self.client.get(reverse('list-create-images')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_tokens_are_refused_while_revocations_cannot_be_checked(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {issue_token(self.user)}")
+        with patch('authorization.authentication.run', side_effect=RedisUnavailable()):
+            response = self.client.get(reverse('list-create-images'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_deactivating_or_deleting_user_revokes_its_tokens(self):
+        with patch('authorization.models.revoke_user_tokens') as revoke_user_tokens:
+            self.user.first_name = 'renamed'
+            self.user.save()
+            revoke_user_tokens.assert_not_called()
+            self.user.is_active = False
+            self.user.save()
+            revoke_user_tokens.assert_called_once_with(self.user.id)
+            user_id = self.user.id
+            self.user.delete()
+        revoke_user_tokens.assert_called_with(user_id)
+
+    def test_changing_password_revokes_its_tokens(self):
+        with patch('authorization.models.revoke_user_tokens') as revoke_user_tokens:
+            self.user.save(update_fields=['last_login'])
+            revoke_user_tokens.assert_not_called()
+            self.user.set_password('another-strong-password')
+            self.user.save()
+        revoke_user_tokens.assert_called_once_with(self.user.id)
+
+    def test_password_is_not_changed_while_tokens_cannot_be_revoked(self):
+        with patch('authorization.authentication.run', side_effect=RedisUnavailable()):
+            self.user.set_password('another-strong-password')
+            with self.assertRaises(RevocationUnavailable):
+                self.user.save()
+        self.assertTrue(User.objects.get(id=self.user.id).check_password('very-strong-password'))
+
+    def test_refresh_requires_bearer_token(self):
+        self.assertEqual(self.client.post(reverse('token-refresh')).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {issue_token(self.user)}")
+        response = self.client.post(reverse('token-refresh'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.authenticate(response.data['token'])[0], self.user)
+
+    @skipUnless(redis_available(), "Redis is not available.")
+    def test_revoked_tokens_are_rejected(self):
+        token, other_token = issue_token(self.user), issue_token(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(self.client.post(reverse('token-revoke')).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(reverse('list-create-images')).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {other_token}")
+        self.client.post(reverse('token-revoke'), {'all': True}, format='json')
+        self.assertEqual(self.client.get(reverse('list-create-images')).status_code, status.HTTP_403_FORBIDDEN)
@@ -1,9 +1,12 @@
 from django.urls import path
-from .views import LoginAPIView, AuthAPIOverview, LogoutAPIView
+from .views import LoginAPIView, AuthAPIOverview, LogoutAPIView, TokenAPIView, TokenRefreshAPIView, TokenRevokeAPIView
 
 
 urlpatterns = [
     path('', AuthAPIOverview.as_view(), name="authorization"),
     path('login/', LoginAPIView.as_view(), name='login'),
     path('logout/', LogoutAPIView.as_view(), name='logout'),
+    path('token/', TokenAPIView.as_view(), name='token'),
+    path('token/refresh/', TokenRefreshAPIView.as_view(), name='token-refresh'),
+    path('token/revoke/', TokenRevokeAPIView.as_view(), name='token-revoke'),
 ]
\ No newline at end of file
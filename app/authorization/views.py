@@ -1,9 +1,12 @@
 from django.contrib.auth import authenticate, login, logout
+from django.conf import settings
+from rest_framework import permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from django.contrib.auth.models import User
 from .serializers import LoginSerializer
+from .authentication import SignedTokenAuthentication, issue_token, revoke_token, revoke_user_tokens
 
 
 class AuthAPIOverview(APIView):
@@ -12,6 +15,9 @@ class AuthAPIOverview(APIView):
         routes = {
             "Login": request.build_absolute_uri(reverse(('login'))),
             "Logout": request.build_absolute_uri(reverse(('logout'))),
+            "Token": request.build_absolute_uri(reverse(('token'))),
+            "Token refresh": request.build_absolute_uri(reverse(('token-refresh'))),
+            "Token revoke": request.build_absolute_uri(reverse(('token-revoke'))),
         }
         return Response(routes)
 
@@ -47,4 +53,57 @@ class LoginAPIView(APIView):
 class LogoutAPIView(APIView):
     def get(self, request):
         logout(request)
-        return Response({"message": "Successfully logouted."})
\ No newline at end of file
+        return Response({"message": "Successfully logouted."})
+
+
+def token_response(user):
+    return Response({
+        "token": issue_token(user),
+        "token_type": "Bearer",
+        "expires_in": settings.API_TOKEN_MAX_AGE,
+    })
+
+
+class TokenAPIView(APIView):
+    """
+    Issue a signed bearer token for API clients in exchange for credentials.
+    Send it as `Authorization: Bearer <token>`; no session is created.
+    """
+    authentication_classes = []
+    serializer_class = LoginSerializer
+
+    def post(self, request):
+        serializer = LoginSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = authenticate(username=serializer.data['username'], password=serializer.data['password'])
+        if user is None:
+            return Response({"message": "error", "details": ["Invalid credentials"]}, status=status.HTTP_401_UNAUTHORIZED)
+        return token_response(user)
+
+
+class TokenRefreshAPIView(APIView):
+    """
+    Exchange a valid bearer token for a new one without sending credentials again.
+    The old token is revoked.
+    """
+    authentication_classes = [SignedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        revoke_token(request.auth)
+        return token_response(request.user)
+
+
+class TokenRevokeAPIView(APIView):
+    """
+    Revoke the bearer token of the request, or with `{"all": true}` every token of the user.
+    """
+    authentication_classes = [SignedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        if request.data.get('all') is True:
+            revoke_user_tokens(request.user.id)
+        else:
+            revoke_token(request.auth)
+        return Response(status=status.HTTP_204_NO_CONTENT)
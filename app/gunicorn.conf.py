@@ -0,0 +1,42 @@
+"""
+Gunicorn configuration for serving images_api in production.
+
+The application is preloaded and warmed up in the master process, workers are
+forked from it and recycled after a configurable number of requests.
+
+Workers are threaded by default: image event streams stay open for up to
+IMAGE_EVENTS_MAX_SECONDS, longer than `timeout`, and each holds one thread. A sync
+worker serving a stream would be killed once `timeout` expires, so with
+GUNICORN_WORKER_CLASS=sync IMAGE_EVENTS_MAX_SECONDS must be set below GUNICORN_TIMEOUT.
+"""
+import os
+import time
+
+BOOT_STARTED = time.perf_counter()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', (os.cpu_count() or 1) * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+
+# Recycle workers to bound memory growth; jitter avoids restarting them all at once.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+preload_app = True
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    """
+    Warm up the preloaded application in the master before any worker is forked
+    and report the cold-start time.
+    """
+    from images_api.warmup import warm_up
+
+    warm_up_seconds = warm_up()
+    server.log.info(
+        "Cold start: %.3fs (warm-up %.3fs)", time.perf_counter() - BOOT_STARTED, warm_up_seconds
+    )
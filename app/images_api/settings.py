@@ -54,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'images_api_app.profiling.ProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'images_api.urls'
@@ -90,6 +91,17 @@ DATABASES = {
     }
 }
 
+# Comma-separated hosts of streaming replicas of the default database, e.g. "replica-1,replica-2".
+# Each becomes an alias `replica_<n>` serving read-only API queries.
+DATABASE_REPLICAS = []
+for replica_number, replica_host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica_{replica_number}'] = {**DATABASES['default'], 'HOST': replica_host, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica_{replica_number}')
+
+DATABASE_ROUTERS = ['images_api_app.db_router.ReplicaRouter']
+# Users read from the primary for this many seconds after a write, so replica lag never hides their changes.
+REPLICA_STICKY_SECONDS = 5
+
 # Cache settings
 
 CACHES = {
@@ -153,6 +165,156 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Europe/Warsaw'
+CELERY_BEAT_SCHEDULE = {
+    # Safety net for queued file deletions whose after-commit drain never ran.
+    'drain-file-deletions': {
+        'task': 'images_api_app.tasks.drain_file_deletions',
+        'schedule': 300,
+    },
+}
+
+
+# THUMBNAIL SETTINGS
+
+# Images above this pixel count are rejected before decoding.
+THUMBNAIL_MAX_PIXELS = int(os.environ.get('THUMBNAIL_MAX_PIXELS', 150_000_000))
+# Bytes a single thumbnail task may allocate for the decoded bitmap.
+THUMBNAIL_TASK_MEMORY_BUDGET = int(os.environ.get('THUMBNAIL_TASK_MEMORY_BUDGET', 256 * 1024 * 1024))
+# Queue for images over the memory budget, e.g. consumed by a worker with concurrency 1.
+# When unset, such images are rejected.
+THUMBNAIL_LARGE_QUEUE = os.environ.get('THUMBNAIL_LARGE_QUEUE')
+# Images up to this pixel count get their thumbnails rendered inline by the upload request.
+THUMBNAIL_INLINE_MAX_PIXELS = int(os.environ.get('THUMBNAIL_INLINE_MAX_PIXELS', 1_000_000))
+# Uploads per web process allowed to render inline at the same time; 0 disables the inline path.
+# Only threaded gunicorn workers serve uploads concurrently, sync workers render one at a time.
+THUMBNAIL_INLINE_CONCURRENCY = int(os.environ.get('THUMBNAIL_INLINE_CONCURRENCY', 2))
+# Images of tiers with deep zoom get a tile pyramid from this pixel count on.
+TILE_PYRAMID_MIN_PIXELS = int(os.environ.get('TILE_PYRAMID_MIN_PIXELS', 16_000_000))
+# Queue of the batch consumer rendering pending images on a process pool, consumed by a worker
+# with the solo pool, e.g. `celery -A images_api worker -P solo -Q thumbnail-batches`.
+# When unset, every image gets its own create_thumbnails task.
+THUMBNAIL_BATCH_QUEUE = os.environ.get('THUMBNAIL_BATCH_QUEUE')
+# Images claimed and bulk-written at once by the batch consumer.
+THUMBNAIL_BATCH_SIZE = int(os.environ.get('THUMBNAIL_BATCH_SIZE', 64))
+# Processes of the batch consumer pool; 0 starts one per core.
+THUMBNAIL_BATCH_WORKERS = int(os.environ.get('THUMBNAIL_BATCH_WORKERS', 0))
+# Seconds after which an image still processing is assumed lost with its worker and queued again.
+THUMBNAIL_PROCESSING_TIMEOUT = int(os.environ.get('THUMBNAIL_PROCESSING_TIMEOUT', 3600))
+
+CELERY_BEAT_SCHEDULE['requeue-stale-thumbnails'] = {
+    'task': 'images_api_app.tasks.requeue_stale_thumbnails',
+    'schedule': 300,
+}
+
+if THUMBNAIL_BATCH_QUEUE:
+    # Safety net for pending images whose consumer was lost with its worker.
+    CELERY_BEAT_SCHEDULE['render-pending-thumbnails'] = {
+        'task': 'images_api_app.tasks.render_pending_thumbnails',
+        'schedule': 60,
+        'options': {'queue': THUMBNAIL_BATCH_QUEUE},
+    }
+
+
+# STORAGE TIERING SETTINGS
+
+# Originals not accessed for COLD_STORAGE_AFTER_DAYS days are moved to this cheaper volume
+# and moved back on their next access. When unset, all originals stay in MEDIA_ROOT.
+COLD_STORAGE_ROOT = os.environ.get('COLD_STORAGE_ROOT')
+COLD_STORAGE_AFTER_DAYS = int(os.environ.get('COLD_STORAGE_AFTER_DAYS', 30))
+COLD_STORAGE_BATCH_SIZE = 500
+# Share of accesses of originals buffered in Redis, which is flushed to the database every minute.
+ORIGINAL_ACCESS_SAMPLE_RATE = float(os.environ.get('ORIGINAL_ACCESS_SAMPLE_RATE', 1))
+
+if COLD_STORAGE_ROOT:
+    CELERY_BEAT_SCHEDULE.update({
+        'flush-original-accesses': {
+            'task': 'images_api_app.tasks.flush_original_accesses',
+            'schedule': 60,
+        },
+        'demote-idle-originals': {
+            'task': 'images_api_app.tasks.demote_idle_originals',
+            'schedule': 24 * 3600,
+        },
+    })
+
+
+# SIMILAR IMAGES SETTINGS
+
+# Hash indexes of this many users are kept per process, least recently used dropped first.
+PHASH_INDEX_CACHE_USERS = int(os.environ.get('PHASH_INDEX_CACHE_USERS', 100))
+# Hash changes kept per user in Redis; indexes further behind are rebuilt from the database.
+PHASH_CHANGE_LOG_LENGTH = 1000
+
+# THUMBNAIL ATLAS SETTINGS
+
+# Atlases not served for this many hours are deleted; must stay well above CACHE_TIMEOUT,
+# since the atlas view only refreshes an atlas when its cached coordinates expire.
+ATLAS_IDLE_HOURS = int(os.environ.get('ATLAS_IDLE_HOURS', 24))
+CELERY_BEAT_SCHEDULE['collect-idle-atlases'] = {
+    'task': 'images_api_app.tasks.collect_idle_atlases',
+    'schedule': 3600,
+}
+
+
+# FILE DELETION SETTINGS
+
+FILE_DELETION_BATCH_SIZE = 500
+FILE_DELETION_MAX_ATTEMPTS = 5
+
+
+# UPLOAD SETTINGS
+
+# Uploads whose image header is not parsed within this many bytes are rejected.
+UPLOAD_HEADER_MAX_BYTES = 256 * 1024
+
+
+# API AUTHENTICATION SETTINGS
+
+REST_FRAMEWORK = {
+    # Session authentication stays first for the browsable API; API clients send signed bearer tokens.
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'authorization.authentication.SignedTokenAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+}
+API_TOKEN_MAX_AGE = int(os.environ.get('API_TOKEN_MAX_AGE', 3600))
+# Users of verified tokens are cached per process for this long, so changes of an user reach every
+# process within it. Deactivation and deletion revoke the user's tokens in Redis at once.
+API_TOKEN_USER_CACHE_SECONDS = 60
+
+# PROFILER SETTINGS
+
+# Requests and tasks selected below are sampled every PROFILER_INTERVAL seconds and their
+# collapsed stacks written to PROFILER_DIRECTORY, which keeps at most PROFILER_MAX_BYTES.
+PROFILER_DIRECTORY = os.environ.get('PROFILER_DIRECTORY', '/vol/web/profiles/')
+PROFILER_MAX_BYTES = int(os.environ.get('PROFILER_MAX_BYTES', 100 * 1024 * 1024))
+PROFILER_INTERVAL = float(os.environ.get('PROFILER_INTERVAL', 0.005))
+PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', 0))
+# URL names, user ids and task names which are always profiled.
+PROFILER_ROUTES = [name for name in os.environ.get('PROFILER_ROUTES', '').split(',') if name]
+PROFILER_USERS = [int(user_id) for user_id in os.environ.get('PROFILER_USERS', '').split(',') if user_id]
+PROFILER_TASKS = [name for name in os.environ.get('PROFILER_TASKS', '').split(',') if name]
+# Admin key signing X-Profile headers; profiling by header is disabled while it is empty.
+PROFILER_SIGNING_KEY = os.environ.get('PROFILER_SIGNING_KEY', '')
+PROFILER_HEADER_MAX_AGE = 3600
+
+# IMAGE EVENTS SETTINGS
+
+# Event streams are closed after this many seconds; clients reconnect. Every open stream holds
+# a gunicorn worker thread, so with sync workers this must stay below GUNICORN_TIMEOUT.
+IMAGE_EVENTS_MAX_SECONDS = int(os.environ.get('IMAGE_EVENTS_MAX_SECONDS', 300))
+IMAGE_EVENTS_HEARTBEAT_SECONDS = 15
+
+# RATE LIMIT SETTINGS
+
+# Redis holding the upload and expiring link token buckets and the storage usage counters,
+# and the other shared state of images_api_app.redis_client.
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/1')
+REDIS_SOCKET_TIMEOUT = 0.5
+# Optional Redis commands, e.g. rate limits, are skipped for this many seconds after Redis
+# failed to answer. Commands failing closed, e.g. token revocation checks, are always attempted.
+REDIS_RETRY_SECONDS = 5
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -0,0 +1,35 @@
+"""
+Pre-fork warm-up for the images_api project.
+
+Called once in the server master process (with app preloading enabled) so that
+heavy modules and the URLconf are imported before workers are forked and their
+memory is shared copy-on-write between all workers.
+"""
+import time
+
+from django.db import connections
+from django.urls import get_resolver
+
+
+def warm_up():
+    """
+    Import heavy dependencies and resolve the URLconf. Return elapsed seconds.
+    """
+    started = time.perf_counter()
+
+    # Pillow registers its format plugins lazily on first open; do it now.
+    from PIL import Image as PILImage
+    PILImage.init()
+
+    # DRF renderers, parsers and the browsable API templates.
+    import rest_framework.renderers  # noqa: F401
+    import rest_framework.parsers  # noqa: F401
+    import rest_framework.generics  # noqa: F401
+
+    # Importing the URLconf imports every view, serializer and task module.
+    get_resolver().url_patterns
+
+    # Never share database sockets opened during warm-up with forked workers.
+    connections.close_all()
+
+    return time.perf_counter() - started
@@ -1,5 +1,37 @@
 from django.contrib import admin
-from .models import Image, Thumbnail, ThumbnailSize, AccountTier, GrantedTier, ExpiringLink
+from .models import Image, Thumbnail, ThumbnailSize, AccountTier, GrantedTier, ExpiringLink, PendingFileDeletion, UsageStats
 # Register your models here.
 
-admin.site.register((Image, Thumbnail, ThumbnailSize, AccountTier, GrantedTier, ExpiringLink))
\ No newline at end of file
+admin.site.register((Image, ThumbnailSize, PendingFileDeletion))
+
+
+@admin.register(AccountTier)
+class AccountTierAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('thumbnail_sizes')
+
+
+@admin.register(GrantedTier)
+class GrantedTierAdmin(admin.ModelAdmin):
+    list_select_related = ['user']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('granted_tiers')
+
+
+@admin.register(Thumbnail)
+class ThumbnailAdmin(admin.ModelAdmin):
+    list_select_related = ['base_image']
+
+
+@admin.register(ExpiringLink)
+class ExpiringLinkAdmin(admin.ModelAdmin):
+    list_select_related = ['base_image']
+
+
+@admin.register(UsageStats)
+class UsageStatsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'image_count', 'thumbnail_count', 'stored_bytes', 'updated_at']
+    list_select_related = ['user']
+    ordering = ['-stored_bytes']
+    readonly_fields = list_display
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ImagesApiAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'images_api_app'
+
+    def ready(self):
+        from django.conf import settings
+        from PIL import Image as PILImage
+
+        # Pillow's own decompression-bomb guard runs on open; align it with our pixel limit.
+        PILImage.MAX_IMAGE_PIXELS = settings.THUMBNAIL_MAX_PIXELS
+
+        # Connects the Celery task signals of the sampling profiler.
+        from . import profiling  # noqa: F401
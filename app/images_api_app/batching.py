@@ -0,0 +1,157 @@
+"""
+Batch rendering of thumbnails on a process pool.
+
+One Celery task per image pays the task bookkeeping and its queries for every image, which
+dominates for the small images of bulk imports. The batch consumer claims many pending images
+at once, fans their decoding and resizing out to a process pool with one process per core,
+and writes the results back with one bulk insert per batch.
+
+Pool processes are forked from the consumer and never query the database.
+"""
+import logging
+import multiprocessing
+import os
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from .events import publish_image_event
+from .imaging import (decode_image, encode_image, estimate_decode_bytes, find_focal_point, fit_to_size,
+                      output_extension, placeholder_data_uri, plan_thumbnail_sizes)
+from .models import Image, Thumbnail, UsageStats, batched_file_deletions, queue_file_deletion
+from .phash import DHASH_SIZE, dhash, index_image, to_signed
+from .tasks import create_thumbnails, granted_thumbnail_sizes, schedule_tile_pyramid, set_processing_status
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+
+def get_pool():
+    """
+    Return the process pool of this consumer, started on first use with THUMBNAIL_BATCH_WORKERS
+    processes, or one per core when it is 0.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.THUMBNAIL_BATCH_WORKERS or os.cpu_count(),
+            mp_context=multiprocessing.get_context('fork'),
+        )
+    return _pool
+
+
+def run_inline(function, *args):
+    """
+    Call a function in this process, returning its outcome as a completed Future.
+    """
+    future = Future()
+    try:
+        future.set_result(function(*args))
+    except Exception as error:
+        future.set_exception(error)
+    return future
+
+
+def render_image(base_image, sizes):
+    """
+    Decode an image once and render its perceptual hash, placeholder, focal point unless already
+    set, and encoded thumbnails cropped around it. Runs in a pool process.
+    """
+    bitmap = decode_image(base_image, sizes or [DHASH_SIZE])
+    focal_point = base_image.focal_point if base_image.focal_x is not None else find_focal_point(bitmap)
+    return {
+        'phash': to_signed(dhash(bitmap)),
+        'placeholder': placeholder_data_uri(bitmap),
+        'focal_point': focal_point,
+        'thumbnails': [(size, encode_image(fit_to_size(bitmap, size, focal_point), base_image.format))
+                       for size in sizes],
+    }
+
+
+def needs_single_rendering(base_image, sizes):
+    """
+    Whether an image has to take the one-image path of create_thumbnails, which reads missing
+    metadata and defers or rejects images over the pixel limit or the per-task memory budget.
+    """
+    if base_image.width is None or base_image.width * base_image.height > settings.THUMBNAIL_MAX_PIXELS:
+        return True
+    return estimate_decode_bytes(base_image, sizes or [DHASH_SIZE]) > settings.THUMBNAIL_TASK_MEMORY_BUDGET
+
+
+def render_thumbnail_batch(images, executor=None):
+    """
+    Render the thumbnails, perceptual hashes and placeholders of many images with `executor`,
+    in this process when it is None, and store them with one bulk insert and one bulk update.
+    Images are claimed as processing beforehand and rendered without holding their row locks;
+    only those still existing when the results are written get them, the thumbnail files of
+    images deleted meanwhile are queued for deletion. Images needing the one-image path are
+    handed to create_thumbnails tasks. Return the number of images rendered without error here.
+
+    Signal handlers do not run for bulk writes, so usage statistics, the perceptual-hash index
+    and image events are updated here.
+    """
+    sizes_by_user, futures, single = {}, [], []
+    existing_sizes = set(Thumbnail.objects.filter(base_image__in=images).values_list('base_image_id', 'thumbnail_size'))
+    for base_image in images:
+        user_id = base_image.uploaded_by_id
+        if user_id not in sizes_by_user:
+            sizes_by_user[user_id] = granted_thumbnail_sizes(user_id)
+        sizes = plan_thumbnail_sizes(base_image, sizes_by_user[user_id]) if base_image.width else []
+        # Thumbnails stored by an earlier render which failed half-way are kept.
+        sizes = [size for size in sizes if (base_image.id, f"{size[0]}x{size[1]}px") not in existing_sizes]
+        if needs_single_rendering(base_image, sizes):
+            single.append(base_image.id)
+            continue
+        submit = executor.submit if executor else run_inline
+        futures.append((base_image, submit(render_image, base_image, sizes)))
+
+    for image_id in single:
+        transaction.on_commit(partial(create_thumbnails.delay, image_id))
+
+    rendered, failed, thumbnails = [], [], []
+    for base_image, future in futures:
+        try:
+            result = future.result()
+        except Exception:
+            logger.exception("Batch rendering of image %s failed.", base_image.id)
+            failed.append(base_image)
+            continue
+        base_image.phash, base_image.placeholder = result['phash'], result['placeholder']
+        base_image.focal_x, base_image.focal_y = result['focal_point']
+        base_image.processing_status = Image.READY
+        image_name = base_image.image.name.split("/")[-1].rsplit(".", 1)[0]
+        extension = output_extension(base_image.format)
+        for size, data in result['thumbnails']:
+            thumbnail = Thumbnail(created_by_id=base_image.uploaded_by_id, base_image=base_image,
+                                  thumbnail_size=f"{size[0]}x{size[1]}px")
+            thumbnail.thumbnail_image.save(f"{image_name}_{size[0]}x{size[1]}.{extension}", ContentFile(data), save=False)
+            thumbnails.append(thumbnail)
+        rendered.append(base_image)
+
+    with transaction.atomic(), batched_file_deletions():
+        existing = set(Image.objects.select_for_update().filter(id__in=[
+            base_image.id for base_image in rendered + failed
+        ]).values_list('id', flat=True))
+        for thumbnail in thumbnails:
+            if thumbnail.base_image_id not in existing:
+                queue_file_deletion(thumbnail.thumbnail_image)
+        rendered = [base_image for base_image in rendered if base_image.id in existing]
+        failed = [base_image for base_image in failed if base_image.id in existing]
+        thumbnails = [thumbnail for thumbnail in thumbnails if thumbnail.base_image_id in existing]
+        Thumbnail.objects.bulk_create(thumbnails)
+        Image.objects.bulk_update(rendered, ['phash', 'placeholder', 'focal_x', 'focal_y', 'processing_status'])
+        for base_image in failed:
+            set_processing_status(base_image, Image.FAILED)
+        for user_id, count in Counter(thumbnail.created_by_id for thumbnail in thumbnails).items():
+            UsageStats.record(user_id, thumbnails=count)
+    for base_image in rendered:
+        index_image(base_image)
+        base_image.forget_cached_detail()
+        publish_image_event(base_image)
+        schedule_tile_pyramid(base_image)
+    return len(rendered)
@@ -0,0 +1,79 @@
+"""
+Routing of read-only request queries to read replicas.
+
+Reads go to a replica only between start_replica_reads() and stop_replica_reads(), which views
+call around safe requests, or inside replica_reads().
+After a write an user is pinned to the primary for REPLICA_STICKY_SECONDS, so they always
+read their own writes; the pins live in Redis and are shared by all web processes.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from .redis_client import run
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def pin_key(user_id):
+    return f"db:primary-pin:{user_id}"
+
+
+def pin_to_primary(user_id):
+    """
+    Route reads of an user to the primary for the next REPLICA_STICKY_SECONDS.
+    """
+    run(lambda client: client.set(pin_key(user_id), 1, px=int(settings.REPLICA_STICKY_SECONDS * 1000)))
+
+
+def is_pinned_to_primary(user_id):
+    """
+    Return whether an user wrote recently. Without Redis every user counts as pinned.
+    """
+    return run(lambda client: client.exists(pin_key(user_id))) != 0
+
+
+def start_replica_reads():
+    """
+    Send the following reads of the current context to replicas; return a token for stop_replica_reads.
+    """
+    return _replica_reads.set(True)
+
+
+def stop_replica_reads(token):
+    _replica_reads.reset(token)
+
+
+@contextmanager
+def replica_reads():
+    token = start_replica_reads()
+    try:
+        yield
+    finally:
+        stop_replica_reads(token)
+
+
+class ReplicaRouter:
+    """
+    Send reads inside `replica_reads()` to a random alias of DATABASE_REPLICAS, everything else,
+    including all writes, migrations and Celery tasks, to the default database.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -0,0 +1,104 @@
+"""
+Image processing events pushed to clients with Server-Sent Events.
+
+Workers publish an event on the Redis channel of the image owner when processing of an
+image finishes; each open event stream of that user is subscribed to the channel.
+"""
+import json
+import logging
+import time
+
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+from rest_framework.renderers import BaseRenderer
+
+from .models import Image
+from .redis_client import run
+
+logger = logging.getLogger(__name__)
+
+
+def channel_name(user_id):
+    return f"images:events:{user_id}"
+
+
+def image_event(image):
+    return {
+        'id': image.id,
+        'slug': image.slug,
+        'processing_status': image.processing_status,
+        'thumbnails': image.thumbnails.count(),
+    }
+
+
+def publish_image_event(image):
+    """
+    Publish the processing status of an image to its owner's channel once the transaction commits.
+    """
+    payload = json.dumps(image_event(image))
+    channel = channel_name(image.uploaded_by_id)
+    transaction.on_commit(lambda: run(lambda client: client.publish(channel, payload)))
+
+
+def format_event(event):
+    return f"event: image\nid: {event['id']}\ndata: {json.dumps(event)}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Renderer accepting `text/event-stream` requests; rendered responses, e.g. errors, become an `error` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f"event: error\ndata: {json.dumps(data)}\n\n".encode()
+
+
+def stream_image_events(user, images):
+    """
+    Generate SSE messages with processing events of the user's images in `images`.
+
+    Images of `images` which are ready or failed are sent right away, the others once an event
+    with either status arrives. The stream ends once every image of `images` has been sent, or
+    after IMAGE_EVENTS_MAX_SECONDS, sending a comment every IMAGE_EVENTS_HEARTBEAT_SECONDS to keep
+    proxies from closing it. No database connection is held while waiting for events.
+    Without Redis the current statuses are sent and the stream ends, so clients fall back to polling.
+    """
+    pubsub = run(lambda client: client.pubsub(ignore_subscribe_messages=True))
+    try:
+        if pubsub is not None:
+            pubsub.subscribe(channel_name(user.id))
+    except redis.RedisError:
+        logger.warning("Could not subscribe to image events of user %s.", user.id, exc_info=True)
+        pubsub = None
+
+    # Subscribed before reading the statuses, so no event between the two can be missed.
+    waiting = set()
+    for image in images:
+        if image.processing_status in image.UNFINISHED_STATUSES and pubsub is not None:
+            waiting.add(image.id)
+        else:
+            yield format_event(image_event(image))
+    if not waiting:
+        return
+    # The stream only waits on Redis from here on; give the database connection back meanwhile.
+    if not connection.in_atomic_block:
+        connection.close()
+
+    deadline = time.monotonic() + settings.IMAGE_EVENTS_MAX_SECONDS
+    try:
+        while waiting and time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=settings.IMAGE_EVENTS_HEARTBEAT_SECONDS)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            event = json.loads(message['data'])
+            if event['id'] in waiting and event['processing_status'] not in Image.UNFINISHED_STATUSES:
+                waiting.discard(event['id'])
+                yield format_event(event)
+    except redis.RedisError:
+        logger.warning("Image events stream of user %s lost Redis.", user.id, exc_info=True)
+    finally:
+        pubsub.close()
@@ -0,0 +1,174 @@
+"""
+Streaming ZIP export of an user's originals, thumbnails and metadata manifest.
+
+The archive is written by ZipStream entry by entry: every entry is followed by a data
+descriptor and its central directory record is spilled to a temporary file, so neither the
+archive, any file, nor the per-entry bookkeeping is ever held in memory, whatever the number
+of images.
+"""
+import json
+import struct
+import tempfile
+import time
+import zlib
+from functools import partial
+
+from .models import Image
+
+CHUNK_SIZE = 64 * 1024
+QUERY_CHUNK_SIZE = 500
+
+# ZIP64 with stored entries only: version 4.5 needed, entries flagged with a data descriptor
+# (bit 3) and UTF-8 names (bit 11), made on Unix with rw-r--r-- permissions.
+ZIP64_VERSION = 45
+ENTRY_FLAGS = 0x0808
+UNIX_SYSTEM = 3
+FILE_ATTRIBUTES = 0o100644 << 16
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+DATA_DESCRIPTOR = struct.Struct('<4sL2Q')
+CENTRAL_DIRECTORY_RECORD = struct.Struct('<4s4B4HL2L5H2L')
+ZIP64_EXTRA = struct.Struct('<2H3Q')
+# Sizes of an entry are only known from its data descriptor, the local header leaves them zero.
+LOCAL_ZIP64_EXTRA = struct.pack('<2H2Q', 1, 16, 0, 0)
+ZIP64_END_RECORD = struct.Struct('<4sQ2H2L4Q')
+ZIP64_END_LOCATOR = struct.Struct('<4sLQL')
+END_RECORD = struct.Struct('<4s4H2LH')
+
+
+def dos_timestamp(timestamp):
+    year, month, day, hour, minute, second = time.localtime(timestamp)[:6]
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+class ZipStream:
+    """
+    Write-only ZIP64 archive of stored entries, generating its bytes as entries are added.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.entries = 0
+        self.time, self.date = dos_timestamp(time.time())
+        self.central_directory = tempfile.TemporaryFile()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.central_directory.close()
+
+    def entry(self, name, chunks):
+        """
+        Generate the bytes of an entry named `name` with the content of the `chunks` iterable.
+        """
+        name = name.encode()
+        header_offset = self.offset
+        yield self.written(LOCAL_HEADER.pack(
+            b'PK\x03\x04', ZIP64_VERSION, 0, ENTRY_FLAGS, 0, self.time, self.date,
+            0, ZIP64_LIMIT, ZIP64_LIMIT, len(name), len(LOCAL_ZIP64_EXTRA),
+        ) + name + LOCAL_ZIP64_EXTRA)
+
+        crc = size = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            yield self.written(chunk)
+        yield self.written(DATA_DESCRIPTOR.pack(b'PK\x07\x08', crc, size, size))
+
+        extra = ZIP64_EXTRA.pack(1, 24, size, size, header_offset)
+        self.central_directory.write(CENTRAL_DIRECTORY_RECORD.pack(
+            b'PK\x01\x02', ZIP64_VERSION, UNIX_SYSTEM, ZIP64_VERSION, 0, ENTRY_FLAGS, 0, self.time, self.date,
+            crc, ZIP64_LIMIT, ZIP64_LIMIT, len(name), len(extra), 0, 0, 0, FILE_ATTRIBUTES, ZIP64_LIMIT,
+        ) + name + extra)
+        self.entries += 1
+
+    def finish(self):
+        """
+        Generate the central directory and the end records closing the archive.
+        """
+        directory_offset = self.offset
+        self.central_directory.seek(0)
+        for chunk in iter(partial(self.central_directory.read, CHUNK_SIZE), b''):
+            yield self.written(chunk)
+        directory_size = self.offset - directory_offset
+
+        end_offset = self.offset
+        yield self.written(ZIP64_END_RECORD.pack(
+            b'PK\x06\x06', ZIP64_END_RECORD.size - 12, ZIP64_VERSION, ZIP64_VERSION, 0, 0,
+            self.entries, self.entries, directory_size, directory_offset,
+        ))
+        yield self.written(ZIP64_END_LOCATOR.pack(b'PK\x06\x07', 0, end_offset, 1))
+        yield self.written(END_RECORD.pack(
+            b'PK\x05\x06', 0, 0, min(self.entries, ZIP64_COUNT_LIMIT), min(self.entries, ZIP64_COUNT_LIMIT),
+            min(directory_size, ZIP64_LIMIT), min(directory_offset, ZIP64_LIMIT), 0,
+        ))
+
+    def written(self, data):
+        self.offset += len(data)
+        return data
+
+
+def original_arcname(image):
+    return f"originals/{image.id}-{image.image.name.split('/')[-1]}"
+
+
+def thumbnail_arcname(image, thumbnail):
+    return f"thumbnails/{image.id}/{thumbnail.thumbnail_image.name.split('/')[-1]}"
+
+
+def manifest_line(image):
+    """
+    Return the NDJSON manifest line describing an image and its thumbnails.
+    """
+    return json.dumps({
+        'id': image.id,
+        'name': image.name,
+        'slug': image.slug,
+        'created_at': image.created_at.isoformat(),
+        'width': image.width,
+        'height': image.height,
+        'format': image.format,
+        'file_size': image.file_size,
+        'original': original_arcname(image),
+        'thumbnails': [
+            {'size': thumbnail.thumbnail_size, 'path': thumbnail_arcname(image, thumbnail)}
+            for thumbnail in image.thumbnails.all()
+        ],
+    }) + '\n'
+
+
+def read_chunks(source):
+    with source:
+        yield from source.chunks(CHUNK_SIZE)
+
+
+def stream_user_export(user):
+    """
+    Generate the bytes of a ZIP archive with the manifest, originals and thumbnails of an user.
+    """
+    images = Image.objects.filter(uploaded_by=user).order_by('id').prefetch_related('thumbnails')
+    missing = []
+    with ZipStream() as archive:
+        yield from archive.entry('manifest.ndjson', (
+            manifest_line(image).encode() for image in images.iterator(chunk_size=QUERY_CHUNK_SIZE)
+        ))
+
+        for image in images.iterator(chunk_size=QUERY_CHUNK_SIZE):
+            # Originals are read from their storage tier without moving cold ones back.
+            files = [(original_arcname(image), image.open_original)]
+            files += [(thumbnail_arcname(image, thumbnail), partial(thumbnail.thumbnail_image.open, 'rb'))
+                      for thumbnail in image.thumbnails.all()]
+            for arcname, open_file in files:
+                try:
+                    source = open_file()
+                except (FileNotFoundError, ValueError):
+                    missing.append(arcname)
+                    continue
+                yield from archive.entry(arcname, read_chunks(source))
+
+        if missing:
+            yield from archive.entry('missing.txt', [('\n'.join(missing) + '\n').encode()])
+        yield from archive.finish()
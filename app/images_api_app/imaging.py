@@ -0,0 +1,263 @@
+import base64
+import math
+from io import BytesIO
+
+from PIL import Image as PILImage, ImageFilter, ImageOps
+
+EXIF_ORIENTATION_TAG = 0x0112
+IMAGE_METADATA_FIELDS = ['width', 'height', 'format', 'file_size', 'orientation', 'color_mode']
+
+# EXIF orientations which rotate the image by 90 or 270 degrees.
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+# Scale denominators libjpeg can decode at directly.
+JPEG_DRAFT_SCALES = (8, 4, 2, 1)
+# Pillow stores most multi-band modes with 4 bytes per pixel.
+SINGLE_BYTE_MODES = {'1', 'L', 'P'}
+# Longer side of the low-quality image placeholder embedded in API responses.
+PLACEHOLDER_SIZE = 20
+# Side of the square tiles of deep-zoom pyramids.
+TILE_SIZE = 256
+# Format thumbnails and tiles are encoded in, by source format; other formats are encoded as PNG.
+OUTPUT_FORMATS = {'JPEG': 'JPEG', 'MPO': 'JPEG', 'PNG': 'PNG', 'WEBP': 'WEBP'}
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+EXTENSION_CONTENT_TYPES = {'jpg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp'}
+# Longer side of the downscaled copy analysed for the focal point.
+FOCAL_ANALYSIS_SIZE = 64
+CENTER = (0.5, 0.5)
+
+
+class ImageTooLarge(Exception):
+    """
+    Raised when an image exceeds the configured pixel limit.
+    """
+
+
+def read_image_metadata(image_file):
+    """
+    Read dimensions, format, byte size, EXIF orientation and color mode of an image.
+    Only the image header is parsed, pixel data is not decoded.
+    """
+    image_file.seek(0)
+    with PILImage.open(image_file) as img:
+        metadata = {
+            'width': img.width,
+            'height': img.height,
+            'format': img.format,
+            'color_mode': img.mode,
+            'orientation': img.getexif().get(EXIF_ORIENTATION_TAG),
+        }
+    image_file.seek(0)
+    metadata['file_size'] = image_file.size
+    return metadata
+
+
+def plan_thumbnail_sizes(image, sizes):
+    """
+    Return the (width, height) sizes worth rendering for an Image, largest first.
+    Sizes the original fits into entirely are skipped, as they would only upscale it.
+    """
+    return sorted(
+        (size for size in sizes if not (image.width <= size[0] and image.height <= size[1])),
+        key=lambda size: size[0] * size[1],
+        reverse=True,
+    )
+
+
+def display_size(image):
+    """
+    Return the (width, height) of an Image once its EXIF orientation is applied.
+    """
+    if image.orientation in TRANSPOSED_ORIENTATIONS:
+        return image.height, image.width
+    return image.width, image.height
+
+
+def required_source_size(image, sizes):
+    """
+    Return the smallest (width, height) of the stored, not yet orientated, bitmap
+    from which every size in `sizes` can be cropped without upscaling.
+    """
+    width, height = display_size(image)
+    scale = max(max(size[0] / width, size[1] / height) for size in sizes)
+    scale = min(scale, 1)
+    required = (math.ceil(width * scale), math.ceil(height * scale))
+    if image.orientation in TRANSPOSED_ORIENTATIONS:
+        required = required[::-1]
+    return required
+
+
+def draft_scale(image, required_size):
+    """
+    Return the JPEG shrink-on-load denominator which still decodes at least `required_size`.
+    Other formats are always decoded at full scale.
+    """
+    if image.format != 'JPEG':
+        return 1
+    for scale in JPEG_DRAFT_SCALES:
+        if image.width / scale >= required_size[0] and image.height / scale >= required_size[1]:
+            return scale
+    return 1
+
+
+def estimate_decode_bytes(image, sizes):
+    """
+    Estimate the memory needed to decode an Image for rendering the given sizes.
+    """
+    scale = draft_scale(image, required_source_size(image, sizes))
+    bytes_per_pixel = 1 if image.color_mode in SINGLE_BYTE_MODES else 4
+    return math.ceil(image.width / scale) * math.ceil(image.height / scale) * bytes_per_pixel
+
+
+def check_pixel_limit(image, max_pixels):
+    """
+    Decompression-bomb check on the header metadata of an Image, before any decode.
+    """
+    if image.width * image.height > max_pixels:
+        raise ImageTooLarge(f"{image.width}x{image.height}px exceeds the limit of {max_pixels} pixels.")
+
+
+def decode_image(image, sizes):
+    """
+    Decode the Image once from its storage tier, shrinking on load where the format allows it,
+    to the smallest bitmap every (width, height) in `sizes` can be cropped from.
+    """
+    with image.open_original() as image_file, PILImage.open(image_file) as img:
+        if img.format == 'JPEG':
+            img.draft(img.mode, required_source_size(image, sizes))
+        if img.getexif().get(EXIF_ORIENTATION_TAG, 1) == 1:
+            # Nothing to transpose: return the decoded bitmap itself rather than a copy of it.
+            img.load()
+            return img
+        bitmap = ImageOps.exif_transpose(img)
+        bitmap.load()
+    return bitmap
+
+
+def find_focal_point(bitmap, size=FOCAL_ANALYSIS_SIZE):
+    """
+    Return the focal point of a bitmap as (x, y) fractions of its width and height: the centroid
+    of the edge map of a downscaled grayscale copy, weighted by squared edge strength so that
+    strong edges of the subject outweigh texture. Featureless bitmaps get the center.
+    """
+    scale = min(size / max(bitmap.width, bitmap.height), 1)
+    preview = bitmap.resize((max(1, round(bitmap.width * scale)), max(1, round(bitmap.height * scale))),
+                            PILImage.BILINEAR, reducing_gap=2.0).convert('L')
+    if preview.width < 3 or preview.height < 3:
+        return CENTER
+    # The edge filter is not defined on the outer pixels.
+    edges = preview.filter(ImageFilter.FIND_EDGES).crop((1, 1, preview.width - 1, preview.height - 1))
+    total = sum_x = sum_y = 0
+    for position, value in enumerate(edges.getdata()):
+        weight = value * value
+        total += weight
+        sum_x += weight * (position % edges.width)
+        sum_y += weight * (position // edges.width)
+    if not total:
+        return CENTER
+    return (sum_x / total + 1.5) / preview.width, (sum_y / total + 1.5) / preview.height
+
+
+def fit_to_size(bitmap, size, focal_point=CENTER):
+    """
+    Scale and crop a bitmap to exactly `size`, never upscaling it. The crop is centered on
+    `focal_point`, given as (x, y) fractions of the bitmap, as far as the bitmap bounds allow.
+    Large reductions go through Image.reduce before resampling.
+    """
+    scale = min(max(size[0] / bitmap.width, size[1] / bitmap.height), 1)
+    box_width, box_height = size[0] / scale, size[1] / scale
+    box_width, box_height = min(box_width, bitmap.width), min(box_height, bitmap.height)
+    left = min(max(focal_point[0] * bitmap.width - box_width / 2, 0), bitmap.width - box_width)
+    top = min(max(focal_point[1] * bitmap.height - box_height / 2, 0), bitmap.height - box_height)
+    target = (max(1, round(box_width * scale)), max(1, round(box_height * scale)))
+    return bitmap.resize(
+        target, PILImage.LANCZOS, box=(left, top, left + box_width, top + box_height), reducing_gap=3.0
+    )
+
+
+def output_format(image_format):
+    """
+    Return the format a bitmap of an original in `image_format` is encoded in.
+    """
+    return OUTPUT_FORMATS.get(image_format, 'PNG')
+
+
+def output_extension(image_format):
+    """
+    Return the file extension of bitmaps encoded from an original in `image_format`.
+    """
+    return FORMAT_EXTENSIONS[output_format(image_format)]
+
+
+def encode_image(bitmap, image_format, quality=85):
+    """
+    Encode a bitmap into bytes in the output format of the original image format.
+    """
+    image_format = output_format(image_format)
+    if image_format == 'JPEG' and bitmap.mode not in ('RGB', 'L', 'CMYK'):
+        bitmap = bitmap.convert('RGB')
+    buffer = BytesIO()
+    bitmap.save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue()
+
+
+def placeholder_data_uri(bitmap, size=PLACEHOLDER_SIZE):
+    """
+    Return a tiny base64 WebP data URI of a bitmap, for painting a blurred preview
+    before the thumbnail is loaded.
+    """
+    preview = bitmap.copy()
+    preview.thumbnail((size, size), PILImage.BILINEAR, reducing_gap=2.0)
+    if preview.mode not in ('RGB', 'RGBA'):
+        preview = preview.convert('RGBA' if 'A' in preview.getbands() else 'RGB')
+    buffer = BytesIO()
+    preview.save(buffer, format='WEBP', quality=40, method=6)
+    return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def build_atlas(bitmaps, cell_size):
+    """
+    Pack bitmaps into a grid of `cell_size` cells, as square as possible.
+    Return the atlas image and the (x, y, width, height) box of every bitmap, in order.
+    """
+    columns = max(1, math.ceil(math.sqrt(len(bitmaps))))
+    rows = max(1, math.ceil(len(bitmaps) / columns))
+    atlas = PILImage.new('RGBA', (columns * cell_size[0], rows * cell_size[1]), (0, 0, 0, 0))
+    boxes = []
+    for position, bitmap in enumerate(bitmaps):
+        x, y = (position % columns) * cell_size[0], (position // columns) * cell_size[1]
+        atlas.paste(bitmap.convert('RGBA'), (x, y))
+        boxes.append((x, y, bitmap.width, bitmap.height))
+    return atlas, boxes
+
+
+def pyramid_levels(width, height):
+    """
+    Return the (width, height) of every DeepZoom level of an image, from 1x1 (level 0) to full size.
+    """
+    max_level = math.ceil(math.log2(max(width, height, 1)))
+    return [
+        (math.ceil(width / 2 ** (max_level - level)), math.ceil(height / 2 ** (max_level - level)))
+        for level in range(max_level + 1)
+    ]
+
+
+def iter_pyramid_tiles(bitmap, tile_size=TILE_SIZE):
+    """
+    Yield (level, column, row, tile) for every tile of the DeepZoom pyramid of a bitmap, full size first.
+
+    Every level is halved from the previous one, which is dropped afterwards, and tiles are cut
+    from one strip of rows at a time, so at most two levels and a strip are alive at once. The
+    full-size bitmap is dropped as well once the next level is built, provided the caller keeps
+    no reference to it, e.g. by passing the result of decode_image directly.
+    """
+    levels = pyramid_levels(*bitmap.size)
+    level_bitmap = bitmap
+    del bitmap
+    for level in range(len(levels) - 1, -1, -1):
+        width, height = levels[level]
+        if level_bitmap.size != (width, height):
+            level_bitmap = level_bitmap.resize((width, height), PILImage.BOX)
+        for top in range(0, height, tile_size):
+            strip = level_bitmap.crop((0, top, width, min(top + tile_size, height)))
+            for left in range(0, width, tile_size):
+                yield level, left // tile_size, top // tile_size, strip.crop((left, 0, min(left + tile_size, width), strip.height))
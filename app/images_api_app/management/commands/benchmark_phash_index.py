@@ -0,0 +1,58 @@
+"""
+Django command to benchmark the perceptual-hash index on synthetic hashes.
+"""
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from images_api_app.phash import HASH_BITS, MultiIndexHashIndex, hamming
+
+
+class Command(BaseCommand):
+    """
+    Compare multi-index hashing search against a linear scan on random 64-bit hashes.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1_000_000, help='Number of hashes in the index.')
+        parser.add_argument('--queries', type=int, default=200, help='Number of search queries.')
+        parser.add_argument('--distance', type=int, default=8, help='Maximum Hamming distance.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        size, distance = options['size'], options['distance']
+        hashes = [rng.getrandbits(HASH_BITS) for _ in range(size)]
+
+        started = time.perf_counter()
+        index = MultiIndexHashIndex()
+        for image_id, value in enumerate(hashes):
+            index.add(image_id, value)
+        self.stdout.write(f"Built index of {size} hashes in {time.perf_counter() - started:.2f}s")
+
+        # Query near-duplicates of indexed hashes so every search has at least one match.
+        queries = []
+        for _ in range(options['queries']):
+            value = hashes[rng.randrange(size)]
+            for bit in rng.sample(range(HASH_BITS), rng.randint(0, distance)):
+                value ^= 1 << bit
+            queries.append(value)
+
+        started = time.perf_counter()
+        mih_results = [index.search(value, distance) for value in queries]
+        mih_seconds = (time.perf_counter() - started) / len(queries)
+
+        scan_queries = queries[:max(1, min(len(queries), 10))]
+        started = time.perf_counter()
+        scan_results = [
+            sorted((d, image_id) for image_id, h in enumerate(hashes) if (d := hamming(value, h)) <= distance)
+            for value in scan_queries
+        ]
+        scan_seconds = (time.perf_counter() - started) / len(scan_queries)
+
+        if mih_results[:len(scan_results)] != scan_results:
+            self.stdout.write(self.style.ERROR('Index results differ from the linear scan!'))
+        self.stdout.write(f"Multi-index search: {mih_seconds * 1000:.3f} ms/query")
+        self.stdout.write(f"Linear scan:        {scan_seconds * 1000:.3f} ms/query")
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: {scan_seconds / mih_seconds:.1f}x"))
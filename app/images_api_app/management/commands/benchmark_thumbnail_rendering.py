@@ -0,0 +1,77 @@
+"""
+Django command to compare the throughput of one-task-per-image and batch thumbnail rendering.
+"""
+import os
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image as PILImage
+
+from images_api_app.batching import get_pool, render_thumbnail_batch
+from images_api_app.imaging import read_image_metadata
+from images_api_app.models import Image, batched_file_deletions
+from images_api_app.tasks import create_thumbnails
+
+
+class Command(BaseCommand):
+    """
+    Render thumbnails of synthetic images of an user once with a create_thumbnails task per image
+    and once with the batch consumer on its process pool, and report images/sec of both modes.
+    The benchmark images are deleted afterwards unless --keep is given.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Username owning the benchmark images.')
+        parser.add_argument('--count', type=int, default=200, help='Number of images rendered by each mode.')
+        parser.add_argument('--width', type=int, default=1024)
+        parser.add_argument('--height', type=int, default=768)
+        parser.add_argument('--batch-size', type=int, default=64)
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark images.')
+
+    def create_images(self, user, content, count, label):
+        metadata, images = read_image_metadata(content), []
+        for number in range(count):
+            image = Image(name=f"Benchmark{number}", uploaded_by=user, **metadata)
+            image.image.save(f"benchmark-{label}-{number}.jpg", content, save=False)
+            image.save()
+            image.slug = f"benchmark{number}-{image.id}"
+            image.save(update_fields=['slug'])
+            images.append(image)
+        return images
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist.")
+
+        buffer = BytesIO()
+        PILImage.effect_noise((options['width'], options['height']), 64).convert('RGB').save(buffer, format='JPEG')
+        content = ContentFile(buffer.getvalue(), name='benchmark.jpg')
+        count = options['count']
+        single_images = self.create_images(user, content, count, 'single')
+        batch_images = self.create_images(user, content, count, 'batch')
+        try:
+            started = time.perf_counter()
+            for image in single_images:
+                create_thumbnails.apply(args=[image.id])
+            single_rate = count / (time.perf_counter() - started)
+
+            pool = get_pool()
+            started = time.perf_counter()
+            for position in range(0, count, options['batch_size']):
+                render_thumbnail_batch(batch_images[position:position + options['batch_size']], pool)
+            batch_rate = count / (time.perf_counter() - started)
+        finally:
+            if not options['keep']:
+                with batched_file_deletions():
+                    Image.objects.filter(id__in=[image.id for image in single_images + batch_images]).delete()
+
+        self.stdout.write(f"One task per image: {single_rate:.1f} images/s")
+        workers = settings.THUMBNAIL_BATCH_WORKERS or os.cpu_count()
+        self.stdout.write(f"Batch on {workers} processes: {batch_rate:.1f} images/s")
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: {batch_rate / single_rate:.1f}x"))
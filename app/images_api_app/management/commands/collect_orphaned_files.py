@@ -0,0 +1,155 @@
+"""
+Django command to delete files under MEDIA_ROOT which no database row references.
+"""
+import hashlib
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from images_api_app.models import ExpiringLink, Image, PendingFileDeletion, Thumbnail
+
+MEDIA_DIRECTORIES = ['images', 'thumbnails', 'expiring', 'tiles']
+REFERENCING_FIELDS = [
+    (Image, 'image'),
+    (Thumbnail, 'thumbnail_image'),
+    (ExpiringLink, 'expiring_image'),
+    (Image, 'tiles_path'),
+    (PendingFileDeletion, 'path'),
+]
+QUERY_CHUNK_SIZE = 10000
+IO_BATCH_SIZE = 1000
+
+
+def path_key(path):
+    """
+    Return a 64-bit digest of a storage path. Referenced paths are kept as these integers
+    instead of strings; a collision can only make the collector keep an orphan.
+    """
+    return int.from_bytes(hashlib.blake2b(path.encode(), digest_size=8).digest(), 'little')
+
+
+def reference_path(relative_path):
+    """
+    Return the path a database row would reference for a stored file: tiles are referenced
+    by their pyramid directory `tiles/ab/cd/<key>`, other files by their own path.
+    """
+    if relative_path.startswith('tiles/'):
+        return '/'.join(relative_path.split('/')[:4])
+    return relative_path
+
+
+def scan_files(directory):
+    """
+    Yield DirEntry objects of all files below `directory`, streaming with os.scandir.
+    """
+    stack = [directory]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            continue
+
+
+class Command(BaseCommand):
+    """
+    Garbage-collect unreferenced files in the images, thumbnails, expiring and tiles directories.
+    Works on the local MEDIA_ROOT of FileSystemStorage.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Keep files modified more recently than this.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be collected.')
+        parser.add_argument('--quarantine', help='Move orphans into this directory instead of deleting them.')
+        parser.add_argument('--workers', type=int, default=8, help='Number of parallel I/O threads.')
+
+    def referenced_paths(self):
+        """
+        Load paths referenced by Image, Thumbnail and ExpiringLink rows, tile pyramids,
+        and those already queued for deletion, in chunked values_list queries.
+        """
+        referenced = set()
+        for model, field in REFERENCING_FIELDS:
+            queryset = model.objects.values_list(field, flat=True)
+            for path in queryset.iterator(chunk_size=QUERY_CHUNK_SIZE):
+                if path:
+                    referenced.add(path_key(path.rstrip('/')))
+        return referenced
+
+    def referenced_now(self, batch):
+        """
+        Return the reference paths of a batch of orphans which rows reference by now, such as
+        files uploaded or moved by migrate_media_layout since the referenced paths were loaded.
+        """
+        paths = {reference_path(relative_path) for _, relative_path, _ in batch}
+        # Tile pyramids are queued for deletion as directories, with a trailing slash.
+        paths.update(f"{path}/" for path in list(paths) if path.startswith('tiles/'))
+        referenced = set()
+        for model, field in REFERENCING_FIELDS:
+            queryset = model.objects.filter(**{f"{field}__in": paths}).values_list(field, flat=True)
+            referenced.update(path.rstrip('/') for path in queryset)
+        return referenced
+
+    def orphans(self, referenced, cutoff):
+        media_root = os.path.abspath(settings.MEDIA_ROOT)
+        for directory in MEDIA_DIRECTORIES:
+            for entry in scan_files(os.path.join(media_root, directory)):
+                relative_path = os.path.relpath(entry.path, media_root).replace(os.sep, '/')
+                if path_key(reference_path(relative_path)) in referenced:
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime < cutoff:
+                    yield entry.path, relative_path, stat.st_size
+
+    def collect(self, orphan, quarantine):
+        path, relative_path, size = orphan
+        try:
+            if quarantine:
+                target = os.path.join(quarantine, relative_path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+            else:
+                os.unlink(path)
+        except FileNotFoundError:
+            return 0
+        return size
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        referenced = self.referenced_paths()
+        self.stdout.write(f"Loaded {len(referenced)} referenced paths.")
+
+        cutoff = time.time() - options['grace_hours'] * 3600
+        orphans = self.orphans(referenced, cutoff)
+        count = reclaimed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                batch = list(islice(orphans, IO_BATCH_SIZE))
+                if not batch:
+                    break
+                # Re-check right before collecting, so rows written during the scan keep their files.
+                fresh = self.referenced_now(batch)
+                batch = [orphan for orphan in batch if reference_path(orphan[1]) not in fresh]
+                if options['dry_run']:
+                    for _, relative_path, size in batch:
+                        self.stdout.write(f"Would collect {relative_path} ({size} bytes)")
+                    sizes = [size for _, _, size in batch]
+                else:
+                    sizes = list(executor.map(lambda orphan: self.collect(orphan, options['quarantine']), batch))
+                count += len(batch)
+                reclaimed += sum(sizes)
+
+        action = 'Would reclaim' if options['dry_run'] else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {reclaimed} bytes in {count} orphaned files ({time.perf_counter() - started:.1f}s)."
+        ))
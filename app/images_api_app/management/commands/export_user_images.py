@@ -0,0 +1,39 @@
+"""
+Django command to export all images of an user to a ZIP archive.
+"""
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from images_api_app.exports import stream_user_export
+
+
+class Command(BaseCommand):
+    """
+    Stream the originals, thumbnails and metadata manifest of an user into a ZIP file.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('output', help="Path of the ZIP file, '-' for stdout.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User \"{options['username']}\" does not exist.")
+
+        if options['output'] == '-':
+            output = sys.stdout.buffer
+        else:
+            output = open(options['output'], 'wb')
+        written = 0
+        try:
+            for chunk in stream_user_export(user):
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        self.stderr.write(self.style.SUCCESS(f"Exported {written} bytes for \"{user.username}\"."))
@@ -0,0 +1,87 @@
+"""
+Django command to move stored media into the hashed fan-out directory layout.
+"""
+import os
+import shutil
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from images_api_app.models import ExpiringLink, Image, Thumbnail
+from images_api_app.paths import hashed_path, is_hashed_path, migration_key
+
+MIGRATED_FIELDS = [
+    (Image, 'image'),
+    (Thumbnail, 'thumbnail_image'),
+    (ExpiringLink, 'expiring_image'),
+]
+
+
+class Command(BaseCommand):
+    """
+    Move files of Image, Thumbnail and ExpiringLink rows to `<prefix>/ab/cd/<hash>.<ext>`
+    and rewrite their paths, batch by batch, while the application keeps serving.
+
+    Every file is first hard-linked (or copied) to its new path, the row is updated only if it
+    still points at the old path, and the old path is removed after the batch commits.
+    New paths are derived from the old ones, so an interrupted run can simply be restarted.
+    Works on the local MEDIA_ROOT of FileSystemStorage.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches.')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def link(self, old_path, new_path):
+        source, target = default_storage.path(old_path), default_storage.path(new_path)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+        # Links and copies keep the old modification time; a fresh one keeps collect_orphaned_files
+        # from taking the new path for an old orphan before the row points at it.
+        os.utime(target)
+
+    def migrate_batch(self, model, field, rows, options):
+        prefix = model._meta.get_field(field).upload_to.prefix
+        moved, obsolete = 0, []
+        with transaction.atomic():
+            for row_id, old_path in rows:
+                if not old_path or is_hashed_path(old_path):
+                    continue
+                new_path = hashed_path(prefix, migration_key(old_path), old_path.rsplit('/', 1)[-1])
+                if options['dry_run']:
+                    self.stdout.write(f"{old_path} -> {new_path}")
+                    continue
+                if not default_storage.exists(old_path) and not default_storage.exists(new_path):
+                    self.stderr.write(f"Missing file {old_path} of {model.__name__} {row_id}, skipped.")
+                    continue
+                if default_storage.exists(old_path):
+                    self.link(old_path, new_path)
+                if model.objects.filter(id=row_id, **{field: old_path}).update(**{field: new_path}):
+                    moved += 1
+                    obsolete.append(old_path)
+        for old_path in obsolete:
+            default_storage.delete(old_path)
+        return moved
+
+    def handle(self, *args, **options):
+        for model, field in MIGRATED_FIELDS:
+            last_id, moved = 0, 0
+            while True:
+                rows = list(
+                    model.objects.filter(id__gt=last_id).order_by('id')
+                    .values_list('id', field)[:options['batch_size']]
+                )
+                if not rows:
+                    break
+                moved += self.migrate_batch(model, field, rows, options)
+                last_id = rows[-1][0]
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+            self.stdout.write(self.style.SUCCESS(f"{model.__name__}: moved {moved} files."))
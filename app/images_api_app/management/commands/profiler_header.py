@@ -0,0 +1,18 @@
+"""
+Django command to print an X-Profile header value which enables profiling of a request.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from images_api_app.profiling import sign_profile_header
+
+
+class Command(BaseCommand):
+    """
+    Sign an X-Profile header value with PROFILER_SIGNING_KEY, valid for PROFILER_HEADER_MAX_AGE seconds.
+    """
+
+    def handle(self, *args, **options):
+        if not settings.PROFILER_SIGNING_KEY:
+            raise CommandError("Set PROFILER_SIGNING_KEY to enable profiling by header.")
+        self.stdout.write(f"X-Profile: {sign_profile_header()}")
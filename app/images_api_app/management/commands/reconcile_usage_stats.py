@@ -0,0 +1,63 @@
+"""
+Django command to rebuild the per-user usage statistics from the Image and Thumbnail tables.
+"""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from images_api_app.models import Image, Thumbnail, UsageStats
+
+STATS_FIELDS = ['image_count', 'thumbnail_count', 'stored_bytes']
+
+
+class Command(BaseCommand):
+    """
+    Recompute UsageStats of all users, batch by batch, and correct rows which drifted.
+
+    Existing rows of a batch are locked before counting, so increments of concurrent uploads
+    wait for the batch and are applied on top of the recomputed values.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def reconcile_batch(self, user_ids):
+        with transaction.atomic():
+            current = {
+                row[0]: row[1:] for row in
+                UsageStats.objects.select_for_update().filter(user_id__in=user_ids)
+                .values_list('user_id', *STATS_FIELDS)
+            }
+            images = {
+                row['uploaded_by_id']: row for row in
+                Image.objects.filter(uploaded_by_id__in=user_ids).values('uploaded_by_id')
+                .annotate(count=Count('id'), size=Sum('file_size')).order_by()
+            }
+            thumbnails = dict(
+                Thumbnail.objects.filter(created_by_id__in=user_ids).values('created_by_id')
+                .annotate(count=Count('id')).order_by().values_list('created_by_id', 'count')
+            )
+            stats = []
+            for user_id in user_ids:
+                image_row = images.get(user_id, {})
+                values = (image_row.get('count', 0), thumbnails.get(user_id, 0), image_row.get('size') or 0)
+                if current.get(user_id) != values:
+                    stats.append(UsageStats(user_id=user_id, **dict(zip(STATS_FIELDS, values))))
+            UsageStats.objects.bulk_create(
+                stats, update_conflicts=True, unique_fields=['user'], update_fields=STATS_FIELDS + ['updated_at']
+            )
+        return len(stats)
+
+    def handle(self, *args, **options):
+        last_id, users, corrected = 0, 0, 0
+        while True:
+            user_ids = list(
+                User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not user_ids:
+                break
+            corrected += self.reconcile_batch(user_ids)
+            users += len(user_ids)
+            last_id = user_ids[-1]
+        self.stdout.write(self.style.SUCCESS(f"Reconciled usage stats of {users} users, corrected {corrected}."))
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images_api_app', '0002_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accounttier',
+            name='max_image_dimension',
+            field=models.PositiveIntegerField(default=10000),
+        ),
+        migrations.AddField(
+            model_name='accounttier',
+            name='max_image_pixels',
+            field=models.PositiveBigIntegerField(default=50000000),
+        ),
+        migrations.AddField(
+            model_name='accounttier',
+            name='max_upload_size',
+            field=models.PositiveBigIntegerField(default=20971520),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images_api_app', '0003_account_tier_upload_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='phash',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['uploaded_by', 'phash'], name='images_api__uploade_2b94b9_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:20
+
+import django.core.validators
+from django.db import migrations, models
+import images_api_app.paths
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images_api_app', '0006_pending_file_deletion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expiringlink',
+            name='expiring_image',
+            field=models.ImageField(upload_to=images_api_app.paths.HashedUploadTo('expiring')),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(upload_to=images_api_app.paths.HashedUploadTo('images'), validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['png', 'jpg', 'jpeg'])]),
+        ),
+        migrations.AlterField(
+            model_name='thumbnail',
+            name='thumbnail_image',
+            field=models.ImageField(upload_to=images_api_app.paths.HashedUploadTo('thumbnails')),
+        ),
+    ]
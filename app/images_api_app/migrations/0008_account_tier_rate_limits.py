@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:25
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images_api_app', '0007_hashed_upload_paths'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accounttier',
+            name='expiring_links_per_minute',
+            field=models.PositiveIntegerField(default=30, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AddField(
+            model_name='accounttier',
+            name='storage_quota',
+            field=models.PositiveBigIntegerField(default=1073741824),
+        ),
+        migrations.AddField(
+            model_name='accounttier',
+            name='uploads_per_minute',
+            field=models.PositiveIntegerField(default=30, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('images_api_app', '0008_account_tier_rate_limits'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='usage_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('image_count', models.BigIntegerField(default=0)),
+                ('thumbnail_count', models.BigIntegerField(default=0)),
+                ('stored_bytes', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'usage stats',
+            },
+        ),
+    ]
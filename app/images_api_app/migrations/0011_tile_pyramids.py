@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images_api_app', '0010_image_processing_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accounttier',
+            name='deep_zoom',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='tiles_path',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:52
+
+from django.db import migrations, models
+
+LIST_FILTER_INDEXES = [
+    models.Index(fields=['uploaded_by', '-id'], name='image_user_id_idx'),
+    models.Index(fields=['uploaded_by', 'created_at'], name='image_user_created_idx'),
+    models.Index(fields=['uploaded_by', 'format'], name='image_user_format_idx'),
+    models.Index(fields=['uploaded_by', 'width', 'height'], name='image_user_size_idx'),
+    models.Index(fields=['uploaded_by', 'processing_status'], name='image_user_status_idx'),
+]
+
+
+def add_indexes(apps, schema_editor):
+    # PostgreSQL builds the indexes without blocking writes to the image table.
+    image = apps.get_model('images_api_app', 'Image')
+    options = {'concurrently': True} if schema_editor.connection.vendor == 'postgresql' else {}
+    for index in LIST_FILTER_INDEXES:
+        schema_editor.add_index(image, index, **options)
+
+
+def remove_indexes(apps, schema_editor):
+    image = apps.get_model('images_api_app', 'Image')
+    options = {'concurrently': True} if schema_editor.connection.vendor == 'postgresql' else {}
+    for index in LIST_FILTER_INDEXES:
+        schema_editor.remove_index(image, index, **options)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('images_api_app', '0011_tile_pyramids'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='image', index=index) for index in LIST_FILTER_INDEXES
+            ],
+            database_operations=[
+                migrations.RunPython(add_indexes, remove_indexes),
+            ],
+        ),
+    ]
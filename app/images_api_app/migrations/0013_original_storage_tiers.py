@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:08
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def start_access_tracking_at_upload(apps, schema_editor):
+    # Existing originals count as last accessed when they were uploaded.
+    apps.get_model('images_api_app', 'Image').objects.update(last_accessed_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images_api_app', '0012_image_list_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='last_accessed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(start_access_tracking_at_upload, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='image',
+            name='storage_tier',
+            field=models.CharField(choices=[('hot', 'Hot'), ('cold', 'Cold')], default='hot', max_length=4),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['storage_tier', 'last_accessed_at'], name='image_tier_accessed_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:14
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images_api_app', '0013_original_storage_tiers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='focal_x',
+            field=models.FloatField(null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)]),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='focal_y',
+            field=models.FloatField(null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)]),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Trigram index serving the case-insensitive prefix and substring filters on name
+# (UPPER(name) LIKE ...) in PostgreSQL; other databases scan the user's images instead.
+#
+# CREATE EXTENSION pg_trgm needs the CREATE privilege on the database (pg_trgm is a trusted
+# extension from PostgreSQL 13 on), or a superuser before that. Where the application role lacks
+# it, have an administrator run `CREATE EXTENSION pg_trgm` first; this migration then only
+# builds the index, concurrently, so uploads keep working while it is built.
+
+from django.db import migrations
+
+
+def create_name_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS image_upper_name_trgm_idx "
+            "ON images_api_app_image USING gin (UPPER(name::text) gin_trgm_ops)"
+        )
+
+
+def drop_name_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS image_upper_name_trgm_idx")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('images_api_app', '0014_image_focal_point'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_name_trigram_index, drop_name_trigram_index),
+    ]
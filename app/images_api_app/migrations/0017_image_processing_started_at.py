@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images_api_app', '0016_image_processing_status_processing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='processing_started_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
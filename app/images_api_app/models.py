@@ -1,10 +1,21 @@
-from django.db import models
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
 from django.contrib.auth.models import User
 
 from django.core.validators import FileExtensionValidator, MinValueValidator, MaxValueValidator
 from .validators import charfield_image_validator
+from .paths import COLD_PATH_PREFIX, HashedUploadTo
+from .imaging import CENTER, read_image_metadata
+from .phash import index_image, unindex_image
+from .ratelimit import release_storage
 
-from django.db.models.signals import post_delete
+from django.db.models.functions import Now
+from django.utils import timezone
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 
@@ -12,19 +23,135 @@ class Image(models.Model):
     """
     Represents an image uploaded by an user.
     """
+    # Pending images wait for a renderer; processing ones are claimed by an inline render or a
+    # create_thumbnails task, so the batch consumer leaves them alone.
+    PENDING, PROCESSING, READY, FAILED = 'pending', 'processing', 'ready', 'failed'
+    PROCESSING_STATUSES = [(PENDING, 'Pending'), (PROCESSING, 'Processing'), (READY, 'Ready'), (FAILED, 'Failed')]
+    UNFINISHED_STATUSES = [PENDING, PROCESSING]
+    HOT, COLD = 'hot', 'cold'
+    STORAGE_TIERS = [(HOT, 'Hot'), (COLD, 'Cold')]
+
     name = models.CharField(max_length=40, validators=[charfield_image_validator])
     slug = models.SlugField()
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='images/%Y/%m/%d/', max_length=100, 
+    image = models.ImageField(upload_to=HashedUploadTo('images'), max_length=100, 
                               validators=[FileExtensionValidator(allowed_extensions=['png', 'jpg', 'jpeg'])])
     created_at = models.DateTimeField(auto_now_add=True)
+    width = models.PositiveIntegerField(null=True, db_index=True)
+    height = models.PositiveIntegerField(null=True, db_index=True)
+    format = models.CharField(max_length=10, blank=True, db_index=True)
+    file_size = models.PositiveBigIntegerField(null=True, db_index=True)
+    orientation = models.PositiveSmallIntegerField(null=True, db_index=True)
+    color_mode = models.CharField(max_length=10, blank=True, db_index=True)
+    phash = models.BigIntegerField(null=True)
+    placeholder = models.TextField(blank=True)
+    processing_status = models.CharField(max_length=10, choices=PROCESSING_STATUSES, default=PENDING, db_index=True)
+    # When the image was last claimed as processing; images processing for longer than
+    # THUMBNAIL_PROCESSING_TIMEOUT lost their renderer and are queued again.
+    processing_started_at = models.DateTimeField(null=True)
+    tiles_path = models.CharField(max_length=100, blank=True)
+    # Where the original file is stored, see storage_tiers. Thumbnails and tiles always stay hot.
+    storage_tier = models.CharField(max_length=4, choices=STORAGE_TIERS, default=HOT)
+    last_accessed_at = models.DateTimeField(default=timezone.now)
+    # Point every thumbnail crop is centered on, as fractions of the orientated image.
+    focal_x = models.FloatField(null=True, validators=[MinValueValidator(0), MaxValueValidator(1)])
+    focal_y = models.FloatField(null=True, validators=[MinValueValidator(0), MaxValueValidator(1)])
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['uploaded_by', 'phash']),
+            # Filters and cursor pagination of the image list, see filters.ImageFilterBackend.
+            # Name searches use a trigram index created in PostgreSQL by migration 0015.
+            models.Index(fields=['uploaded_by', '-id'], name='image_user_id_idx'),
+            models.Index(fields=['uploaded_by', 'created_at'], name='image_user_created_idx'),
+            models.Index(fields=['uploaded_by', 'format'], name='image_user_format_idx'),
+            models.Index(fields=['uploaded_by', 'width', 'height'], name='image_user_size_idx'),
+            models.Index(fields=['uploaded_by', 'processing_status'], name='image_user_status_idx'),
+            models.Index(fields=['storage_tier', 'last_accessed_at'], name='image_tier_accessed_idx'),
+        ]
+
+    def update_metadata(self):
+        """
+        Fill the metadata fields from the header of the stored image file.
+        """
+        for field, value in read_image_metadata(self.image).items():
+            setattr(self, field, value)
+
+    @property
+    def focal_point(self):
+        """
+        The (x, y) focal point of the image, its center until one was computed or set.
+        """
+        if self.focal_x is None or self.focal_y is None:
+            return CENTER
+        return self.focal_x, self.focal_y
+
+    def open_original(self):
+        """
+        Open the original file for reading from the storage tier it is currently stored on.
+        """
+        if self.storage_tier == self.COLD:
+            from .storage_tiers import cold_storage
+            return cold_storage().open(self.image.name, 'rb')
+        return self.image.open('rb')
+
+    def forget_cached_detail(self):
+        """
+        Drop the cached detail response of the image once the current transaction commits.
+        """
+        slug = self.slug
+        transaction.on_commit(lambda: cache.delete(f"image_detail_{slug}"))
+
+@receiver(post_delete, sender=Image)
+def delete_image_file(sender, instance, **kwargs):
+    """
+    Signal handler to queue deletion of associated image file and tile pyramid when an Image instance is deleted.
+    """
+    if instance.storage_tier == Image.COLD:
+        queue_path_deletion(COLD_PATH_PREFIX + instance.image.name)
+    else:
+        queue_file_deletion(instance.image)
+    if instance.tiles_path:
+        queue_path_deletion(instance.tiles_path + '/')
 
 @receiver(post_delete, sender=Image)
-def delete_expiring_link_image(sender, instance, **kwargs):
+def release_image_storage(sender, instance, **kwargs):
     """
-    Signal handler to delete associated image file when an Image instance is deleted.
+    Signal handler to give back the storage quota used by an Image instance once its deletion commits.
     """
-    instance.image.delete(False) 
+    user_id, file_size = instance.uploaded_by_id, instance.file_size
+    transaction.on_commit(lambda: release_storage(user_id, file_size))
+
+@receiver(post_save, sender=Image)
+def record_image_usage(sender, instance, created, **kwargs):
+    """
+    Signal handler to count a new Image instance and its bytes in the usage statistics of its owner.
+    """
+    if created:
+        UsageStats.record(instance.uploaded_by_id, images=1, stored_bytes=instance.file_size or 0)
+
+@receiver(post_delete, sender=Image)
+def forget_image_usage(sender, instance, **kwargs):
+    """
+    Signal handler to remove a deleted Image instance from the usage statistics of its owner.
+    """
+    UsageStats.record(instance.uploaded_by_id, images=-1, stored_bytes=-(instance.file_size or 0))
+
+@receiver(post_save, sender=Image)
+def index_image_phash(sender, instance, **kwargs):
+    """
+    Signal handler to update the loaded perceptual-hash index when an Image instance is saved.
+    """
+    update_fields = kwargs.get('update_fields')
+    if update_fields is None or 'phash' in update_fields:
+        index_image(instance)
+
+@receiver(post_delete, sender=Image)
+def unindex_image_phash(sender, instance, **kwargs):
+    """
+    Signal handler to remove a deleted Image instance from the loaded perceptual-hash index.
+    """
+    unindex_image(instance)
 
 
 class Thumbnail(models.Model):
@@ -33,7 +160,7 @@ class Thumbnail(models.Model):
     """
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     base_image = models.ForeignKey(Image, related_name='thumbnails', on_delete=models.CASCADE)
-    thumbnail_image = models.ImageField(upload_to='thumbnails/%Y/%m/%d/', max_length=100)
+    thumbnail_image = models.ImageField(upload_to=HashedUploadTo('thumbnails'), max_length=100)
     thumbnail_size = models.CharField(max_length=20)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -41,11 +168,26 @@ class Thumbnail(models.Model):
         return f"Thumbnail of {self.base_image.name} {self.thumbnail_size} size"
 
 @receiver(post_delete, sender=Thumbnail)
-def delete_expiring_link_image(sender, instance, **kwargs):
+def delete_thumbnail_file(sender, instance, **kwargs):
+    """
+    Signal handler to queue deletion of associated thumbnail image file when a Thumbnail instance is deleted.
+    """
+    queue_file_deletion(instance.thumbnail_image)
+
+@receiver(post_save, sender=Thumbnail)
+def record_thumbnail_usage(sender, instance, created, **kwargs):
+    """
+    Signal handler to count a new Thumbnail instance in the usage statistics of its creator.
+    """
+    if created:
+        UsageStats.record(instance.created_by_id, thumbnails=1)
+
+@receiver(post_delete, sender=Thumbnail)
+def forget_thumbnail_usage(sender, instance, **kwargs):
     """
-    Signal handler to delete associated thumbnail image file when a Thumbnail instance is deleted.
+    Signal handler to remove a deleted Thumbnail instance from the usage statistics of its creator.
     """
-    instance.thumbnail_image.delete(False) 
+    UsageStats.record(instance.created_by_id, thumbnails=-1)
 
 
 class ThumbnailSize(models.Model):
@@ -68,6 +210,27 @@ class AccountTier(models.Model):
     thumbnail_sizes = models.ManyToManyField(ThumbnailSize)
     link_to_original = models.BooleanField(default=False)
     generate_expiring_links = models.BooleanField(default=False)
+    max_upload_size = models.PositiveBigIntegerField(default=20 * 1024 * 1024)
+    max_image_dimension = models.PositiveIntegerField(default=10000)
+    max_image_pixels = models.PositiveBigIntegerField(default=50_000_000)
+    uploads_per_minute = models.PositiveIntegerField(default=30, validators=[MinValueValidator(1)])
+    expiring_links_per_minute = models.PositiveIntegerField(default=30, validators=[MinValueValidator(1)])
+    storage_quota = models.PositiveBigIntegerField(default=1024 * 1024 * 1024)
+    deep_zoom = models.BooleanField(default=False)
+
+    @classmethod
+    def limits_for_user(cls, user, fields):
+        """
+        Return the most permissive value of each of `fields` among the tiers granted to an user.
+        Users without granted tiers get the field defaults.
+        """
+        limits = {field: cls._meta.get_field(field).default for field in fields}
+        if user is not None and user.is_authenticated:
+            granted = cls.objects.filter(grantedtier__user=user).aggregate(
+                **{field: models.Max(field) for field in fields}
+            )
+            limits.update({field: value for field, value in granted.items() if value is not None})
+        return limits
 
     def __str__(self):
         thumbnail_sizes_str = ', '.join([th.name for th in self.thumbnail_sizes.all()])
@@ -82,7 +245,7 @@ class GrantedTier(models.Model):
     granted_tiers = models.ManyToManyField(AccountTier)
 
     def __str__(self):
-        tier_names = self.granted_tiers.values_list('name', flat=True)
+        tier_names = [tier.name for tier in self.granted_tiers.all()]
         granted_tiers_str = ', '.join(tier_names)
         return f"{self.user.username}'s Granted Tiers: {granted_tiers_str}"
     
@@ -92,7 +255,7 @@ class ExpiringLink(models.Model):
     Represents an expiring link associated with a base image.
     """
     base_image = models.ForeignKey(Image, on_delete=models.CASCADE)
-    expiring_image = models.ImageField(upload_to='expiring/%Y/%m/%d/', max_length=100)
+    expiring_image = models.ImageField(upload_to=HashedUploadTo('expiring'), max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
     seconds_to_expire = models.PositiveBigIntegerField(validators=[MinValueValidator(30), MaxValueValidator(30000)])
 
@@ -101,8 +264,103 @@ class ExpiringLink(models.Model):
 
 
 @receiver(post_delete, sender=ExpiringLink)
-def delete_expiring_link_image(sender, instance, **kwargs):
+def delete_expiring_link_file(sender, instance, **kwargs):
+    """
+    Signal handler to queue deletion of associated expiring link image file when an ExpiringLink instance is deleted.
+    """
+    queue_file_deletion(instance.expiring_image)
+
+
+class PendingFileDeletion(models.Model):
+    """
+    Represents a stored file waiting to be deleted by a background worker.
+    """
+    path = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    def __str__(self):
+        return f"Pending deletion of {self.path}"
+
+
+class UsageStats(models.Model):
+    """
+    Represents the image count, thumbnail count and stored bytes of originals of an user.
+    Maintained incrementally by signal handlers and rebuilt by the reconcile_usage_stats command.
+    """
+    user = models.OneToOneField(User, primary_key=True, related_name='usage_stats', on_delete=models.CASCADE)
+    image_count = models.BigIntegerField(default=0)
+    thumbnail_count = models.BigIntegerField(default=0)
+    stored_bytes = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'usage stats'
+
+    @classmethod
+    def record(cls, user_id, images=0, thumbnails=0, stored_bytes=0):
+        """
+        Atomically add the given deltas to the statistics of an user, creating its row on first increment.
+        Decrements never create a row, so deleting an user does not resurrect its statistics.
+        """
+        changes = {
+            'image_count': models.F('image_count') + images,
+            'thumbnail_count': models.F('thumbnail_count') + thumbnails,
+            'stored_bytes': models.F('stored_bytes') + stored_bytes,
+            'updated_at': Now(),
+        }
+        if cls.objects.filter(user_id=user_id).update(**changes) or min(images, thumbnails, stored_bytes) < 0:
+            return
+        cls.objects.get_or_create(user_id=user_id)
+        cls.objects.filter(user_id=user_id).update(**changes)
+
+    def __str__(self):
+        return f"Usage of user {self.user_id}: {self.image_count} images, {self.thumbnail_count} thumbnails, {self.stored_bytes} bytes"
+
+
+# Paths queued inside the active batched_file_deletions block of this thread.
+_deletion_batch = threading.local()
+
+
+@contextmanager
+def batched_file_deletions():
+    """
+    Collect the paths queued for deletion inside the block and insert them with one bulk insert
+    when it exits, draining the queue once after commit. Nested blocks join the outermost one,
+    and nothing is queued when the block raises.
+    """
+    if getattr(_deletion_batch, 'paths', None) is not None:
+        yield
+        return
+    _deletion_batch.paths = paths = []
+    try:
+        yield
+    finally:
+        _deletion_batch.paths = None
+    if paths:
+        PendingFileDeletion.objects.bulk_create([PendingFileDeletion(path=path) for path in paths],
+                                                batch_size=settings.FILE_DELETION_BATCH_SIZE)
+        from .tasks import schedule_file_deletion_drain
+        schedule_file_deletion_drain()
+
+
+def queue_file_deletion(field_file):
+    """
+    Queue a stored file for deletion in the current transaction and drain the queue once it commits.
+    """
+    if field_file.name:
+        queue_path_deletion(field_file.name)
+
+
+def queue_path_deletion(path):
     """
-    Signal handler to delete associated expiring link image file when an ExpiringLink instance is deleted.
+    Queue a storage path for deletion like queue_file_deletion. Paths ending with a slash are
+    directories, deleted with everything below them.
     """
-    instance.expiring_image.delete(False)
+    paths = getattr(_deletion_batch, 'paths', None)
+    if paths is not None:
+        paths.append(path)
+        return
+    PendingFileDeletion.objects.create(path=path)
+    from .tasks import schedule_file_deletion_drain
+    schedule_file_deletion_drain()
@@ -0,0 +1,28 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ImageCursorPagination(CursorPagination):
+    """
+    Cursor pagination of the image list, newest first. Only used when the request asks for it
+    with `page_size` or `cursor`, so the unpaginated list keeps its shape for existing clients.
+    """
+    ordering = '-id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params and self.page_size_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class AtlasCursorPagination(ImageCursorPagination):
+    """
+    Pages of the image list packed into thumbnail atlases: the same ordering and cursors as the
+    image list, but always paginated and with at most 100 thumbnails per atlas.
+    """
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return CursorPagination.paginate_queryset(self, queryset, request, view)
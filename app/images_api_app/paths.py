@@ -0,0 +1,46 @@
+import hashlib
+import re
+import uuid
+
+from django.utils.deconstruct import deconstructible
+
+HASHED_PATH_PATTERN = re.compile(r'^[a-z]+/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}(\.[a-z0-9]+)?$')
+# Prefix of queued deletions of files on the cold storage, see storage_tiers.
+COLD_PATH_PREFIX = 'cold:'
+
+
+def hashed_path(prefix, key, filename):
+    """
+    Return the fan-out storage path `<prefix>/ab/cd/<key>.<ext>` for a 32-character hex key.
+    """
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    name = f"{key}.{extension}" if extension else key
+    return f"{prefix}/{key[:2]}/{key[2:4]}/{name}"
+
+
+def is_hashed_path(path):
+    return bool(HASHED_PATH_PATTERN.match(path))
+
+
+def migration_key(path):
+    """
+    Deterministic key for moving an existing file, so an interrupted migration can be resumed.
+    """
+    return hashlib.sha1(path.encode()).hexdigest()[:32]
+
+
+@deconstructible
+class HashedUploadTo:
+    """
+    upload_to callable sharding stored files into two levels of hash-prefix directories,
+    so no directory grows beyond a few thousand entries.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def __call__(self, instance, filename):
+        return hashed_path(self.prefix, uuid.uuid4().hex, filename)
+
+    def __eq__(self, other):
+        return isinstance(other, HashedUploadTo) and self.prefix == other.prefix
@@ -1,5 +1,6 @@
 from rest_framework import permissions
-from .models import GrantedTier
+from .models import AccountTier, GrantedTier
+from .ratelimit import get_storage_usage
     
 class CreateExpiringLinkPermission(permissions.BasePermission):
     """
@@ -10,4 +11,18 @@ class CreateExpiringLinkPermission(permissions.BasePermission):
         Check if the user has the necessary tier permissions to generate expiring links.
         """
         return GrantedTier.objects.filter(user=request.user, granted_tiers__generate_expiring_links=True).exists()
-      
\ No newline at end of file
+
+
+class StorageQuotaPermission(permissions.BasePermission):
+    """
+    Custom permission rejecting uploads which would exceed the storage quota of the user's tiers.
+    Uses the declared Content-Length, so the request body is never read for a rejected upload.
+    """
+    message = "Storage quota exceeded."
+
+    def has_permission(self, request, view):
+        if request.method != 'POST':
+            return True
+        quota = AccountTier.limits_for_user(request.user, ['storage_quota'])['storage_quota']
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        return get_storage_usage(request.user.id) + content_length <= quota
@@ -0,0 +1,318 @@
+"""
+Perceptual hashing and near-duplicate search.
+
+Every Image gets a 64-bit difference hash (dHash). Hashes of an user are kept in
+a per-process multi-index hashing (MIH) table: the hash is split into four 16-bit
+substrings and, by the pigeonhole principle, any hash within Hamming distance k
+matches at least one substring within distance k // 4, so only a few buckets
+are probed instead of scanning all hashes.
+"""
+import threading
+from collections import OrderedDict, defaultdict
+from itertools import combinations
+
+from django.conf import settings
+from PIL import Image as PILImage, ImageOps
+
+from .redis_client import run, script
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# The source bitmap for a dHash: one extra column to compare neighbours.
+DHASH_SIZE = (9, 8)
+
+
+def dhash(bitmap):
+    """
+    Return the 64-bit difference hash of a PIL image as an unsigned integer.
+    """
+    pixels = list(bitmap.convert('L').resize(DHASH_SIZE, PILImage.LANCZOS).getdata())
+    value = 0
+    for row in range(DHASH_SIZE[1]):
+        for col in range(DHASH_SIZE[0] - 1):
+            offset = row * DHASH_SIZE[0] + col
+            value = (value << 1) | (pixels[offset] > pixels[offset + 1])
+    return value
+
+
+def hash_image_file(image_file):
+    """
+    Return the dHash of an image file, decoding JPEGs at the smallest draft scale.
+    """
+    with PILImage.open(image_file) as img:
+        img.draft('L', (DHASH_SIZE[0] * 8, DHASH_SIZE[1] * 8))
+        return dhash(ImageOps.exif_transpose(img))
+
+
+def to_signed(value):
+    """
+    Convert an unsigned 64-bit hash to the signed value stored in a BigIntegerField.
+    """
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    """
+    Convert a stored signed 64-bit hash back to its unsigned value.
+    """
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def chunk_neighbours(chunk, radius):
+    """
+    Yield every 16-bit value within Hamming distance `radius` of `chunk`.
+    """
+    for distance in range(radius + 1):
+        for bits in combinations(range(CHUNK_BITS), distance):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            yield flipped
+
+
+class MultiIndexHashIndex:
+    """
+    In-memory multi-index hashing table mapping 64-bit hashes to image ids.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.tables = [defaultdict(set) for _ in range(CHUNKS)]
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @staticmethod
+    def chunks(value):
+        return [(value >> (CHUNK_BITS * i)) & CHUNK_MASK for i in range(CHUNKS)]
+
+    def add(self, image_id, value):
+        self.remove(image_id)
+        self.hashes[image_id] = value
+        for table, chunk in zip(self.tables, self.chunks(value)):
+            table[chunk].add(image_id)
+
+    def remove(self, image_id):
+        value = self.hashes.pop(image_id, None)
+        if value is None:
+            return
+        for table, chunk in zip(self.tables, self.chunks(value)):
+            bucket = table[chunk]
+            bucket.discard(image_id)
+            if not bucket:
+                del table[chunk]
+
+    def search(self, value, distance):
+        """
+        Return (distance, image_id) pairs of hashes within `distance` of `value`, closest first.
+        """
+        radius = distance // CHUNKS
+        candidates = set()
+        for table, chunk in zip(self.tables, self.chunks(value)):
+            for probe in chunk_neighbours(chunk, radius):
+                candidates.update(table.get(probe, ()))
+        matches = ((hamming(value, self.hashes[image_id]), image_id) for image_id in candidates)
+        return sorted(match for match in matches if match[0] <= distance)
+
+
+class UserHashIndex(MultiIndexHashIndex):
+    """
+    Index of one user's images, tracking the version of the user's hashes it reflects.
+    """
+
+    def __init__(self, user_id, version):
+        super().__init__()
+        self.user_id = user_id
+        self.version = version
+        self.lock = threading.Lock()
+
+    def load(self, queryset):
+        for image_id, value in queryset.values_list('id', 'phash').iterator(chunk_size=10000):
+            self.add(image_id, to_unsigned(value))
+
+
+# Appends a change of an user's hashes to its change log under the next version.
+# KEYS: version counter, change log; ARGV: image id, unsigned hash or '-' when removed, log length.
+RECORD_CHANGE_SCRIPT = """
+local version = redis.call('INCR', KEYS[1])
+redis.call('RPUSH', KEYS[2], version .. ' ' .. ARGV[1] .. ' ' .. ARGV[2])
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[3]), -1)
+return version
+"""
+
+# Returns {version, changes after version ARGV[1]...}; no changes when ARGV[1] is -1.
+READ_CHANGES_SCRIPT = """
+local version = tonumber(redis.call('GET', KEYS[1]) or 0)
+local result = {version}
+local since = tonumber(ARGV[1])
+if since < 0 or since >= version then
+    return result
+end
+for _, change in ipairs(redis.call('LRANGE', KEYS[2], 0, -1)) do
+    if tonumber(string.match(change, '^%d+')) > since then
+        table.insert(result, change)
+    end
+end
+return result
+"""
+
+# Least recently used last; bounded by PHASH_INDEX_CACHE_USERS.
+_indexes = OrderedDict()
+# Guards the index and lock registries only; indexes are built under their user's lock.
+_indexes_lock = threading.Lock()
+_user_locks = {}
+
+
+def hashed_images(user_id):
+    from .models import Image
+    return Image.objects.filter(uploaded_by_id=user_id, phash__isnull=False)
+
+
+def version_key(user_id):
+    return f"phash:version:{user_id}"
+
+
+def changes_key(user_id):
+    return f"phash:changes:{user_id}"
+
+
+def read_changes(user_id, since=None):
+    """
+    Return the version of an user's hashes and the (version, image id, hash or None) changes
+    made after version `since`, or None while Redis is unavailable.
+    """
+    result = run(lambda client: script(READ_CHANGES_SCRIPT)(
+        keys=[version_key(user_id), changes_key(user_id)], args=[-1 if since is None else since]
+    ))
+    if result is None:
+        return None
+    changes = []
+    for change in result[1:]:
+        version, image_id, value = change.decode().split()
+        changes.append((int(version), int(image_id), None if value == '-' else int(value)))
+    return int(result[0]), changes
+
+
+def record_change(user_id, image_id, value):
+    """
+    Log a written (`value`) or deleted (None) hash under the next version of the user's hashes,
+    so indexes loaded by other processes apply it. Return the new version, or None while Redis
+    is unavailable.
+    """
+    return run(lambda client: script(RECORD_CHANGE_SCRIPT)(
+        keys=[version_key(user_id), changes_key(user_id)],
+        args=[image_id, '-' if value is None else value, settings.PHASH_CHANGE_LOG_LENGTH],
+    ))
+
+
+def user_lock(user_id):
+    with _indexes_lock:
+        return _user_locks.setdefault(user_id, threading.Lock())
+
+
+def cached_index(user_id):
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is not None:
+            _indexes.move_to_end(user_id)
+        return index
+
+
+def cache_index(index):
+    """
+    Keep an index, dropping the least recently used ones above PHASH_INDEX_CACHE_USERS.
+    """
+    with _indexes_lock:
+        _indexes[index.user_id] = index
+        _indexes.move_to_end(index.user_id)
+        while len(_indexes) > settings.PHASH_INDEX_CACHE_USERS:
+            user_id, _ = _indexes.popitem(last=False)
+            _user_locks.pop(user_id, None)
+
+
+def apply_changes(index, version, changes):
+    """
+    Bring an index to `version` with the logged changes following its own version. Return
+    False when the log does not reach back that far anymore.
+    """
+    if len(changes) != version - index.version or (changes and changes[0][0] != index.version + 1):
+        return False
+    with index.lock:
+        for _, image_id, value in changes:
+            if value is None:
+                index.remove(image_id)
+            else:
+                index.add(image_id, value)
+        index.version = version
+    return True
+
+
+def get_user_index(user_id):
+    """
+    Return the up-to-date hash index of an user, building it on first use.
+
+    Hashes are written by Celery workers and other web processes, which log every hash write
+    and image deletion under a new per-user version in Redis. A loaded index applies the changes
+    logged since its version, and is only rebuilt when it is further behind than the
+    PHASH_CHANGE_LOG_LENGTH changes kept in the log. While Redis is unavailable the loaded index
+    is used as it is. Only the user's own lock is held while building, so other users are never
+    blocked.
+    """
+    with user_lock(user_id):
+        index = cached_index(user_id)
+        changes = read_changes(user_id, None if index is None else index.version)
+        if index is not None and (changes is None or (
+                index.version is not None and apply_changes(index, *changes))):
+            return index
+        index = UserHashIndex(user_id, None if changes is None else changes[0])
+        index.load(hashed_images(user_id))
+        cache_index(index)
+        return index
+
+
+def apply_change(user_id, image_id, value):
+    """
+    Once the current transaction commits, log a written (`value`) or deleted (None) hash of an
+    user. Indexes, this process' included, apply it on next use. When it cannot be logged, it is
+    applied to the index of this process only, which is rebuilt once Redis is back.
+    """
+    from django.db import transaction
+
+    def apply():
+        if record_change(user_id, image_id, value) is not None:
+            return
+        index = cached_index(user_id)
+        if index is None:
+            return
+        with index.lock:
+            if value is None:
+                index.remove(image_id)
+            else:
+                index.add(image_id, value)
+            index.version = None
+
+    transaction.on_commit(apply)
+
+
+def index_image(image):
+    """
+    Log the written hash of an image for the indexes of its owner.
+    """
+    if image.phash is None:
+        return
+    apply_change(image.uploaded_by_id, image.id, to_unsigned(image.phash))
+
+
+def unindex_image(image):
+    """
+    Log the removal of a deleted image from the indexes of its owner.
+    """
+    if image.phash is None:
+        return
+    apply_change(image.uploaded_by_id, image.id, None)
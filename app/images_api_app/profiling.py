@@ -0,0 +1,200 @@
+"""
+Opt-in sampling profiler for requests and Celery tasks of images_api_app.
+
+A background thread samples the stack of the profiled thread every PROFILER_INTERVAL seconds
+and the samples are written as collapsed stacks (`frame;frame;frame count` lines), readable by
+flamegraph.pl and speedscope, into PROFILER_DIRECTORY, which is kept under PROFILER_MAX_BYTES.
+
+A request is profiled when its URL name is in PROFILER_ROUTES, its user id in PROFILER_USERS,
+it carries an X-Profile header signed with PROFILER_SIGNING_KEY (see the profiler_header command),
+or at random with PROFILER_SAMPLE_RATE. A task is profiled when its name is in PROFILER_TASKS
+or at random. When nothing is configured, the cost is a few settings lookups per request.
+Streaming responses are profiled until their body has been sent.
+"""
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.core import signing
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+HEADER_SALT = 'images_api_app.profiling'
+TASK_PREFIX = 'images_api_app.tasks.'
+
+
+class SamplingProfiler:
+    """
+    Sample the stack of the current thread from a daemon thread until stopped.
+    """
+
+    def __init__(self, name, interval):
+        self.name = name
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, name=f"profiler-{name}", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.sampler.start()
+        return self
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def cancel(self):
+        self.stopped.set()
+        self.sampler.join()
+
+    def stop(self):
+        """
+        Stop sampling and write the profile; return its path, or None when nothing was sampled
+        or the profile could not be written. Profiling never fails the profiled request or task.
+        """
+        self.cancel()
+        if not self.stacks:
+            return None
+        try:
+            return write_profile(self.name, self.stacks, time.perf_counter() - self.started)
+        except OSError:
+            logger.warning("Profile of %s could not be written.", self.name, exc_info=True)
+            return None
+
+
+def write_profile(name, stacks, duration):
+    directory = settings.PROFILER_DIRECTORY
+    os.makedirs(directory, exist_ok=True)
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name)[:80]
+    path = os.path.join(directory, f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{duration * 1000:.0f}ms-{safe_name}.folded")
+    with open(path, 'w') as profile:
+        for stack, count in stacks.most_common():
+            profile.write(f"{stack} {count}\n")
+    enforce_size_cap(directory, settings.PROFILER_MAX_BYTES)
+    return path
+
+
+def enforce_size_cap(directory, max_bytes):
+    """
+    Delete the oldest profiles until the directory holds at most `max_bytes`.
+    """
+    profiles = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith('.folded') and entry.is_file():
+                stat = entry.stat()
+                profiles.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in profiles)
+    for _, size, path in sorted(profiles):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def sign_profile_header():
+    return signing.dumps('profile', key=settings.PROFILER_SIGNING_KEY, salt=HEADER_SALT)
+
+
+def has_valid_profile_header(request):
+    value = request.META.get(PROFILE_HEADER)
+    if not value or not settings.PROFILER_SIGNING_KEY:
+        return False
+    try:
+        signing.loads(value, key=settings.PROFILER_SIGNING_KEY, salt=HEADER_SALT,
+                      max_age=settings.PROFILER_HEADER_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def sampled():
+    return settings.PROFILER_SAMPLE_RATE > 0 and random.random() < settings.PROFILER_SAMPLE_RATE
+
+
+def request_profiler(request, route):
+    return SamplingProfiler(f"{request.method}-{route or request.path}", settings.PROFILER_INTERVAL).start()
+
+
+def stop_after_streaming(streaming_content, profiler):
+    try:
+        yield from streaming_content
+    finally:
+        profiler.stop()
+
+
+class ProfilerMiddleware:
+    """
+    Profile requests selected by route, header or sample rate. Requests of PROFILER_USERS are
+    started by UserProfilingMixin once DRF authenticated the user, since the user is not known here.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        profiler = getattr(request, 'profiler', None)
+        if profiler is not None:
+            if response.streaming:
+                response.streaming_content = stop_after_streaming(response.streaming_content, profiler)
+            else:
+                profiler.stop()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        route = request.resolver_match.url_name if request.resolver_match else None
+        if route in settings.PROFILER_ROUTES or sampled() or has_valid_profile_header(request):
+            request.profiler = request_profiler(request, route)
+        return None
+
+
+class UserProfilingMixin:
+    """
+    API view mixin profiling requests of the users in PROFILER_USERS from their authentication on.
+    """
+
+    def perform_authentication(self, request):
+        super().perform_authentication(request)
+        http_request = request._request
+        if (settings.PROFILER_USERS and request.user.id in settings.PROFILER_USERS
+                and getattr(http_request, 'profiler', None) is None):
+            route = http_request.resolver_match.url_name if http_request.resolver_match else None
+            http_request.profiler = request_profiler(http_request, route)
+
+
+_task_profilers = {}
+
+
+@task_prerun.connect
+def start_task_profiler(task_id=None, task=None, **kwargs):
+    if task.name.startswith(TASK_PREFIX) and (task.name in settings.PROFILER_TASKS or sampled()):
+        _task_profilers[task_id] = SamplingProfiler(f"task-{task.name[len(TASK_PREFIX):]}",
+                                                    settings.PROFILER_INTERVAL).start()
+
+
+@task_postrun.connect
+def stop_task_profiler(task_id=None, **kwargs):
+    profiler = _task_profilers.pop(task_id, None)
+    if profiler is not None:
+        profiler.stop()
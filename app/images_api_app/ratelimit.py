@@ -0,0 +1,123 @@
+"""
+Per-user rate limits and storage quotas enforced atomically in Redis with Lua scripts.
+
+When Redis is unreachable the limits fail open for REDIS_RETRY_SECONDS, so an outage of
+the limiter never takes the API down with it.
+"""
+from .redis_client import run, script, unavailable
+
+# KEYS[1] bucket hash; ARGV: refill rate per second, capacity, cost.
+# Returns {allowed, seconds until enough tokens are available}.
+# The clock of Redis is used, so buckets do not depend on the clocks of the web hosts.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+# KEYS[1] usage counter; ARGV: bytes to reserve, quota.
+# Returns -1 when the counter is not seeded yet, 0 when over quota, 1 when reserved.
+RESERVE_BYTES_SCRIPT = """
+local used = redis.call('GET', KEYS[1])
+if not used then
+    return -1
+end
+if tonumber(used) + tonumber(ARGV[1]) > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('INCRBY', KEYS[1], ARGV[1])
+return 1
+"""
+
+RELEASE_BYTES_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('DECRBY', KEYS[1], ARGV[1])
+end
+"""
+
+
+def take_token(scope, user_id, per_minute, cost=1):
+    """
+    Take `cost` tokens from the bucket of an user refilled with `per_minute` tokens per minute.
+    Return (allowed, seconds to wait before retrying).
+    """
+    result = run(lambda client: script(TOKEN_BUCKET_SCRIPT)(
+        keys=[f"ratelimit:{scope}:{user_id}"], args=[per_minute / 60, per_minute, cost]
+    ))
+    if result is None:
+        return True, None
+    return bool(result[0]), float(result[1])
+
+
+def usage_key(user_id):
+    return f"quota:bytes:{user_id}"
+
+
+def seed_storage_usage(user_id):
+    """
+    Initialise the usage counter of an user from the database, once.
+    """
+    from django.db.models import Sum
+    from .models import Image
+
+    used = Image.objects.filter(uploaded_by_id=user_id).aggregate(used=Sum('file_size'))['used'] or 0
+    run(lambda client: client.set(usage_key(user_id), used, nx=True))
+    return used
+
+
+def get_storage_usage(user_id):
+    """
+    Return the stored bytes of an user, or 0 while Redis is unavailable.
+    """
+    used = run(lambda client: client.get(usage_key(user_id)))
+    if used is not None:
+        return int(used)
+    if unavailable():
+        return 0
+    return seed_storage_usage(user_id)
+
+
+def reserve_storage(user_id, size, quota):
+    """
+    Atomically add `size` bytes to the usage of an user unless it would exceed `quota`.
+    """
+    def reserve(client):
+        return script(RESERVE_BYTES_SCRIPT)(keys=[usage_key(user_id)], args=[size, quota])
+
+    result = run(reserve)
+    if result == -1:
+        seed_storage_usage(user_id)
+        result = run(reserve)
+    return result != 0
+
+
+def release_storage(user_id, size):
+    """
+    Give back `size` bytes of an user's usage, e.g. after a failed upload or a deletion.
+    """
+    if size:
+        run(lambda client: script(RELEASE_BYTES_SCRIPT)(keys=[usage_key(user_id)], args=[size]))
+
+
+def reset_storage_usage(user_id):
+    """
+    Drop the usage counter of an user, so it is seeded again from the database.
+    """
+    run(lambda client: client.delete(usage_key(user_id)))
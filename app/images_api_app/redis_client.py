@@ -0,0 +1,70 @@
+"""
+The Redis client shared by rate limits, quotas, events, replica pins, token revocations and
+the other Redis-backed features.
+
+Each caller decides what an outage means for it. By default `run` fails open: after Redis failed
+to answer, commands are skipped for REDIS_RETRY_SECONDS and return `default`, so optional work
+never holds requests up. Callers which must not be skipped pass `fail_closed=True`: their
+commands are always attempted and raise RedisUnavailable when Redis does not answer.
+"""
+import logging
+import time
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_scripts = {}
+_unavailable_until = 0
+
+
+class RedisUnavailable(Exception):
+    pass
+
+
+def get_redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return _client
+
+
+def script(source):
+    """
+    Return a registered Lua script, executed with EVALSHA after its first call.
+    """
+    if source not in _scripts:
+        _scripts[source] = get_redis().register_script(source)
+    return _scripts[source]
+
+
+def unavailable():
+    return time.monotonic() < _unavailable_until
+
+
+def run(command, default=None, fail_closed=False):
+    """
+    Run a Redis command. Failing open, return `default` while Redis is unavailable; failing
+    closed, raise RedisUnavailable when the command itself fails.
+    """
+    global _unavailable_until
+    if unavailable() and not fail_closed:
+        return default
+    try:
+        return command(get_redis())
+    except redis.RedisError as error:
+        if not unavailable():
+            logger.warning(
+                "Redis is unavailable, skipping optional Redis commands for %s seconds.",
+                settings.REDIS_RETRY_SECONDS, exc_info=True,
+            )
+        _unavailable_until = time.monotonic() + settings.REDIS_RETRY_SECONDS
+        if fail_closed:
+            raise RedisUnavailable() from error
+        return default
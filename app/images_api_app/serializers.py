@@ -1,5 +1,8 @@
+from django.urls import reverse
 from rest_framework import serializers
 from .models import Image, Thumbnail, ExpiringLink
+from .imaging import IMAGE_METADATA_FIELDS
+from .storage_tiers import record_original_accesses
 
 
 class ThumbnailSerializer(serializers.ModelSerializer):
@@ -29,8 +32,8 @@ class ImageSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Image
-        fields = ['id', 'name', 'slug', 'uploaded_by', 'image', 'created_at', 'thumbnails']
-        read_only_fields = ['uploaded_by', 'slug'] 
+        fields = ['id', 'name', 'slug', 'uploaded_by', 'image', 'created_at', 'thumbnails', 'placeholder', 'processing_status', 'focal_x', 'focal_y'] + IMAGE_METADATA_FIELDS
+        read_only_fields = ['uploaded_by', 'slug', 'placeholder', 'processing_status', 'focal_x', 'focal_y'] + IMAGE_METADATA_FIELDS
     
     def to_representation(self, instance):
         """
@@ -44,6 +47,17 @@ class ImageSerializer(serializers.ModelSerializer):
         return representation
 
 
+class ImageLinkToOriginalListSerializer(serializers.ListSerializer):
+    """
+    List serializer recording an access of every original it links to, with one Redis command.
+    """
+
+    def to_representation(self, data):
+        representation = super(ImageLinkToOriginalListSerializer, self).to_representation(data)
+        record_original_accesses([image['id'] for image in representation])
+        return representation
+
+
 class ImageLinkToOriginalSerializer(serializers.ModelSerializer):
     """
     Serializer for the Image model with additional fields for link-to-original view.
@@ -52,17 +66,39 @@ class ImageLinkToOriginalSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Image
-        fields = ['id', 'name', 'slug', 'uploaded_by', 'image', 'created_at', 'thumbnails']    
-        read_only_fields = ['uploaded_by', 'slug']  
+        list_serializer_class = ImageLinkToOriginalListSerializer
+        fields = ['id', 'name', 'slug', 'uploaded_by', 'image', 'created_at', 'thumbnails', 'placeholder', 'processing_status', 'focal_x', 'focal_y'] + IMAGE_METADATA_FIELDS
+        read_only_fields = ['uploaded_by', 'slug', 'placeholder', 'processing_status', 'focal_x', 'focal_y'] + IMAGE_METADATA_FIELDS
     
     def to_representation(self, instance):
         """
         Modify the representation of Image instances to include the username of the creator in place of id.
+        Originals link to the view serving them, which tracks their accesses and moves cold ones back
+        to the hot storage, so links handed out keep working whichever tier the original is on.
+        Handing out the link counts as an access of the original as well.
         """
         representation = super(ImageLinkToOriginalSerializer, self).to_representation(instance)
         representation['uploaded_by'] = instance.uploaded_by.username
+        request = self.context.get('request')
+        if request is not None:
+            representation['image'] = request.build_absolute_uri(reverse('image-original', kwargs={'slug': instance.slug}))
+        if not isinstance(self.parent, ImageLinkToOriginalListSerializer):
+            record_original_accesses([instance.id])
         return representation
     
+class ImageFocalPointSerializer(serializers.ModelSerializer):
+    """
+    Serializer for setting the focal point of an image, as fractions of its width and height.
+    """
+    focal_x = serializers.FloatField(min_value=0, max_value=1)
+    focal_y = serializers.FloatField(min_value=0, max_value=1)
+
+    class Meta:
+        model = Image
+        fields = ['slug', 'focal_x', 'focal_y', 'processing_status']
+        read_only_fields = ['slug', 'processing_status']
+
+
 class ExpiringLinkSerializer(serializers.ModelSerializer):
     """
     Serializer for the ExpiringLink model.
@@ -0,0 +1,140 @@
+"""
+Hot/cold storage tiering of originals.
+
+Originals are uploaded to the hot default storage. Their accesses are sampled into a Redis hash
+and flushed to Image.last_accessed_at in batches, and originals not accessed for
+COLD_STORAGE_AFTER_DAYS days are moved to the cheaper storage at COLD_STORAGE_ROOT under the
+same name. Serving an original moves it back to the hot storage first. Thumbnails, tiles and
+metadata always stay hot.
+"""
+import random
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Image, PendingFileDeletion, queue_path_deletion
+from .paths import COLD_PATH_PREFIX
+from .redis_client import run, script
+
+ACCESS_BUFFER_KEY = 'original_accesses'
+
+# KEYS[1] access buffer hash of image id -> timestamp. Returns and clears it atomically.
+TAKE_ACCESSES_SCRIPT = """
+local accesses = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return accesses
+"""
+
+
+def tiering_enabled():
+    return bool(settings.COLD_STORAGE_ROOT)
+
+
+def cold_storage():
+    return FileSystemStorage(location=settings.COLD_STORAGE_ROOT)
+
+
+def record_original_access(image_id):
+    """
+    Buffer an access of an original in Redis for ORIGINAL_ACCESS_SAMPLE_RATE of the calls.
+    Repeated accesses of an image only overwrite its timestamp, so the buffer stays small.
+    """
+    record_original_accesses([image_id])
+
+
+def record_original_accesses(image_ids):
+    """
+    Buffer accesses of many originals like record_original_access, with one Redis command.
+    """
+    if not tiering_enabled():
+        return
+    sampled = [image_id for image_id in image_ids if random.random() < settings.ORIGINAL_ACCESS_SAMPLE_RATE]
+    if sampled:
+        accessed_at = int(time.time())
+        run(lambda client: client.hset(ACCESS_BUFFER_KEY, mapping=dict.fromkeys(sampled, accessed_at)))
+
+
+def flush_original_accesses():
+    """
+    Write the buffered accesses to Image.last_accessed_at with bulk updates.
+    Return the number of images updated.
+    """
+    accesses = run(lambda client: script(TAKE_ACCESSES_SCRIPT)(keys=[ACCESS_BUFFER_KEY]))
+    if not accesses:
+        return 0
+    images = [
+        Image(id=int(image_id), last_accessed_at=datetime.fromtimestamp(int(timestamp), tz=dt_timezone.utc))
+        for image_id, timestamp in zip(accesses[::2], accesses[1::2])
+    ]
+    Image.objects.bulk_update(images, ['last_accessed_at'], batch_size=settings.COLD_STORAGE_BATCH_SIZE)
+    return len(images)
+
+
+def demote_original(image):
+    """
+    Move the original of an image to the cold storage. Return whether it was moved.
+
+    The cold copy is written before the row is switched, and the hot file is deleted
+    through the deletion queue once the switch commits.
+    """
+    name, cold = image.image.name, cold_storage()
+    hot = image.image.storage
+    with transaction.atomic():
+        # A cold copy left by an earlier restore may still be queued for deletion.
+        PendingFileDeletion.objects.filter(path=COLD_PATH_PREFIX + name).delete()
+        if not hot.exists(name):
+            return False
+        if not cold.exists(name):
+            with hot.open(name, 'rb') as source:
+                cold.save(name, source)
+        if not Image.objects.filter(id=image.id, storage_tier=Image.HOT).update(storage_tier=Image.COLD):
+            return False
+        queue_path_deletion(name)
+    image.storage_tier = Image.COLD
+    # Cached details link to the hot file.
+    cache.delete(f"image_detail_{image.slug}")
+    return True
+
+
+def restore_original(image):
+    """
+    Move the original of an image back to the hot storage if it is cold.
+
+    The hot file may still be queued for deletion by the demotion; the queued deletion is
+    dropped first, waiting for a drain which already locked it, before the hot file is checked.
+    """
+    if image.storage_tier != Image.COLD:
+        return
+    name, hot = image.image.name, image.image.storage
+    with transaction.atomic():
+        PendingFileDeletion.objects.filter(path=name).delete()
+        if not hot.exists(name):
+            with cold_storage().open(name, 'rb') as source:
+                hot.save(name, source)
+        if Image.objects.filter(id=image.id, storage_tier=Image.COLD).update(storage_tier=Image.HOT):
+            queue_path_deletion(COLD_PATH_PREFIX + name)
+    image.storage_tier = Image.HOT
+
+
+def demote_idle_originals():
+    """
+    Move originals of processed images not accessed for COLD_STORAGE_AFTER_DAYS days to the
+    cold storage, in batches of COLD_STORAGE_BATCH_SIZE. Return the number of originals moved.
+    """
+    if not tiering_enabled():
+        return 0
+    flush_original_accesses()
+    cutoff = timezone.now() - timedelta(days=settings.COLD_STORAGE_AFTER_DAYS)
+    idle = Image.objects.filter(storage_tier=Image.HOT, last_accessed_at__lt=cutoff, processing_status=Image.READY)
+    last_id, moved = 0, 0
+    while True:
+        batch = list(idle.filter(id__gt=last_id).order_by('id')[:settings.COLD_STORAGE_BATCH_SIZE])
+        if not batch:
+            return moved
+        moved += sum(demote_original(image) for image in batch)
+        last_id = batch[-1].id
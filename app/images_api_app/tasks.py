@@ -1,30 +1,484 @@
-from .models import Thumbnail, GrantedTier, Image, ExpiringLink
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+from functools import partial
+
+from .models import (Thumbnail, GrantedTier, Image, ExpiringLink, PendingFileDeletion, UsageStats, AccountTier,
+                     queue_path_deletion)
 from celery import shared_task
-from easy_thumbnails.files import get_thumbnailer
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.utils import timezone
+from .imaging import (IMAGE_METADATA_FIELDS, ImageTooLarge, check_pixel_limit, decode_image, display_size, encode_image,
+                      estimate_decode_bytes, find_focal_point, fit_to_size, iter_pyramid_tiles, output_extension,
+                      placeholder_data_uri, plan_thumbnail_sizes)
+from .phash import DHASH_SIZE, dhash, to_signed
+from .events import publish_image_event
+from .paths import COLD_PATH_PREFIX, hashed_path
+from .redis_client import run
+from . import storage_tiers
+
+logger = logging.getLogger(__name__)
+
+# Bounds the uploads of this process rendering thumbnails inline at the same time. Only threaded
+# gunicorn workers serve concurrent uploads; a sync worker renders at most one image inline.
+_inline_slots = threading.BoundedSemaphore(settings.THUMBNAIL_INLINE_CONCURRENCY)
+
+# Set in Redis while a batch consumer is queued, shared by all web processes; expires in case
+# its worker is lost.
+THUMBNAIL_BATCH_QUEUED_KEY = 'thumbnails:batch-queued'
+THUMBNAIL_BATCH_QUEUED_TIMEOUT = 300
 
 
 @shared_task()
-def create_thumbnails(user_id):
+def create_thumbnails(image_id, deferred=False):
     """
-    Celery task to create thumbnails for the last uploaded image of an user based on their granted tiers.
+    Celery task to create thumbnails, the perceptual hash and the placeholder of an uploaded image.
     """
-    base_image = Image.objects.filter(uploaded_by__id=user_id).last()
-    user_tiers = GrantedTier.objects.filter(user__id=user_id).first()
+    base_image = Image.objects.get(id=image_id)
+    mark_processing(base_image)
+    try:
+        generate_thumbnails(base_image, deferred=deferred)
+    except Exception:
+        set_processing_status(base_image, Image.FAILED)
+        raise
 
-    sizes = set()
-    for tier in user_tiers.granted_tiers.all():
-        sizes.update((thumbnail_size.width, thumbnail_size.height) for thumbnail_size in tier.thumbnail_sizes.all())
 
+def set_processing_status(base_image, processing_status):
+    """
+    Store the processing status of an image, drop its cached detail and notify its owner's event streams.
+    """
+    base_image.processing_status = processing_status
+    base_image.save(update_fields=['processing_status'])
+    base_image.forget_cached_detail()
+    publish_image_event(base_image)
+
+
+def mark_processing(base_image):
+    """
+    Mark an image as processing from now on, so it is queued again if its renderer is lost.
+    """
+    base_image.processing_status, base_image.processing_started_at = Image.PROCESSING, timezone.now()
+    base_image.save(update_fields=['processing_status', 'processing_started_at'])
+    base_image.forget_cached_detail()
+
+
+def generate_thumbnails(base_image, deferred=False):
+    """
+    Create thumbnails, the perceptual hash and the placeholder of an image based on the granted
+    tiers of its owner. Shared by the Celery task and the inline path of schedule_thumbnails.
+    The focal point is found once on the decoded bitmap, unless already set, and every crop is
+    centered on it.
+
+    The pixel limit is checked on the stored header metadata before anything is decoded.
+    Images whose decode would exceed the per-task memory budget are deferred to
+    THUMBNAIL_LARGE_QUEUE when it is configured, otherwise they are rejected.
+    The processing status ends as ready, or failed for rejected images. Sizes the image already
+    has a thumbnail of are skipped, so a render retried after a partial failure adds no duplicates.
+    """
+    image_id = base_image.id
+    if base_image.width is None:
+        base_image.update_metadata()
+        base_image.save(update_fields=IMAGE_METADATA_FIELDS)
+        UsageStats.record(base_image.uploaded_by_id, stored_bytes=base_image.file_size)
+
+    sizes = plan_thumbnail_sizes(base_image, granted_thumbnail_sizes(base_image.uploaded_by_id))
+    # Images too small for any thumbnail are still decoded for their perceptual hash.
+    decode_sizes = sizes or [DHASH_SIZE]
+
+    try:
+        check_pixel_limit(base_image, settings.THUMBNAIL_MAX_PIXELS)
+    except ImageTooLarge as error:
+        logger.warning("Rejected thumbnails of image %s: %s", image_id, error)
+        set_processing_status(base_image, Image.FAILED)
+        return
+
+    decode_bytes = estimate_decode_bytes(base_image, decode_sizes)
+    if decode_bytes > settings.THUMBNAIL_TASK_MEMORY_BUDGET and not deferred:
+        if settings.THUMBNAIL_LARGE_QUEUE:
+            create_thumbnails.apply_async(args=[image_id], kwargs={'deferred': True}, queue=settings.THUMBNAIL_LARGE_QUEUE)
+        else:
+            logger.warning("Rejected thumbnails of image %s: decode needs %s bytes.", image_id, decode_bytes)
+            set_processing_status(base_image, Image.FAILED)
+        return
+
+    image_name = base_image.image.name.split("/")[-1].rsplit(".", 1)[0]
+    extension = output_extension(base_image.format)
+    bitmap = decode_image(base_image, decode_sizes)
+    base_image.phash = to_signed(dhash(bitmap))
+    base_image.placeholder = placeholder_data_uri(bitmap)
+    if base_image.focal_x is None:
+        base_image.focal_x, base_image.focal_y = find_focal_point(bitmap)
+    base_image.save(update_fields=['phash', 'placeholder', 'focal_x', 'focal_y'])
+
+    existing_sizes = set(base_image.thumbnails.values_list('thumbnail_size', flat=True))
     for size in sizes:
-        thumbnailer = get_thumbnailer(base_image.image)
-        th = thumbnailer.get_thumbnail({'size': size, 'crop': True})
         thumbnail_size = f"{size[0]}x{size[1]}px"
-        Thumbnail.objects.create(created_by_id=user_id, base_image=base_image, thumbnail_image=str(th), thumbnail_size=thumbnail_size)
+        if thumbnail_size in existing_sizes:
+            continue
+        thumbnail = Thumbnail(created_by_id=base_image.uploaded_by_id, base_image=base_image, thumbnail_size=thumbnail_size)
+        thumbnail.thumbnail_image.save(
+            f"{image_name}_{size[0]}x{size[1]}.{extension}",
+            ContentFile(encode_image(fit_to_size(bitmap, size, base_image.focal_point), base_image.format)),
+        )
+    set_processing_status(base_image, Image.READY)
+    schedule_tile_pyramid(base_image)
      
 
+def granted_thumbnail_sizes(user_id):
+    """
+    Return the set of (width, height) thumbnail sizes offered by the granted tiers of an user.
+    """
+    user_tiers = GrantedTier.objects.filter(user__id=user_id).first()
+    sizes = set()
+    for tier in user_tiers.granted_tiers.all():
+        sizes.update((thumbnail_size.width, thumbnail_size.height) for thumbnail_size in tier.thumbnail_sizes.all())
+    return sizes
+
+
+def schedule_thumbnails(base_image):
+    """
+    Render thumbnails of small images inline, skipping the Celery round trip, and offload the rest.
+
+    An image is rendered inline when its pixel count is at most THUMBNAIL_INLINE_MAX_PIXELS and
+    one of the THUMBNAIL_INLINE_CONCURRENCY inline slots of this process is free. Return True
+    when the thumbnails were rendered inline. Offloaded images go to the batch consumer when
+    THUMBNAIL_BATCH_QUEUE is configured, otherwise to a create_thumbnails task each.
+    """
+    pixels = (base_image.width or 0) * (base_image.height or 0)
+    if 0 < pixels <= settings.THUMBNAIL_INLINE_MAX_PIXELS and _inline_slots.acquire(blocking=False):
+        try:
+            if not claim_for_rendering(base_image):
+                return False
+            generate_thumbnails(base_image)
+            return True
+        except Exception:
+            # No event: streams keep waiting for the terminal status of the offloaded render.
+            logger.exception("Inline thumbnails of image %s failed, offloading to Celery.", base_image.id)
+            base_image.processing_status = Image.PENDING
+            base_image.save(update_fields=['processing_status'])
+            base_image.forget_cached_detail()
+        finally:
+            _inline_slots.release()
+    if settings.THUMBNAIL_BATCH_QUEUE:
+        schedule_thumbnail_batch()
+    else:
+        create_thumbnails.delay(base_image.id)
+    return False
+
+
+def claim_for_rendering(base_image):
+    """
+    Mark a pending image as processing, so the batch consumer does not render it as well.
+    Return whether the image was claimed; it is not when a consumer has rendered it meanwhile.
+    """
+    started_at = timezone.now()
+    if not Image.objects.filter(id=base_image.id, processing_status=Image.PENDING).update(
+            processing_status=Image.PROCESSING, processing_started_at=started_at):
+        return False
+    base_image.processing_status, base_image.processing_started_at = Image.PROCESSING, started_at
+    base_image.forget_cached_detail()
+    return True
+
+
+def _queue_thumbnail_batch_after_commit():
+    # The consumer clears the flag before it scans, so images committed later queue the next one.
+    # Without Redis every upload queues a consumer; SKIP LOCKED keeps them from rendering an image twice.
+    queued = run(lambda client: bool(client.set(THUMBNAIL_BATCH_QUEUED_KEY, 1, nx=True,
+                                                ex=THUMBNAIL_BATCH_QUEUED_TIMEOUT)))
+    if queued is not False:
+        render_pending_thumbnails.apply_async(queue=settings.THUMBNAIL_BATCH_QUEUE)
+
+
+def schedule_thumbnail_batch():
+    """
+    Queue the batch consumer once the current transaction commits, unless one is queued already,
+    so the images uploaded meanwhile are rendered together.
+    """
+    transaction.on_commit(_queue_thumbnail_batch_after_commit)
+
+
+@shared_task()
+def render_pending_thumbnails():
+    """
+    Celery task rendering all pending images in batches of THUMBNAIL_BATCH_SIZE on a process pool.
+
+    Each batch is claimed as processing in a short transaction locking its rows with SKIP LOCKED,
+    so concurrent consumers never render the same image, and rendered once it has committed, so
+    focal point changes and deletions of its images are not blocked meanwhile. Images claimed
+    as processing by an inline render or a create_thumbnails task are skipped.
+    Prefork children cannot start a process pool, so THUMBNAIL_BATCH_QUEUE must be consumed
+    by a worker with the solo pool. Return the number of images rendered.
+    """
+    from .batching import get_pool, render_thumbnail_batch
+
+    run(lambda client: client.delete(THUMBNAIL_BATCH_QUEUED_KEY))
+    last_id, rendered = 0, 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                Image.objects
+                .select_for_update(skip_locked=True)
+                .filter(id__gt=last_id, processing_status=Image.PENDING)
+                .order_by('id')[:settings.THUMBNAIL_BATCH_SIZE]
+            )
+            if not batch:
+                return rendered
+            started_at = timezone.now()
+            Image.objects.filter(id__in=[base_image.id for base_image in batch]).update(
+                processing_status=Image.PROCESSING, processing_started_at=started_at)
+            for base_image in batch:
+                base_image.processing_status, base_image.processing_started_at = Image.PROCESSING, started_at
+                base_image.forget_cached_detail()
+        rendered += render_thumbnail_batch(batch, get_pool())
+        last_id = batch[-1].id
+
+
+@shared_task()
+def requeue_stale_thumbnails():
+    """
+    Periodic Celery task queueing again the images processing for longer than
+    THUMBNAIL_PROCESSING_TIMEOUT, whose renderer was lost with its worker. Return their number.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.THUMBNAIL_PROCESSING_TIMEOUT)
+    with transaction.atomic():
+        stale = list(
+            Image.objects
+            .select_for_update(skip_locked=True)
+            .filter(models.Q(processing_started_at__lt=cutoff) | models.Q(processing_started_at__isnull=True),
+                    processing_status=Image.PROCESSING)
+        )
+        Image.objects.filter(id__in=[base_image.id for base_image in stale]).update(
+            processing_status=Image.PENDING, processing_started_at=None)
+        for base_image in stale:
+            logger.warning("Thumbnails of image %s were not rendered in time, queueing them again.", base_image.id)
+            base_image.forget_cached_detail()
+            if not settings.THUMBNAIL_BATCH_QUEUE:
+                transaction.on_commit(partial(create_thumbnails.delay, base_image.id))
+        if stale and settings.THUMBNAIL_BATCH_QUEUE:
+            schedule_thumbnail_batch()
+    return len(stale)
+
+
+def schedule_tile_pyramid(base_image):
+    """
+    Queue the deep-zoom tile pyramid of an image of at least TILE_PYRAMID_MIN_PIXELS pixels
+    when a tier of its owner offers deep zoom. Large images go to THUMBNAIL_LARGE_QUEUE when configured.
+    Images re-rendering their thumbnails keep their existing pyramid.
+    """
+    if base_image.tiles_path or (base_image.width or 0) * (base_image.height or 0) < settings.TILE_PYRAMID_MIN_PIXELS:
+        return
+    if not AccountTier.objects.filter(grantedtier__user_id=base_image.uploaded_by_id, deep_zoom=True).exists():
+        return
+    if settings.THUMBNAIL_LARGE_QUEUE:
+        create_tile_pyramid.apply_async(args=[base_image.id], kwargs={'deferred': True},
+                                        queue=settings.THUMBNAIL_LARGE_QUEUE)
+    else:
+        create_tile_pyramid.delay(base_image.id)
+
+
+@shared_task()
+def create_tile_pyramid(image_id, deferred=False):
+    """
+    Celery task to build the DeepZoom pyramid of TILE_SIZE tiles of an image.
+
+    Tiles are encoded and stored as they are cut, into a new directory which replaces the
+    previous pyramid only once complete, so viewers never see a partial pyramid.
+    Each level is built from the previous one and the full-size bitmap is released once the
+    next level exists, so memory peaks at the full-size decode plus a quarter of it for the
+    next level. That peak is held to the per-task memory budget like thumbnails: pyramids
+    over it are deferred to THUMBNAIL_LARGE_QUEUE when it is configured, otherwise rejected.
+    """
+    base_image = Image.objects.get(id=image_id)
+    try:
+        check_pixel_limit(base_image, settings.THUMBNAIL_MAX_PIXELS)
+    except ImageTooLarge as error:
+        logger.warning("Rejected tile pyramid of image %s: %s", image_id, error)
+        return
+
+    full_size = [display_size(base_image)]
+    decode_bytes = estimate_decode_bytes(base_image, full_size)
+    decode_bytes += decode_bytes // 4
+    if decode_bytes > settings.THUMBNAIL_TASK_MEMORY_BUDGET and not deferred:
+        if settings.THUMBNAIL_LARGE_QUEUE:
+            create_tile_pyramid.apply_async(args=[image_id], kwargs={'deferred': True}, queue=settings.THUMBNAIL_LARGE_QUEUE)
+        else:
+            logger.warning("Rejected tile pyramid of image %s: decode needs %s bytes.", image_id, decode_bytes)
+        return
+
+    tiles_path = hashed_path('tiles', uuid.uuid4().hex, '')
+    extension = output_extension(base_image.format)
+    # No reference to the full-size bitmap is kept here, so the pyramid can release it.
+    for level, column, row, tile in iter_pyramid_tiles(decode_image(base_image, full_size)):
+        default_storage.save(f"{tiles_path}/{level}/{column}_{row}.{extension}",
+                             ContentFile(encode_image(tile, base_image.format)))
+
+    previous_path = base_image.tiles_path
+    base_image.tiles_path = tiles_path
+    base_image.save(update_fields=['tiles_path'])
+    cache.delete(f"tiles_path_{base_image.uploaded_by_id}_{base_image.slug}")
+    if previous_path:
+        queue_path_deletion(previous_path + '/')
+
+
+@shared_task()
+def flush_original_accesses():
+    """
+    Celery task writing the accesses of originals buffered in Redis to the database.
+    """
+    return storage_tiers.flush_original_accesses()
+
+
+@shared_task()
+def demote_idle_originals():
+    """
+    Celery task moving originals not accessed for COLD_STORAGE_AFTER_DAYS days to the cold storage.
+    """
+    return storage_tiers.demote_idle_originals()
+
+
+@shared_task()
+def collect_idle_atlases():
+    """
+    Celery task deleting thumbnail atlases not served for ATLAS_IDLE_HOURS hours, with the
+    boxes stored next to them. Return the number of atlases deleted.
+    """
+    cutoff = time.time() - settings.ATLAS_IDLE_HOURS * 3600
+    return collect_idle_atlas_directory('atlases', cutoff)
+
+
+def collect_idle_atlas_directory(directory, cutoff):
+    try:
+        directories, names = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    deleted = sum(collect_idle_atlas_directory(f"{directory}/{name}", cutoff) for name in directories)
+    for name in names:
+        path = f"{directory}/{name}"
+        stem, _, extension = name.rpartition('.')
+        if extension == 'json':
+            # Boxes of an atlas deleted, e.g. by an earlier run, before them.
+            if f"{stem}.webp" not in names:
+                default_storage.delete(path)
+        elif default_storage.get_modified_time(path).timestamp() < cutoff:
+            default_storage.delete(path)
+            default_storage.delete(f"{directory}/{stem}.json")
+            deleted += 1
+    return deleted
+
+
 @shared_task()
 def delete_expiring_link(*args, **kwargs):
     """
     Celery task to delete an expiring link after a specified duration.
     """
     ExpiringLink.objects.get(id=kwargs['instance_id']).delete()
+
+
+@shared_task()
+def drain_file_deletions():
+    """
+    Celery task to delete queued files in batches of FILE_DELETION_BATCH_SIZE.
+
+    Rows are locked with SKIP LOCKED, so concurrent drains never process the same batch.
+    Files which fail to delete stay queued until FILE_DELETION_MAX_ATTEMPTS is reached.
+    """
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                PendingFileDeletion.objects
+                .select_for_update(skip_locked=True)
+                .filter(id__gt=last_id, attempts__lt=settings.FILE_DELETION_MAX_ATTEMPTS)
+                .order_by('id')[:settings.FILE_DELETION_BATCH_SIZE]
+            )
+            if not batch:
+                return
+            referenced = referenced_by_images([pending.path for pending in batch])
+            deleted, failed = [], []
+            for pending in batch:
+                if pending.path in referenced:
+                    logger.warning("Kept queued file %s, which an image references.", pending.path)
+                    deleted.append(pending.id)
+                    continue
+                try:
+                    delete_stored_path(pending.path)
+                    deleted.append(pending.id)
+                except OSError:
+                    logger.warning("Could not delete file %s.", pending.path, exc_info=True)
+                    failed.append(pending.id)
+            PendingFileDeletion.objects.filter(id__in=deleted).delete()
+            PendingFileDeletion.objects.filter(id__in=failed).update(attempts=models.F('attempts') + 1)
+            last_id = batch[-1].id
+
+
+def referenced_by_images(paths):
+    """
+    Return the queued paths which an Image row references, in one query: originals on the
+    storage tier they were queued on and tile pyramids, e.g. after an original moved back to
+    the tier it was queued on.
+    """
+    hot, cold, tiles = set(), set(), set()
+    for path in paths:
+        if path.startswith(COLD_PATH_PREFIX):
+            cold.add(path[len(COLD_PATH_PREFIX):])
+        elif path.endswith('/'):
+            tiles.add(path[:-1])
+        else:
+            hot.add(path)
+    rows = Image.objects.filter(
+        models.Q(image__in=hot, storage_tier=Image.HOT)
+        | models.Q(image__in=cold, storage_tier=Image.COLD)
+        | models.Q(tiles_path__in=tiles)
+    ).values_list('image', 'storage_tier', 'tiles_path')
+    referenced = set()
+    for image, storage_tier, tiles_path in rows:
+        if image in hot and storage_tier == Image.HOT:
+            referenced.add(image)
+        if image in cold and storage_tier == Image.COLD:
+            referenced.add(f"{COLD_PATH_PREFIX}{image}")
+        if tiles_path in tiles:
+            referenced.add(f"{tiles_path}/")
+    return referenced
+
+
+def delete_stored_path(path):
+    """
+    Delete a stored file, or every file below a directory when the path ends with a slash.
+    Paths starting with COLD_PATH_PREFIX are files on the cold storage.
+    """
+    if path.startswith(COLD_PATH_PREFIX):
+        storage_tiers.cold_storage().delete(path[len(COLD_PATH_PREFIX):])
+        return
+    delete_default_storage_path(path)
+
+
+def delete_default_storage_path(path):
+    if not path.endswith('/'):
+        default_storage.delete(path)
+        return
+    try:
+        directories, files = default_storage.listdir(path)
+    except FileNotFoundError:
+        return
+    for directory in directories:
+        delete_default_storage_path(f"{path}{directory}/")
+    for name in files:
+        default_storage.delete(f"{path}{name}")
+
+
+def _drain_file_deletions_after_commit():
+    drain_file_deletions.delay()
+
+
+def schedule_file_deletion_drain():
+    """
+    Run drain_file_deletions once the current transaction commits. Deletions queueing many files
+    run inside batched_file_deletions, which schedules a single drain for all of them.
+    """
+    transaction.on_commit(_drain_file_deletions_after_commit)
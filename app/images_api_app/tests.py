@@ -1,12 +1,57 @@
-from django.test import TestCase
+import base64
+import gc
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import weakref
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from urllib.parse import parse_qs, urlparse
+from unittest import skipUnless
+from unittest.mock import Mock, patch
+from django.conf import settings
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from django.core.cache import cache
-from rest_framework.test import APIClient
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework import status
-from .models import Image, Thumbnail, ExpiringLink, ThumbnailSize, AccountTier, GrantedTier
+from .models import Image, Thumbnail, ExpiringLink, ThumbnailSize, AccountTier, GrantedTier, PendingFileDeletion, UsageStats
 from django.urls import reverse
 from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image as PILImage
+from .batching import render_thumbnail_batch
+from .events import publish_image_event, stream_image_events
+from .exports import ZipStream
+from .profiling import SamplingProfiler, enforce_size_cap, sign_profile_header
+from .filters import ImageFilterBackend
+from .db_router import ReplicaRouter, is_pinned_to_primary, replica_reads
+from .imaging import FORMAT_EXTENSIONS, draft_scale, encode_image, output_extension, find_focal_point, fit_to_size, iter_pyramid_tiles, pyramid_levels, plan_thumbnail_sizes, required_source_size
+from .paths import COLD_PATH_PREFIX, is_hashed_path
+from . import phash, ratelimit, redis_client, storage_tiers
+from .phash import MultiIndexHashIndex, hamming, hash_image_file, to_signed, to_unsigned
+from . import tasks
+from .tasks import create_thumbnails, create_tile_pyramid, drain_file_deletions
+
+
+def redis_available():
+    try:
+        return redis_client.get_redis().ping()
+    except Exception:
+        return False
 
 
 class ImagesApiTestCase(TestCase):
@@ -241,3 +286,1277 @@ class ImagesApiTestCase(TestCase):
 
         response = self.client.get(reverse("image-detail-destroy", kwargs={'slug': "image1-1"}))
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    """
+    8.  Metadata tests.
+    """
+    def test_upload_stores_image_metadata(self):
+        self.client.force_authenticate(user=self.user1)
+        with open('images_api/tests_static/test.png', 'rb') as image_file:
+            upload = SimpleUploadedFile("upload.png", image_file.read())
+        with patch('images_api_app.views.schedule_thumbnails'):
+            response = self.client.post(reverse("list-create-images"), {'name': 'upload', 'image': upload})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = Image.objects.get(name='upload')
+        self.assertEqual((image.width, image.height, image.format, image.color_mode), (544, 413, 'JPEG', 'RGB'))
+        self.assertEqual(image.file_size, upload.size)
+        self.assertEqual(response.data['width'], 544)
+
+    def test_plan_thumbnail_sizes_skips_sizes_larger_than_original(self):
+        self.image_1.width, self.image_1.height = 300, 300
+        planned = plan_thumbnail_sizes(self.image_1, {(200, 200), (400, 400), (100, 100)})
+        self.assertEqual(planned, [(200, 200), (100, 100)])
+
+    """
+    9.  Thumbnail rendering tests.
+    """
+    def test_create_thumbnails_renders_exact_sizes(self):
+        create_thumbnails(self.image_1.id)
+        thumbnails = Thumbnail.objects.filter(base_image=self.image_1).exclude(id__in=[1, 2])
+        self.assertEqual(sorted(th.thumbnail_size for th in thumbnails), ['200x200px', '400x400px'])
+        for thumbnail in thumbnails:
+            with PILImage.open(thumbnail.thumbnail_image) as img:
+                self.assertEqual(f"{img.width}x{img.height}px", thumbnail.thumbnail_size)
+
+    def test_jpeg_draft_scale_decodes_at_reduced_size(self):
+        self.image_1.width, self.image_1.height, self.image_1.format = 8000, 6000, 'JPEG'
+        self.assertEqual(draft_scale(self.image_1, required_source_size(self.image_1, [(400, 400)])), 8)
+        self.assertEqual(draft_scale(self.image_1, required_source_size(self.image_1, [(2000, 2000)])), 2)
+
+    @override_settings(THUMBNAIL_MAX_PIXELS=1000)
+    def test_create_thumbnails_rejects_image_over_pixel_limit(self):
+        create_thumbnails(self.image_1.id)
+        self.assertEqual(Thumbnail.objects.filter(base_image=self.image_1).count(), 2)
+
+    @override_settings(THUMBNAIL_TASK_MEMORY_BUDGET=1000, THUMBNAIL_LARGE_QUEUE='thumbnails-large')
+    def test_create_thumbnails_defers_image_over_memory_budget(self):
+        with patch('images_api_app.tasks.create_thumbnails.apply_async') as apply_async:
+            create_thumbnails(self.image_1.id)
+        apply_async.assert_called_once_with(args=[self.image_1.id], kwargs={'deferred': True}, queue='thumbnails-large')
+        self.assertEqual(Thumbnail.objects.filter(base_image=self.image_1).count(), 2)
+
+    """
+    10. Upload validation tests.
+    """
+    def upload_image(self, content, name="upload.png"):
+        self.client.force_authenticate(user=self.user1)
+        with patch('images_api_app.views.schedule_thumbnails') as schedule:
+            response = self.client.post(
+                reverse("list-create-images"), {'name': 'upload', 'image': SimpleUploadedFile(name, content)}
+            )
+        return response, schedule
+
+    def test_upload_mislabeled_file_is_rejected(self):
+        response, schedule = self.upload_image(b'%PDF-1.4 not an image at all')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Image.objects.filter(name='upload').exists())
+        schedule.assert_not_called()
+
+    def test_upload_truncated_header_is_rejected(self):
+        with open('images_api/tests_static/test.png', 'rb') as image_file:
+            response, schedule = self.upload_image(image_file.read(100))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        schedule.assert_not_called()
+
+    def test_upload_over_tier_pixel_limit_is_rejected(self):
+        AccountTier.objects.filter(id=1).update(max_image_pixels=1000)
+        with open('images_api/tests_static/test.png', 'rb') as image_file:
+            response, schedule = self.upload_image(image_file.read())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('pixels', str(response.data['image']))
+        self.assertFalse(Image.objects.filter(name='upload').exists())
+        schedule.assert_not_called()
+
+    """
+    11. Perceptual hash tests.
+    """
+    def test_create_thumbnails_stores_perceptual_hash(self):
+        create_thumbnails(self.image_1.id)
+        self.image_1.refresh_from_db()
+        with open('images_api/tests_static/test.png', 'rb') as image_file:
+            self.assertLessEqual(hamming(to_unsigned(self.image_1.phash), hash_image_file(image_file)), 4)
+
+    def test_multi_index_search_matches_linear_scan(self):
+        rng = random.Random(1)
+        hashes = [rng.getrandbits(64) for _ in range(2000)]
+        index = MultiIndexHashIndex()
+        for image_id, value in enumerate(hashes):
+            index.add(image_id, value)
+        index.remove(0)
+        query = hashes[1] ^ 0b1011
+        expected = sorted((hamming(query, h), i) for i, h in enumerate(hashes) if i and hamming(query, h) <= 10)
+        self.assertEqual(index.search(query, 10), expected)
+
+    def test_similar_images_endpoint_returns_near_duplicates(self):
+        self.client.force_authenticate(user=self.user1)
+        duplicate = Image.objects.create(name="dup", slug="dup-9", image="dup.png", uploaded_by=self.user1,
+                                         phash=to_signed((1 << 63) | 0b111))
+        Image.objects.filter(id=self.image_1.id).update(phash=to_signed(1 << 63))
+        response = self.client.get(reverse("similar-images"), {'slug': 'image1-1', 'distance': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(r['id'], r['distance']) for r in response.data['results']], [(duplicate.id, 3)])
+        response = self.client.get(reverse("similar-images"), {'slug': 'image1-1', 'distance': 2})
+        self.assertEqual(response.data['results'], [])
+
+    def test_user_index_applies_logged_changes_and_is_rebuilt_when_too_far_behind(self):
+        self.addCleanup(phash._indexes.pop, self.user1.id, None)
+        phash._indexes.pop(self.user1.id, None)
+        Image.objects.filter(id=self.image_1.id).update(phash=to_signed(1 << 63))
+        with patch.object(phash, 'read_changes', return_value=(1, [])):
+            index = phash.get_user_index(self.user1.id)
+        self.assertEqual(index.search(1 << 63, 0), [(0, self.image_1.id)])
+
+        changes = [(2, self.image_1.id, 1), (3, self.image_2.id, None)]
+        with patch.object(phash, 'read_changes', return_value=(3, changes)) as read_changes, \
+                patch.object(phash.UserHashIndex, 'load') as load:
+            self.assertIs(phash.get_user_index(self.user1.id), index)
+        read_changes.assert_called_once_with(self.user1.id, 1)
+        load.assert_not_called()
+        self.assertEqual((index.version, index.search(1, 0)), (3, [(0, self.image_1.id)]))
+        self.assertEqual(index.search(1 << 63, 0), [])
+
+        # Without Redis the loaded index is kept.
+        with patch.object(phash, 'read_changes', return_value=None):
+            self.assertIs(phash.get_user_index(self.user1.id), index)
+        # Changes no longer in the log make the index rebuild from the database.
+        with patch.object(phash, 'read_changes', return_value=(6, [(6, self.image_1.id, 1)])):
+            rebuilt = phash.get_user_index(self.user1.id)
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual((rebuilt.version, rebuilt.search(1 << 63, 0)), (6, [(0, self.image_1.id)]))
+
+    def test_least_recently_used_user_indexes_are_dropped(self):
+        for user_id in (self.user1.id, self.user2.id):
+            self.addCleanup(phash._indexes.pop, user_id, None)
+        with override_settings(PHASH_INDEX_CACHE_USERS=1), \
+                patch.object(phash, 'read_changes', return_value=(0, [])):
+            phash.get_user_index(self.user1.id)
+            phash.get_user_index(self.user2.id)
+        self.assertNotIn(self.user1.id, phash._indexes)
+        self.assertIn(self.user2.id, phash._indexes)
+
+    def test_index_changes_are_logged_on_commit(self):
+        self.addCleanup(phash._indexes.pop, self.user1.id, None)
+        phash._indexes.pop(self.user1.id, None)
+        with patch.object(phash, 'read_changes', return_value=(1, [])):
+            index = phash.get_user_index(self.user1.id)
+        self.image_1.phash = to_signed(1 << 62)
+        with patch.object(phash, 'record_change', return_value=2) as record_change:
+            with self.captureOnCommitCallbacks(execute=True):
+                phash.index_image(self.image_1)
+                record_change.assert_not_called()
+        record_change.assert_called_once_with(self.user1.id, self.image_1.id, 1 << 62)
+        # Logged changes reach this process' index through the log as well.
+        self.assertEqual(index.search(1 << 62, 0), [])
+        # Without Redis the change only applies here, and the index is rebuilt once Redis is back.
+        with patch.object(phash, 'record_change', return_value=None):
+            with self.captureOnCommitCallbacks(execute=True):
+                phash.index_image(self.image_1)
+        self.assertEqual((index.version, index.search(1 << 62, 0)), (None, [(0, self.image_1.id)]))
+
+    @skipUnless(redis_available(), "Redis is not available.")
+    def test_hash_changes_are_read_back_from_the_redis_log(self):
+        user_id = random.getrandbits(32)
+        self.addCleanup(redis_client.run, lambda client: client.delete(
+            phash.version_key(user_id), phash.changes_key(user_id)))
+        self.assertEqual(phash.read_changes(user_id), (0, []))
+        self.assertEqual(phash.record_change(user_id, 7, 1 << 63), 1)
+        self.assertEqual(phash.record_change(user_id, 7, None), 2)
+        self.assertEqual(phash.read_changes(user_id, 1), (2, [(2, 7, None)]))
+        self.assertEqual(phash.read_changes(user_id, 0), (2, [(1, 7, 1 << 63), (2, 7, None)]))
+
+    """
+    12. Placeholder tests.
+    """
+    def test_create_thumbnails_stores_placeholder_returned_in_list(self):
+        create_thumbnails(self.image_1.id)
+        self.image_1.refresh_from_db()
+        prefix = 'data:image/webp;base64,'
+        self.assertTrue(self.image_1.placeholder.startswith(prefix))
+        with PILImage.open(BytesIO(base64.b64decode(self.image_1.placeholder[len(prefix):]))) as img:
+            self.assertEqual(max(img.size), 20)
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse("list-create-images"))
+        self.assertEqual(response.data[0]['placeholder'], self.image_1.placeholder)
+
+    """
+    13. Thumbnail atlas tests.
+    """
+    def test_thumbnail_atlas_packs_page_and_changes_with_members(self):
+        create_thumbnails(self.image_1.id)
+        Thumbnail.objects.filter(id__in=[1, 2]).delete()
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse("thumbnail-atlas"), {'size': '200px'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['coordinates'],
+                         [{'id': 1, 'slug': 'image1-1', 'x': 0, 'y': 0, 'width': 200, 'height': 200}])
+        self.assertEqual(self.client.get(reverse("thumbnail-atlas"), {'size': '200px'}).data['atlas'],
+                         response.data['atlas'])
+
+        Thumbnail.objects.filter(base_image=self.image_1).delete()
+        create_thumbnails(self.image_1.id)
+        rebuilt = self.client.get(reverse("thumbnail-atlas"), {'size': '200px'})
+        self.assertNotEqual(rebuilt.data['atlas'], response.data['atlas'])
+
+    def test_thumbnail_atlas_orders_newest_first_and_idle_atlases_are_collected(self):
+        create_thumbnails(self.image_1.id)
+        newer = Image.objects.create(name="newer", slug="newer-3", image=self.image_1.image.name, uploaded_by=self.user1)
+        Thumbnail.objects.create(created_by=self.user1, base_image=newer, thumbnail_size="200x200px",
+                                 thumbnail_image=Thumbnail.objects.get(base_image=self.image_1,
+                                                                       thumbnail_size="200x200px").thumbnail_image.name)
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse("thumbnail-atlas"), {'size': '200px'})
+        self.assertEqual([entry['id'] for entry in response.data['coordinates']], [newer.id, self.image_1.id])
+        atlas_path = response.data['atlas'].split(settings.MEDIA_URL, 1)[-1]
+        boxes_path = atlas_path.replace('.webp', '.json')
+        self.assertTrue(is_hashed_path(atlas_path))
+        self.assertTrue(default_storage.exists(boxes_path))
+        self.addCleanup(default_storage.delete, atlas_path)
+        self.addCleanup(default_storage.delete, boxes_path)
+
+        idle = time.time() - 48 * 3600
+        os.utime(default_storage.path(atlas_path), (idle, idle))
+        self.assertEqual(tasks.collect_idle_atlases(), 1)
+        self.assertFalse(default_storage.exists(atlas_path))
+        self.assertFalse(default_storage.exists(boxes_path))
+
+        # Serving an existing atlas again marks it as used, reading its boxes instead of decoding it.
+        self.client.get(reverse("thumbnail-atlas"), {'size': '200px'})
+        os.utime(default_storage.path(atlas_path), (idle, idle))
+        cache.clear()
+        with patch('images_api_app.views.build_atlas') as build_atlas:
+            served = self.client.get(reverse("thumbnail-atlas"), {'size': '200px'})
+        build_atlas.assert_not_called()
+        self.assertEqual(served.data['coordinates'], response.data['coordinates'])
+        self.assertEqual(tasks.collect_idle_atlases(), 0)
+        self.assertTrue(default_storage.exists(atlas_path))
+
+    def test_thumbnail_atlas_pages_match_the_image_list_pages(self):
+        create_thumbnails(self.image_1.id)
+        thumbnail_name = Thumbnail.objects.get(base_image=self.image_1, thumbnail_size="200x200px").thumbnail_image.name
+        for name in ("atlas-a", "atlas-b", "other"):
+            image = Image.objects.create(name=name, slug=f"{name}-9", image=self.image_1.image.name, uploaded_by=self.user1)
+            Thumbnail.objects.create(created_by=self.user1, base_image=image, thumbnail_size="200x200px",
+                                     thumbnail_image=thumbnail_name)
+        self.client.force_authenticate(user=self.user1)
+        params = {'name': 'atlas', 'page_size': 1}
+        listed = self.client.get(reverse("list-create-images"), params).data
+        atlas = self.client.get(reverse("thumbnail-atlas"), {'size': '200px', **params}).data
+        self.assertEqual([entry['slug'] for entry in atlas['coordinates']], [listed['results'][0]['slug']])
+
+        cursor = parse_qs(urlparse(listed['next']).query)['cursor'][0]
+        next_listed = self.client.get(reverse("list-create-images"), {**params, 'cursor': cursor}).data
+        next_atlas = self.client.get(reverse("thumbnail-atlas"), {'size': '200px', **params, 'cursor': cursor}).data
+        self.assertEqual([entry['slug'] for entry in next_atlas['coordinates']], [next_listed['results'][0]['slug']])
+        self.assertEqual(next_listed['results'][0]['slug'], 'atlas-a-9')
+        self.assertIsNone(next_atlas['next'])
+
+    """
+    14. Export tests.
+    """
+    def test_export_streams_zip_with_manifest_and_originals(self):
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse("export-images"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as archive:
+            manifest = [json.loads(line) for line in archive.read('manifest.ndjson').decode().splitlines()]
+            self.assertEqual([entry['id'] for entry in manifest], [1])
+            self.assertEqual(len(archive.read(manifest[0]['original'])), self.image_1.image.size)
+            self.assertIn('thumbnails/1/th_img.png', archive.read('missing.txt').decode())
+
+    def test_zip_stream_writes_valid_zip64_archive_entry_by_entry(self):
+        with ZipStream() as stream:
+            data = b''.join(itertools.chain(
+                stream.entry('a.txt', [b'hello ', b'world']),
+                stream.entry('empty/b.bin', []),
+                stream.entry('ünicode.txt', [bytes(range(256)) * 300]),
+                stream.finish(),
+            ))
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ['a.txt', 'empty/b.bin', 'ünicode.txt'])
+            self.assertEqual(archive.read('a.txt'), b'hello world')
+            self.assertEqual(archive.read('empty/b.bin'), b'')
+            self.assertEqual(archive.read('ünicode.txt'), bytes(range(256)) * 300)
+
+    """
+    15. Background file deletion tests.
+    """
+    def test_bulk_delete_queues_files_and_drain_deletes_them(self):
+        self.client.force_authenticate(user=self.user1)
+        image_path = self.image_1.image.name
+        response = self.client.post(reverse("bulk-delete-images"), {'slugs': ['image1-1', 'image2-2']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['deleted'], ['image1-1'])
+        self.assertFalse(Image.objects.filter(id=1).exists())
+        queued = set(PendingFileDeletion.objects.values_list('path', flat=True))
+        self.assertEqual(queued, {image_path, 'th_img.png', 'image_exp.png'})
+        self.assertTrue(default_storage.exists(image_path))
+
+        drain_file_deletions()
+        self.assertFalse(PendingFileDeletion.objects.exists())
+        self.assertFalse(default_storage.exists(image_path))
+
+    def test_bulk_delete_inserts_queued_files_at_once_and_drains_once(self):
+        self.client.force_authenticate(user=self.user1)
+        with patch.object(tasks.drain_file_deletions, 'delay') as delay, \
+                CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("bulk-delete-images"), {'slugs': ['image1-1']}, format='json')
+        inserts = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('INSERT') and 'pendingfiledeletion' in query['sql']]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(set(PendingFileDeletion.objects.values_list('path', flat=True)),
+                         {self.image_1.image.name, 'th_img.png', 'image_exp.png'})
+        delay.assert_called_once_with()
+
+    def test_drain_checks_references_of_a_batch_in_one_query(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            Image.objects.filter(id=self.image_2.id).update(storage_tier=Image.COLD, tiles_path='tiles/ab/cd/key')
+            for path in (self.image_1.image.name, 'orphan.png', 'tiles/ab/cd/key/0/0_0.webp'):
+                default_storage.save(path, ContentFile(b'data'))
+            PendingFileDeletion.objects.bulk_create(PendingFileDeletion(path=path) for path in (
+                self.image_1.image.name, 'orphan.png', f"{COLD_PATH_PREFIX}{self.image_2.image.name}", 'tiles/ab/cd/key/',
+            ))
+            with CaptureQueriesContext(connection) as queries, \
+                    patch.object(storage_tiers, 'cold_storage') as cold_storage:
+                drain_file_deletions()
+            image_queries = [query for query in queries.captured_queries
+                             if 'FROM "images_api_app_image"' in query['sql']]
+            self.assertEqual(len(image_queries), 1)
+            cold_storage.assert_not_called()
+            self.assertFalse(PendingFileDeletion.objects.exists())
+            self.assertFalse(default_storage.exists('orphan.png'))
+            self.assertTrue(default_storage.exists(self.image_1.image.name))
+            self.assertTrue(default_storage.exists('tiles/ab/cd/key/0/0_0.webp'))
+
+    """
+    16. Orphaned file collection tests.
+    """
+    def test_collect_orphaned_files_keeps_referenced_and_recent_files(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            referenced = default_storage.save(self.image_1.image.name, ContentFile(b'original'))
+            self.assertEqual(referenced, self.image_1.image.name)
+            old_orphan = default_storage.save('images/orphans/old.png', ContentFile(b'12345'))
+            new_orphan = default_storage.save('images/orphans/new.png', ContentFile(b'123'))
+            old_mtime = time.time() - 48 * 3600
+            os.utime(default_storage.path(old_orphan), (old_mtime, old_mtime))
+            os.utime(default_storage.path(referenced), (old_mtime, old_mtime))
+
+            call_command('collect_orphaned_files', '--dry-run', stdout=StringIO())
+            self.assertTrue(default_storage.exists(old_orphan))
+
+            output = StringIO()
+            call_command('collect_orphaned_files', '--grace-hours', '24', stdout=output)
+            self.assertFalse(default_storage.exists(old_orphan))
+            self.assertTrue(default_storage.exists(new_orphan))
+            self.assertTrue(default_storage.exists(referenced))
+            self.assertIn('Reclaimed 5 bytes in 1 orphaned files', output.getvalue())
+
+    def test_collect_orphaned_files_rechecks_candidates_before_deleting(self):
+        from .management.commands.collect_orphaned_files import Command
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            referenced = default_storage.save(self.image_1.image.name, ContentFile(b'original'))
+            old_mtime = time.time() - 48 * 3600
+            os.utime(default_storage.path(referenced), (old_mtime, old_mtime))
+            # Simulates a row written after the referenced paths were loaded.
+            with patch.object(Command, 'referenced_paths', return_value=set()):
+                call_command('collect_orphaned_files', stdout=StringIO())
+            self.assertTrue(default_storage.exists(referenced))
+
+    """
+    17. Media layout tests.
+    """
+    def test_uploads_use_hashed_fan_out_layout(self):
+        self.assertTrue(is_hashed_path(self.image_1.image.name))
+        self.assertTrue(self.image_1.image.name.startswith('images/'))
+
+    def test_migrate_media_layout_moves_files_and_is_resumable(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            old_path = default_storage.save('images/2023/12/01/legacy.png', ContentFile(b'legacy'))
+            Image.objects.filter(id=1).update(image=old_path)
+            old_mtime = time.time() - 48 * 3600
+            os.utime(default_storage.path(old_path), (old_mtime, old_mtime))
+
+            call_command('migrate_media_layout', '--batch-size', '1', stdout=StringIO(), stderr=StringIO())
+            new_path = Image.objects.get(id=1).image.name
+            self.assertTrue(is_hashed_path(new_path))
+            self.assertFalse(default_storage.exists(old_path))
+            with default_storage.open(new_path) as moved_file:
+                self.assertEqual(moved_file.read(), b'legacy')
+            # A concurrent collection must not take the new path for an old orphan.
+            self.assertGreater(os.path.getmtime(default_storage.path(new_path)), old_mtime + 24 * 3600)
+
+            call_command('migrate_media_layout', stdout=StringIO(), stderr=StringIO())
+            self.assertEqual(Image.objects.get(id=1).image.name, new_path)
+
+    """
+    18. Rate limit and storage quota tests.
+    """
+    def test_upload_throttled_returns_too_many_requests(self):
+        self.client.force_authenticate(user=self.user1)
+        with patch('images_api_app.throttles.take_token', return_value=(False, 12.0)) as take_token:
+            response = self.client.post(reverse("list-create-images"), {'name': 'upload'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '12')
+        take_token.assert_called_once_with('upload', self.user1.id, 30)
+
+    def test_upload_over_storage_quota_is_rejected_before_reading_body(self):
+        AccountTier.objects.filter(id=1).update(storage_quota=1000)
+        with patch('images_api_app.permissions.get_storage_usage', return_value=900):
+            response, schedule = self.upload_image(b'x' * 200)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(Image.objects.filter(name='upload').exists())
+        schedule.assert_not_called()
+
+    def test_limits_fail_open_when_redis_is_unavailable(self):
+        class BrokenRedis:
+            def register_script(self, source):
+                raise redis_client.redis.ConnectionError()
+
+            def get(self, key):
+                raise redis_client.redis.ConnectionError()
+
+        with patch.object(redis_client, '_unavailable_until', 0), \
+                patch.object(redis_client, '_scripts', {}), \
+                patch.object(redis_client, 'get_redis', return_value=BrokenRedis()):
+            self.assertEqual(ratelimit.take_token('upload', self.user1.id, 1), (True, None))
+            self.assertTrue(redis_client.unavailable())
+            self.assertTrue(ratelimit.reserve_storage(self.user1.id, 10, 1))
+            self.assertEqual(ratelimit.get_storage_usage(self.user1.id), 0)
+
+    def test_fail_closed_commands_are_attempted_while_redis_is_skipped(self):
+        client = Mock()
+        with patch.object(redis_client, '_unavailable_until', time.monotonic() + 60), \
+                patch.object(redis_client, 'get_redis', return_value=client):
+            self.assertEqual(redis_client.run(lambda client: client.get('key'), default='skipped'), 'skipped')
+            client.get.assert_not_called()
+            redis_client.run(lambda client: client.get('key'), fail_closed=True)
+            client.get.assert_called_once_with('key')
+
+            client.get.side_effect = redis_client.redis.TimeoutError()
+            with self.assertRaises(redis_client.RedisUnavailable):
+                redis_client.run(lambda client: client.get('key'), fail_closed=True)
+
+    @skipUnless(redis_available(), "Redis is not available.")
+    def test_redis_token_bucket_and_storage_reservation(self):
+        scope = f"test-{random.getrandbits(32)}"
+        self.assertEqual([ratelimit.take_token(scope, self.user1.id, 2)[0] for _ in range(3)], [True, True, False])
+
+        ratelimit.reset_storage_usage(self.user1.id)
+        used = ratelimit.get_storage_usage(self.user1.id)
+        self.assertEqual(used, sum(Image.objects.filter(uploaded_by=self.user1).values_list('file_size', flat=True)))
+        self.assertTrue(ratelimit.reserve_storage(self.user1.id, 100, used + 150))
+        self.assertFalse(ratelimit.reserve_storage(self.user1.id, 100, used + 150))
+        ratelimit.release_storage(self.user1.id, 100)
+        self.assertEqual(ratelimit.get_storage_usage(self.user1.id), used)
+        ratelimit.reset_storage_usage(self.user1.id)
+
+    def test_deleted_image_releases_storage_quota_only_once_committed(self):
+        Image.objects.filter(id=self.image_1.id).update(file_size=300)
+        image = Image.objects.get(id=self.image_1.id)
+        with patch('images_api_app.models.release_storage') as release_storage, \
+                patch.object(tasks.drain_file_deletions, 'delay'):
+            with self.captureOnCommitCallbacks(execute=True):
+                image.delete()
+                release_storage.assert_not_called()
+        release_storage.assert_called_once_with(self.user1.id, 300)
+
+    """
+    19. Usage statistics tests.
+    """
+    def assertUsage(self, user, image_count, thumbnail_count, stored_bytes):
+        stats = UsageStats.objects.get(user=user)
+        self.assertEqual((stats.image_count, stats.thumbnail_count, stats.stored_bytes),
+                         (image_count, thumbnail_count, stored_bytes))
+
+    def test_usage_stats_follow_saves_and_deletes(self):
+        self.assertUsage(self.user1, 1, 2, 0)
+        image = Image.objects.create(name="image3", image="image3.png", slug='image3-3',
+                                     uploaded_by=self.user1, file_size=1000)
+        Thumbnail.objects.create(created_by=self.user1, base_image=image,
+                                 thumbnail_image="th_img3.png", thumbnail_size="200px")
+        self.assertUsage(self.user1, 2, 3, 1000)
+
+        self.image_1.delete()
+        self.assertUsage(self.user1, 1, 1, 1000)
+
+    def test_reconcile_usage_stats_corrects_drift(self):
+        UsageStats.objects.filter(user=self.user1).update(image_count=7, stored_bytes=-5)
+        UsageStats.objects.filter(user=self.user2).delete()
+        output = StringIO()
+        call_command('reconcile_usage_stats', '--batch-size', '1', stdout=output)
+        self.assertUsage(self.user1, 1, 2, 0)
+        self.assertUsage(self.user2, 1, 0, 0)
+        self.assertIn('Reconciled usage stats of 2 users, corrected 2.', output.getvalue())
+
+    def test_admin_tier_list_queries_do_not_grow_with_rows(self):
+        admin_user = User.objects.create_superuser(username="admin", password="very-strong-password")
+        self.client.force_login(admin_user)
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                for model in ('accounttier', 'grantedtier', 'thumbnail', 'expiringlink', 'usagestats'):
+                    response = self.client.get(reverse(f'admin:images_api_app_{model}_changelist'))
+                    self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        queries_before = count_queries()
+        for index in range(3):
+            tier = AccountTier.objects.create(name=f"Tier {index}")
+            tier.thumbnail_sizes.add(1, 2)
+            user = User.objects.create_user(username=f"user{index}", password="very-strong-password")
+            GrantedTier.objects.create(user=user).granted_tiers.add(tier)
+            Thumbnail.objects.create(created_by=self.user1, base_image=self.image_1,
+                                     thumbnail_image="th_img.png", thumbnail_size="200px")
+            ExpiringLink.objects.create(base_image=self.image_1, expiring_image="image_exp.png", seconds_to_expire=30)
+        self.assertEqual(count_queries(), queries_before)
+
+    """
+    20. Inline thumbnailing tests.
+    """
+    def post_test_image(self):
+        self.client.force_authenticate(user=self.user1)
+        with open('images_api/tests_static/test.png', 'rb') as image_file:
+            upload = SimpleUploadedFile("upload.png", image_file.read())
+        with patch('images_api_app.tasks.create_thumbnails.delay') as delay:
+            response = self.client.post(reverse("list-create-images"), {'name': 'upload', 'image': upload})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response, delay
+
+    def thumbnail_bytes(self, image):
+        thumbnails = Thumbnail.objects.filter(base_image=image).exclude(id__in=[1, 2])
+        return {th.thumbnail_size: th.thumbnail_image.read() for th in thumbnails}
+
+    def test_small_upload_renders_thumbnails_inline_like_celery(self):
+        response, delay = self.post_test_image()
+        delay.assert_not_called()
+        self.assertEqual(sorted(th['thumbnail_size'] for th in response.data['thumbnails']), ['200x200px', '400x400px'])
+
+        create_thumbnails(self.image_1.id)
+        inline_image = Image.objects.get(name='upload')
+        self.assertEqual(inline_image.phash, Image.objects.get(id=1).phash)
+        self.assertEqual(self.thumbnail_bytes(inline_image), self.thumbnail_bytes(self.image_1))
+
+    @override_settings(THUMBNAIL_INLINE_MAX_PIXELS=1000)
+    def test_large_upload_is_offloaded_to_celery(self):
+        response, delay = self.post_test_image()
+        delay.assert_called_once_with(response.data['id'])
+        self.assertEqual(response.data['thumbnails'], [])
+
+    def test_upload_is_offloaded_when_inline_slots_are_busy(self):
+        with patch.object(tasks, '_inline_slots', tasks.threading.BoundedSemaphore(0)):
+            response, delay = self.post_test_image()
+        delay.assert_called_once_with(response.data['id'])
+
+    def test_rendering_again_after_a_partial_failure_adds_no_duplicate_thumbnails(self):
+        create_thumbnails(self.image_1.id)
+        create_thumbnails(self.image_1.id)
+        sizes = lambda: sorted(Thumbnail.objects.filter(base_image=self.image_1).exclude(id__in=[1, 2])
+                               .values_list('thumbnail_size', flat=True))
+        self.assertEqual(sizes(), ['200x200px', '400x400px'])
+
+        Thumbnail.objects.filter(base_image=self.image_1, thumbnail_size='400x400px').delete()
+        render_thumbnail_batch([Image.objects.get(id=self.image_1.id)])
+        self.assertEqual(sizes(), ['200x200px', '400x400px'])
+
+    """
+    21. Processing status and event tests.
+    """
+    def read_events(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_create_thumbnails_marks_image_ready_and_publishes_event(self):
+        with patch('images_api_app.events.run') as run, self.captureOnCommitCallbacks(execute=True):
+            create_thumbnails(self.image_1.id)
+        self.assertEqual(Image.objects.get(id=1).processing_status, Image.READY)
+        redis_client = type('RedisClient', (), {'publish': lambda self, channel, payload: (channel, json.loads(payload))})()
+        channel, event = run.call_args[0][0](redis_client)
+        self.assertEqual(channel, f"images:events:{self.user1.id}")
+        self.assertEqual(event, {'id': 1, 'slug': 'image1-1', 'processing_status': 'ready', 'thumbnails': 4})
+
+    @override_settings(THUMBNAIL_MAX_PIXELS=1000)
+    def test_rejected_image_is_marked_failed(self):
+        create_thumbnails(self.image_1.id)
+        self.assertEqual(Image.objects.get(id=1).processing_status, Image.FAILED)
+
+    def test_image_events_sends_current_status_without_redis(self):
+        Image.objects.filter(id=1).update(processing_status=Image.READY)
+        self.client.force_authenticate(user=self.user1)
+        with patch('images_api_app.events.run', return_value=None):
+            response = self.client.get(reverse("image-events"), {'slug': ['image1-1', 'image2-2']},
+                                       HTTP_ACCEPT='text/event-stream')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            body = self.read_events(response)
+        self.assertIn('event: image\nid: 1\n', body)
+        self.assertIn('"processing_status": "ready"', body)
+        self.assertNotIn('image2-2', body)
+
+    @skipUnless(redis_available(), "Redis is not available.")
+    @override_settings(IMAGE_EVENTS_HEARTBEAT_SECONDS=0.1)
+    def test_image_events_streams_published_event(self):
+        stream = stream_image_events(self.user1, Image.objects.filter(id=1))
+        self.assertEqual(next(stream), ": keepalive\n\n")
+        self.image_1.processing_status = Image.READY
+        with self.captureOnCommitCallbacks(execute=True):
+            publish_image_event(self.image_1)
+        events = [message for message in stream if message.startswith('event:')]
+        self.assertEqual(len(events), 1)
+        self.assertIn('"processing_status": "ready"', events[0])
+
+    def test_status_changes_drop_the_cached_image_detail(self):
+        self.client.force_authenticate(user=self.user1)
+        detail = lambda: self.client.get(reverse("image-detail-destroy", args=['image1-1'])).data['data']
+        self.assertEqual(detail()['processing_status'], Image.PENDING)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_thumbnails(self.image_1.id)
+        self.assertEqual(detail()['processing_status'], Image.READY)
+
+    def test_failed_inline_render_is_offloaded_without_event(self):
+        self.image_1.update_metadata()
+        with patch.object(tasks, 'generate_thumbnails', side_effect=OSError()), \
+                patch.object(tasks, 'publish_image_event') as publish_image_event, \
+                patch.object(tasks.create_thumbnails, 'delay') as delay:
+            self.assertFalse(tasks.schedule_thumbnails(self.image_1))
+        publish_image_event.assert_not_called()
+        delay.assert_called_once_with(self.image_1.id)
+        self.assertEqual(Image.objects.get(id=self.image_1.id).processing_status, Image.PENDING)
+
+    def test_image_events_wait_for_terminal_status_without_holding_the_connection(self):
+        events = [{'id': 1, 'slug': 'image1-1', 'processing_status': status, 'thumbnails': 0}
+                  for status in (Image.PROCESSING, Image.FAILED)]
+
+        class PubSub:
+            def subscribe(self, channel):
+                pass
+
+            def get_message(self, timeout):
+                return {'data': json.dumps(events.pop(0))}
+
+            def close(self):
+                pass
+
+        redis = type('Redis', (), {'pubsub': lambda self, **kwargs: PubSub()})()
+        with patch('images_api_app.events.run', side_effect=lambda command: command(redis)), \
+                patch('images_api_app.events.connection') as events_connection:
+            events_connection.in_atomic_block = False
+            messages = list(stream_image_events(self.user1, Image.objects.filter(id=1)))
+        events_connection.close.assert_called_once_with()
+        self.assertEqual(len(messages), 1)
+        self.assertIn('"processing_status": "failed"', messages[0])
+
+    """
+    22. Deep zoom tests.
+    """
+    def test_pyramid_levels_halve_down_to_one_pixel(self):
+        levels = pyramid_levels(544, 413)
+        self.assertEqual((len(levels), levels[0], levels[-2], levels[-1]), (11, (1, 1), (272, 207), (544, 413)))
+
+    def test_pyramid_tiles_cover_every_level(self):
+        tiles = list(iter_pyramid_tiles(PILImage.new('RGB', (544, 413))))
+        full_level = [(column, row, tile.size) for level, column, row, tile in tiles if level == 10]
+        self.assertEqual(full_level, [(0, 0, (256, 256)), (1, 0, (256, 256)), (2, 0, (32, 256)),
+                                      (0, 1, (256, 157)), (1, 1, (256, 157)), (2, 1, (32, 157))])
+        self.assertEqual(tiles[-1][:3], (0, 0, 0))
+
+    def test_pyramid_releases_the_full_size_bitmap_once_the_next_level_is_built(self):
+        bitmap = PILImage.new('RGB', (544, 413))
+        full_size = weakref.ref(bitmap)
+        tiles = iter_pyramid_tiles(bitmap)
+        del bitmap
+        levels = [next(tiles)[0] for _ in range(7)]
+        self.assertEqual(levels, [10] * 6 + [9])
+        gc.collect()
+        self.assertIsNone(full_size())
+
+    @override_settings(TILE_PYRAMID_MIN_PIXELS=100_000)
+    def test_deep_zoom_tiles_are_built_served_and_deleted(self):
+        AccountTier.objects.filter(id=1).update(deep_zoom=True)
+        with patch('images_api_app.tasks.create_tile_pyramid.delay', side_effect=create_tile_pyramid) as delay:
+            create_thumbnails(self.image_1.id)
+        delay.assert_called_once_with(self.image_1.id)
+        tiles_path = Image.objects.get(id=1).tiles_path
+        self.assertTrue(tiles_path.startswith('tiles/'))
+
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse("image-tiles", kwargs={'slug': 'image1-1'}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['levels'], response.data['tile_source']['Image']['Format']), (11, 'jpg'))
+
+        tile_url = reverse("image-tile", kwargs={'slug': 'image1-1', 'level': 10, 'column': 2, 'row': 1, 'extension': 'jpg'})
+        response = self.client.get(tile_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('immutable', response['Cache-Control'])
+        with PILImage.open(BytesIO(b''.join(response.streaming_content))) as tile:
+            self.assertEqual(tile.size, (32, 157))
+        self.assertEqual(self.client.get(tile_url.replace('2_1', '3_1')).status_code, status.HTTP_404_NOT_FOUND)
+
+        Image.objects.get(id=1).delete()
+        drain_file_deletions()
+        self.assertFalse(default_storage.exists(f"{tiles_path}/10/2_1.jpg"))
+
+    @override_settings(THUMBNAIL_TASK_MEMORY_BUDGET=1000)
+    def test_tile_pyramid_over_memory_budget_is_deferred_or_rejected(self):
+        self.image_1.update_metadata()
+        self.image_1.save()
+        with override_settings(THUMBNAIL_LARGE_QUEUE='large'), \
+                patch.object(tasks.create_tile_pyramid, 'apply_async') as apply_async:
+            create_tile_pyramid(self.image_1.id)
+        apply_async.assert_called_once_with(args=[self.image_1.id], kwargs={'deferred': True}, queue='large')
+        create_tile_pyramid(self.image_1.id)
+        self.assertFalse(Image.objects.get(id=1).tiles_path)
+        create_tile_pyramid(self.image_1.id, deferred=True)
+        self.assertTrue(Image.objects.get(id=1).tiles_path)
+
+    def test_tiles_report_dimensions_of_the_orientated_image(self):
+        Image.objects.filter(id=1).update(tiles_path='tiles/ab/cd/rotated', orientation=6, width=544, height=413)
+        image = Image.objects.get(id=1)
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse("image-tiles", kwargs={'slug': 'image1-1'}))
+        self.assertEqual((response.data['width'], response.data['height']), (image.height, image.width))
+        self.assertEqual(response.data['tile_source']['Image']['Size'], {'Width': image.height, 'Height': image.width})
+
+    def test_image_without_tiles_returns_not_found(self):
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse("image-tiles", kwargs={'slug': 'image1-1'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+    """
+    23. Profiler tests.
+    """
+    def test_sampling_profiler_writes_collapsed_stacks(self):
+        def busy_loop():
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                pass
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(PROFILER_DIRECTORY=directory):
+            profiler = SamplingProfiler('busy', 0.001).start()
+            busy_loop()
+            path = profiler.stop()
+            with open(path) as profile:
+                lines = profile.read().splitlines()
+        self.assertTrue(any('busy_loop (tests.py:' in line.rsplit(' ', 1)[0] for line in lines))
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+
+    def test_profile_that_cannot_be_written_is_dropped(self):
+        with tempfile.NamedTemporaryFile() as not_a_directory, \
+                override_settings(PROFILER_DIRECTORY=os.path.join(not_a_directory.name, 'profiles')):
+            profiler = SamplingProfiler('busy', 0.001).start()
+            time.sleep(0.01)
+            with self.assertLogs('images_api_app.profiling', 'WARNING'):
+                self.assertIsNone(profiler.stop())
+
+    def test_profile_directory_is_kept_under_size_cap(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for index in range(3):
+                path = os.path.join(directory, f"{index}.folded")
+                with open(path, 'w') as profile:
+                    profile.write('x' * 100)
+                os.utime(path, (index, index))
+            enforce_size_cap(directory, 250)
+            self.assertEqual(sorted(os.listdir(directory)), ['1.folded', '2.folded'])
+
+    def test_requests_are_profiled_by_route_header_or_user_only(self):
+        self.client.force_authenticate(user=self.user1)
+        with patch('images_api_app.profiling.SamplingProfiler') as profiler:
+            self.client.get(reverse("list-create-images"))
+            profiler.assert_not_called()
+            with override_settings(PROFILER_ROUTES=['list-create-images']):
+                self.client.get(reverse("list-create-images"))
+            profiler.assert_called_once()
+            self.assertEqual(profiler.call_args[0][0], 'GET-list-create-images')
+            profiler.return_value.start.return_value.stop.assert_called_once()
+
+            profiler.reset_mock()
+            with override_settings(PROFILER_SIGNING_KEY='admin-key'):
+                self.client.get(reverse("list-create-images"), HTTP_X_PROFILE='forged')
+                profiler.assert_not_called()
+                self.client.get(reverse("list-create-images"), HTTP_X_PROFILE=sign_profile_header())
+                profiler.assert_called_once()
+
+            # Requests of other users than the listed ones start no sampler at all.
+            profiler.reset_mock()
+            with override_settings(PROFILER_USERS=[self.user2.id]):
+                self.client.get(reverse("list-create-images"))
+            profiler.assert_not_called()
+            with override_settings(PROFILER_USERS=[self.user1.id]):
+                self.client.get(reverse("list-create-images"))
+            profiler.assert_called_once()
+            profiler.return_value.start.return_value.stop.assert_called_once()
+
+    def test_streaming_responses_are_profiled_until_their_body_is_sent(self):
+        self.client.force_authenticate(user=self.user1)
+        with patch('images_api_app.profiling.SamplingProfiler') as profiler, \
+                override_settings(PROFILER_ROUTES=['export-images']):
+            response = self.client.get(reverse("export-images"))
+            stop = profiler.return_value.start.return_value.stop
+            stop.assert_not_called()
+            b''.join(response.streaming_content)
+        stop.assert_called_once_with()
+
+    """
+    24. Image list filter tests.
+    """
+    FILTER_VALUES = {
+        'name': 'ima', 'search': 'age', 'created_after': '2020-01-01T00:00:00Z', 'created_before': '2100-01-01T00:00:00Z',
+        'image_format': 'png', 'min_width': '100', 'max_width': '5000', 'min_height': '100', 'max_height': '5000',
+        'status': 'ready',
+    }
+
+    def create_filtered_images(self):
+        Image.objects.filter(id=1).update(width=544, height=413, format='JPEG', processing_status=Image.READY)
+        for index, (width, image_format) in enumerate([(100, 'PNG'), (2000, 'JPEG')], start=3):
+            Image.objects.create(id=index, name=f"Photo{index}", image=f"photo{index}.png", slug=f"photo{index}-{index}",
+                                 uploaded_by=self.user1, width=width, height=width, format=image_format)
+
+    def list_slugs(self, **params):
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse("list-create-images"), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(image['slug'] for image in response.data)
+
+    def test_image_list_filters(self):
+        self.create_filtered_images()
+        self.assertEqual(self.list_slugs(), ['image1-1', 'photo3-3', 'photo4-4'])
+        self.assertEqual(self.list_slugs(name='PHO'), ['photo3-3', 'photo4-4'])
+        self.assertEqual(self.list_slugs(search='ge1'), ['image1-1'])
+        self.assertEqual(self.list_slugs(image_format='jpeg', min_width=500), ['image1-1', 'photo4-4'])
+        self.assertEqual(self.list_slugs(max_width=1000, max_height=500), ['image1-1', 'photo3-3'])
+        self.assertEqual(self.list_slugs(status='ready'), ['image1-1'])
+        self.assertEqual(self.list_slugs(created_before='2000-01-01T00:00:00Z'), [])
+
+        response = self.client.get(reverse("list-create-images"), {'min_width': 'wide', 'status': 'done'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data), {'min_width', 'status'})
+
+    def test_image_list_cursor_pagination(self):
+        self.create_filtered_images()
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse("list-create-images"), {'image_format': 'JPEG', 'page_size': 1})
+        self.assertEqual([image['slug'] for image in response.data['results']], ['photo4-4'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([image['slug'] for image in response.data['results']], ['image1-1'])
+        self.assertIsNone(response.data['next'])
+
+    def test_every_image_list_filter_combination_uses_an_index(self):
+        self.create_filtered_images()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        # The composite indexes of the image list, and the trigram index on name in PostgreSQL.
+        list_indexes = '(image_user_[a-z]+_idx|image_upper_name_trgm_idx)'
+        sqlite_indexed_filters = {'created_after', 'created_before', 'image_format', 'min_width', 'max_width', 'status'}
+        factory = APIRequestFactory()
+        for count in range(len(self.FILTER_VALUES) + 1):
+            for names in itertools.combinations(self.FILTER_VALUES, count):
+                request = Request(factory.get('/', {name: self.FILTER_VALUES[name] for name in names}))
+                queryset = ImageFilterBackend().filter_queryset(
+                    request, Image.objects.filter(uploaded_by=self.user1), None
+                ).order_by('-id')
+                plan = queryset.explain()
+                if connection.vendor == 'postgresql':
+                    self.assertRegex(plan, rf'(Index (Only )?Scan|Bitmap Index Scan)( Backward)? on {list_indexes}', names)
+                else:
+                    # SQLite has no trigram index, and height only follows width in its index, so
+                    # the user's images are searched by the foreign key index for those filters.
+                    indexes = (list_indexes if set(names) & sqlite_indexed_filters
+                               else 'images_api_app_image_uploaded_by_id_')
+                    self.assertRegex(plan, rf'SEARCH images_api_app_image USING (COVERING )?INDEX {indexes}', names)
+
+    """
+    25. Batch thumbnail rendering tests.
+    """
+    def pending_copy_of_image_1(self):
+        image = Image.objects.get(id=1)
+        image.update_metadata()
+        image.pk, image.phash, image.placeholder, image.processing_status = None, None, '', Image.PENDING
+        image.save()
+        return image
+
+    def test_batch_rendering_matches_one_task_per_image(self):
+        create_thumbnails(self.image_1.id)
+        expected = self.thumbnail_bytes(self.image_1)
+        with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('fork')) as pool:
+            for executor in (None, pool):
+                image = self.pending_copy_of_image_1()
+                thumbnails = UsageStats.objects.get(user=self.user1).thumbnail_count
+                with patch('images_api_app.batching.publish_image_event') as publish:
+                    self.assertEqual(render_thumbnail_batch([image], executor), 1)
+                publish.assert_called_once_with(image)
+
+                image.refresh_from_db()
+                self.assertEqual(image.processing_status, Image.READY)
+                self.assertEqual(image.phash, Image.objects.get(id=1).phash)
+                self.assertTrue(image.placeholder.startswith('data:image/webp;base64,'))
+                self.assertEqual(self.thumbnail_bytes(image), expected)
+                self.assertEqual(UsageStats.objects.get(user=self.user1).thumbnail_count, thumbnails + len(expected))
+
+    def test_batch_rendering_failure_marks_only_that_image_failed(self):
+        broken, image = self.pending_copy_of_image_1(), self.pending_copy_of_image_1()
+        Image.objects.filter(id=broken.id).update(image='images/missing.png')
+        broken.refresh_from_db()
+        self.assertEqual(render_thumbnail_batch([broken, image]), 1)
+        self.assertEqual(Image.objects.get(id=broken.id).processing_status, Image.FAILED)
+        self.assertEqual(Image.objects.get(id=image.id).processing_status, Image.READY)
+
+    @override_settings(THUMBNAIL_BATCH_QUEUE='thumbnail-batches', THUMBNAIL_INLINE_MAX_PIXELS=0)
+    def test_offloaded_uploads_queue_one_batch_consumer(self):
+        class SharedFlags:
+            def __init__(self):
+                self.keys = {}
+
+            def set(self, key, value, nx=False, ex=None):
+                if nx and key in self.keys:
+                    return None
+                self.keys[key] = value
+                return True
+
+            def delete(self, key):
+                self.keys.pop(key, None)
+
+        redis_client = SharedFlags()
+        Image.objects.update(processing_status=Image.READY)
+        images = [self.pending_copy_of_image_1() for _ in range(3)]
+        with patch.object(tasks, 'run', side_effect=lambda command: command(redis_client)), \
+                patch.object(tasks.render_pending_thumbnails, 'apply_async') as apply_async, \
+                patch.object(tasks.create_thumbnails, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            for image in images:
+                tasks.schedule_thumbnails(image)
+        delay.assert_not_called()
+        apply_async.assert_called_once_with(queue='thumbnail-batches')
+        self.assertIn(tasks.THUMBNAIL_BATCH_QUEUED_KEY, redis_client.keys)
+
+        with patch.object(tasks, 'run', side_effect=lambda command: command(redis_client)), \
+                patch('images_api_app.batching.get_pool', return_value=None), \
+                patch('images_api_app.batching.publish_image_event'), \
+                self.settings(THUMBNAIL_BATCH_SIZE=2):
+            self.assertEqual(tasks.render_pending_thumbnails(), 3)
+        self.assertNotIn(tasks.THUMBNAIL_BATCH_QUEUED_KEY, redis_client.keys)
+        self.assertFalse(Image.objects.filter(processing_status=Image.PENDING).exists())
+
+    def test_batch_consumer_hands_off_single_path_images_and_skips_claimed_ones(self):
+        Image.objects.update(processing_status=Image.READY)
+        large, claimed = self.pending_copy_of_image_1(), self.pending_copy_of_image_1()
+        self.assertTrue(tasks.claim_for_rendering(claimed))
+        with patch('images_api_app.batching.get_pool', return_value=None), \
+                patch('images_api_app.batching.publish_image_event'), \
+                patch.object(tasks.create_thumbnails, 'delay') as delay, \
+                patch.object(tasks, 'generate_thumbnails') as generate_thumbnails, \
+                self.settings(THUMBNAIL_TASK_MEMORY_BUDGET=1000), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(tasks.render_pending_thumbnails(), 0)
+            delay.assert_not_called()
+        delay.assert_called_once_with(large.id)
+        generate_thumbnails.assert_not_called()
+        self.assertEqual(Image.objects.get(id=large.id).processing_status, Image.PROCESSING)
+        self.assertFalse(Thumbnail.objects.filter(base_image=claimed).exists())
+
+        # Processing images are not claimed again by the next consumer.
+        with patch('images_api_app.batching.get_pool', return_value=None), \
+                patch.object(tasks.create_thumbnails, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(tasks.render_pending_thumbnails(), 0)
+        delay.assert_not_called()
+        self.assertFalse(tasks.claim_for_rendering(large))
+
+    def test_batch_consumer_commits_its_claims_before_rendering(self):
+        Image.objects.update(processing_status=Image.READY)
+        images = [self.pending_copy_of_image_1() for _ in range(2)]
+        savepoints = len(connection.savepoint_ids)
+
+        def render_claimed_batch(batch, executor):
+            # The claiming transaction is over, the rows are only marked as processing.
+            self.assertEqual(len(connection.savepoint_ids), savepoints)
+            for base_image in Image.objects.filter(id__in=[image.id for image in images]):
+                self.assertEqual(base_image.processing_status, Image.PROCESSING)
+                self.assertIsNotNone(base_image.processing_started_at)
+            return len(batch)
+
+        with patch('images_api_app.batching.get_pool', return_value=None), \
+                patch('images_api_app.batching.render_thumbnail_batch', side_effect=render_claimed_batch):
+            self.assertEqual(tasks.render_pending_thumbnails(), 2)
+
+    def test_batch_rendering_drops_results_of_images_deleted_meanwhile(self):
+        from . import batching
+        deleted, image = self.pending_copy_of_image_1(), self.pending_copy_of_image_1()
+        render_image = batching.render_image
+
+        def render_and_delete(base_image, sizes):
+            result = render_image(base_image, sizes)
+            if base_image.id == deleted.id:
+                Image.objects.filter(id=deleted.id).delete()
+            return result
+
+        paths = set(PendingFileDeletion.objects.values_list('path', flat=True))
+        with patch.object(batching, 'render_image', side_effect=render_and_delete), \
+                patch('images_api_app.batching.publish_image_event') as publish:
+            self.assertEqual(render_thumbnail_batch([deleted, image]), 1)
+        publish.assert_called_once_with(image)
+        self.assertEqual(Image.objects.get(id=image.id).processing_status, Image.READY)
+        self.assertFalse(Thumbnail.objects.filter(base_image_id=deleted.id).exists())
+        queued = set(PendingFileDeletion.objects.values_list('path', flat=True)) - paths
+        self.assertTrue(queued)
+        self.assertTrue(all(path.endswith(('.png', '.webp', '.jpg')) for path in queued))
+
+    def test_stale_processing_images_are_queued_again(self):
+        Image.objects.update(processing_status=Image.READY)
+        stale, recent = self.pending_copy_of_image_1(), self.pending_copy_of_image_1()
+        Image.objects.filter(id=stale.id).update(processing_status=Image.PROCESSING,
+                                                 processing_started_at=timezone.now() - timedelta(hours=2))
+        Image.objects.filter(id=recent.id).update(processing_status=Image.PROCESSING,
+                                                  processing_started_at=timezone.now())
+        with patch.object(tasks.create_thumbnails, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(tasks.requeue_stale_thumbnails(), 1)
+        delay.assert_called_once_with(stale.id)
+        self.assertEqual(Image.objects.get(id=stale.id).processing_status, Image.PENDING)
+        self.assertEqual(Image.objects.get(id=recent.id).processing_status, Image.PROCESSING)
+
+        Image.objects.filter(id=stale.id).update(processing_status=Image.PROCESSING, processing_started_at=None)
+        with override_settings(THUMBNAIL_BATCH_QUEUE='thumbnail-batches'), \
+                patch.object(tasks, 'schedule_thumbnail_batch') as schedule_thumbnail_batch, \
+                patch.object(tasks.create_thumbnails, 'delay') as delay:
+            self.assertEqual(tasks.requeue_stale_thumbnails(), 1)
+        schedule_thumbnail_batch.assert_called_once_with()
+        delay.assert_not_called()
+
+    """
+    26. Storage tiering tests.
+    """
+    def idle_image_1(self, days=31):
+        Image.objects.filter(id=1).update(processing_status=Image.READY,
+                                          last_accessed_at=timezone.now() - timedelta(days=days))
+        return Image.objects.get(id=1)
+
+    def test_idle_original_moves_to_cold_storage_and_back_on_access(self):
+        with tempfile.TemporaryDirectory() as cold_root, override_settings(COLD_STORAGE_ROOT=cold_root):
+            image = self.idle_image_1()
+            original = image.image.read()
+            self.assertEqual(storage_tiers.demote_idle_originals(), 1)
+            drain_file_deletions()
+
+            image.refresh_from_db()
+            self.assertEqual(image.storage_tier, Image.COLD)
+            self.assertFalse(default_storage.exists(image.image.name))
+            self.assertTrue(os.path.exists(os.path.join(cold_root, image.image.name)))
+            with image.open_original() as source:
+                self.assertEqual(source.read(), original)
+
+            self.client.force_authenticate(user=self.user1)
+            original_url = reverse("image-original", kwargs={'slug': 'image1-1'})
+            response = self.client.get(reverse("image-detail-destroy", kwargs={'slug': 'image1-1'}))
+            self.assertTrue(response.data['data']['image'].endswith(original_url))
+
+            response = self.client.get(original_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(b''.join(response.streaming_content), original)
+            self.assertEqual(Image.objects.get(id=1).storage_tier, Image.HOT)
+            drain_file_deletions()
+            self.assertTrue(default_storage.exists(image.image.name))
+            self.assertFalse(os.path.exists(os.path.join(cold_root, image.image.name)))
+
+    def test_restoring_before_the_drain_keeps_the_original(self):
+        with tempfile.TemporaryDirectory() as cold_root, override_settings(COLD_STORAGE_ROOT=cold_root):
+            image = self.idle_image_1()
+            original = image.image.read()
+            self.assertTrue(storage_tiers.demote_original(image))
+            storage_tiers.restore_original(image)
+            self.assertEqual(set(PendingFileDeletion.objects.values_list('path', flat=True)),
+                             {COLD_PATH_PREFIX + image.image.name})
+            drain_file_deletions()
+            self.assertFalse(os.path.exists(os.path.join(cold_root, image.image.name)))
+            with Image.objects.get(id=1).open_original() as source:
+                self.assertEqual(source.read(), original)
+
+    def test_drain_keeps_queued_paths_an_image_references(self):
+        PendingFileDeletion.objects.create(path=self.image_1.image.name)
+        drain_file_deletions()
+        self.assertFalse(PendingFileDeletion.objects.exists())
+        self.assertTrue(default_storage.exists(self.image_1.image.name))
+
+    def test_recent_pending_and_untiered_originals_stay_hot(self):
+        self.idle_image_1()
+        self.assertEqual(storage_tiers.demote_idle_originals(), 0)
+        with tempfile.TemporaryDirectory() as cold_root, override_settings(COLD_STORAGE_ROOT=cold_root):
+            self.idle_image_1(days=5)
+            Image.objects.filter(id=2).update(processing_status=Image.PENDING, last_accessed_at=timezone.now() - timedelta(days=90))
+            self.assertEqual(storage_tiers.demote_idle_originals(), 0)
+        self.assertEqual(set(Image.objects.values_list('storage_tier', flat=True)), {Image.HOT})
+
+    def test_deleting_cold_image_deletes_cold_file(self):
+        with tempfile.TemporaryDirectory() as cold_root, override_settings(COLD_STORAGE_ROOT=cold_root):
+            storage_tiers.demote_original(self.idle_image_1())
+            name = Image.objects.get(id=1).image.name
+            Image.objects.get(id=1).delete()
+            self.assertTrue(PendingFileDeletion.objects.filter(path=COLD_PATH_PREFIX + name).exists())
+            drain_file_deletions()
+            self.assertFalse(os.path.exists(os.path.join(cold_root, name)))
+
+    def test_original_view_requires_link_to_original_tier(self):
+        self.client.force_authenticate(user=self.user2)
+        AccountTier.objects.filter(id=2).update(link_to_original=False)
+        response = self.client.get(reverse("image-original", kwargs={'slug': 'image2-2'}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_listed_and_cached_original_links_are_tracked_accesses(self):
+        self.client.force_authenticate(user=self.user2)
+        original_url = reverse("image-original", kwargs={'slug': 'image2-2'})
+        cache.delete("image_detail_image2-2")
+        client = Mock()
+        with override_settings(COLD_STORAGE_ROOT='/tmp/cold', ORIGINAL_ACCESS_SAMPLE_RATE=1), \
+                patch.object(storage_tiers, 'run', side_effect=lambda command: command(client)):
+            response = self.client.get(reverse("list-create-images"))
+            self.assertTrue(all(image['image'].endswith(reverse("image-original", kwargs={'slug': image['slug']}))
+                                for image in response.data))
+            self.assertEqual(client.hset.call_count, 1)
+            for _ in range(2):
+                response = self.client.get(reverse("image-detail-destroy", kwargs={'slug': 'image2-2'}))
+                self.assertTrue(response.data['data']['image'].endswith(original_url))
+        # One command for the listed page, then the cache miss and the cache hit of the detail.
+        self.assertEqual(client.hset.call_count, 3)
+        listed = client.hset.call_args_list[0].kwargs['mapping']
+        self.assertEqual(set(listed), set(Image.objects.filter(uploaded_by=self.user2).values_list('id', flat=True)))
+        for call in client.hset.call_args_list[1:]:
+            self.assertEqual(list(call.kwargs['mapping']), [2])
+
+    @skipUnless(redis_available(), "Redis is not available.")
+    def test_original_accesses_are_buffered_and_flushed(self):
+        redis_client.run(lambda client: client.delete(storage_tiers.ACCESS_BUFFER_KEY))
+        self.idle_image_1()
+        with override_settings(COLD_STORAGE_ROOT='/tmp/cold', ORIGINAL_ACCESS_SAMPLE_RATE=1):
+            storage_tiers.record_original_access(1)
+            storage_tiers.record_original_access(1)
+            self.assertEqual(storage_tiers.flush_original_accesses(), 1)
+        self.assertGreater(Image.objects.get(id=1).last_accessed_at, timezone.now() - timedelta(minutes=1))
+        self.assertEqual(storage_tiers.flush_original_accesses(), 0)
+
+    def test_encoded_format_and_extension_match(self):
+        bitmap = PILImage.new('RGB', (8, 8), 'red')
+        for image_format, extension in (('JPEG', 'jpg'), ('MPO', 'jpg'), ('PNG', 'png'), ('WEBP', 'webp'), ('GIF', 'png')):
+            with PILImage.open(BytesIO(encode_image(bitmap, image_format))) as encoded:
+                self.assertEqual(FORMAT_EXTENSIONS[encoded.format], extension)
+            self.assertEqual(output_extension(image_format), extension)
+
+    """
+    27. Focal point tests.
+    """
+    def test_focal_point_is_found_on_the_subject(self):
+        bitmap = PILImage.new('RGB', (400, 200), 'white')
+        bitmap.paste(PILImage.new('RGB', (40, 40), 'black'), (300, 120))
+        focal_x, focal_y = find_focal_point(bitmap)
+        self.assertAlmostEqual(focal_x, 0.8, delta=0.03)
+        self.assertAlmostEqual(focal_y, 0.7, delta=0.03)
+        self.assertEqual(find_focal_point(PILImage.new('RGB', (50, 50), 'white')), (0.5, 0.5))
+
+    def test_crops_are_centered_on_the_focal_point_within_bounds(self):
+        bitmap = PILImage.new('RGB', (400, 100), 'red')
+        bitmap.paste(PILImage.new('RGB', (200, 100), 'blue'), (200, 0))
+        self.assertEqual(fit_to_size(bitmap, (50, 50), (0.9, 0.5)).getcolors(), [(2500, (0, 0, 255))])
+        self.assertEqual(fit_to_size(bitmap, (50, 50), (0.1, 0.5)).getcolors(), [(2500, (255, 0, 0))])
+        centered = fit_to_size(bitmap, (50, 50))
+        self.assertEqual((centered.getpixel((0, 25)), centered.getpixel((49, 25))), ((255, 0, 0), (0, 0, 255)))
+
+    def test_pipeline_stores_focal_point_once(self):
+        create_thumbnails(self.image_1.id)
+        image = Image.objects.get(id=1)
+        self.assertIsNotNone(image.focal_x)
+        self.assertTrue(0 <= image.focal_x <= 1 and 0 <= image.focal_y <= 1)
+
+        Image.objects.filter(id=1).update(focal_x=0, focal_y=1)
+        with patch('images_api_app.tasks.find_focal_point') as find:
+            create_thumbnails(self.image_1.id)
+        find.assert_not_called()
+        self.assertEqual(Image.objects.get(id=1).focal_point, (0, 1))
+
+    def test_set_focal_point_renders_thumbnails_again(self):
+        create_thumbnails(self.image_1.id)
+        old_thumbnails = set(Thumbnail.objects.filter(base_image_id=1).values_list('id', flat=True))
+        self.client.force_authenticate(user=self.user1)
+        url = reverse("image-focal-point", kwargs={'slug': 'image1-1'})
+
+        response = self.client.put(url, {'focal_x': 1.5, 'focal_y': 0.5})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with patch('images_api_app.views.schedule_thumbnails', side_effect=tasks.generate_thumbnails) as schedule, \
+                patch.object(tasks.drain_file_deletions, 'delay'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(url, {'focal_x': 0.25, 'focal_y': 0.75})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        schedule.assert_called_once()
+        image = Image.objects.get(id=1)
+        self.assertEqual((image.focal_x, image.focal_y, image.processing_status), (0.25, 0.75, Image.READY))
+        thumbnails = set(Thumbnail.objects.filter(base_image_id=1).values_list('id', flat=True))
+        self.assertEqual(len(thumbnails), 2)
+        self.assertFalse(thumbnails & old_thumbnails)
+
+        self.client.force_authenticate(user=self.user2)
+        self.assertEqual(self.client.put(url, {'focal_x': 0.5, 'focal_y': 0.5}).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_focal_point_of_image_being_rendered_cannot_be_changed(self):
+        self.client.force_authenticate(user=self.user1)
+        url = reverse("image-focal-point", kwargs={'slug': 'image1-1'})
+        for processing_status in Image.UNFINISHED_STATUSES:
+            Image.objects.filter(id=1).update(processing_status=processing_status)
+            with patch('images_api_app.views.schedule_thumbnails') as schedule:
+                response = self.client.put(url, {'focal_x': 0.25, 'focal_y': 0.75})
+            self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+            schedule.assert_not_called()
+        self.assertEqual(Thumbnail.objects.filter(base_image_id=1).count(), 2)
+        self.assertIsNone(Image.objects.get(id=1).focal_x)
+
+    def test_set_focal_point_writes_only_its_fields(self):
+        Image.objects.filter(id=1).update(processing_status=Image.READY)
+        self.client.force_authenticate(user=self.user1)
+        url = reverse("image-focal-point", kwargs={'slug': 'image1-1'})
+        with patch('images_api_app.views.schedule_thumbnails'), CaptureQueriesContext(connection) as queries:
+            self.client.put(url, {'focal_x': 0.25, 'focal_y': 0.75})
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "images_api_app_image"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"name"', updates[0])
+
+class ReplicaRoutingTestCase(TestCase):
+    """
+    Runs against the default database and its replica aliases; set DB_REPLICA_HOSTS to include replicas.
+    """
+    databases = {'default', *settings.DATABASE_REPLICAS}
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="testuser1", password="very-strong-password")
+        self.client.force_authenticate(user=self.user)
+
+    @override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'])
+    def test_router_sends_only_replica_reads_to_replicas(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Image), 'default')
+        with replica_reads():
+            self.assertIn(router.db_for_read(Image), ['replica_1', 'replica_2'])
+            self.assertEqual(router.db_for_write(Image), 'default')
+        self.assertEqual(router.db_for_read(Image), 'default')
+        self.assertFalse(router.allow_migrate('replica_1', 'images_api_app'))
+
+    def test_users_are_pinned_to_primary_without_redis(self):
+        with patch('images_api_app.db_router.run', return_value=None):
+            self.assertTrue(is_pinned_to_primary(self.user.id))
+
+    @skipUnless(settings.DATABASE_REPLICAS, "No replica database aliases configured.")
+    def test_list_reads_from_replica_unless_user_wrote_recently(self):
+        replica = connections[settings.DATABASE_REPLICAS[0]]
+        with override_settings(DATABASE_REPLICAS=settings.DATABASE_REPLICAS[:1]):
+            with patch('images_api_app.views.is_pinned_to_primary', return_value=False), \
+                    CaptureQueriesContext(replica) as replica_queries:
+                response = self.client.get(reverse("list-create-images"))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(replica_queries.captured_queries)
+
+            with patch('images_api_app.views.is_pinned_to_primary', return_value=True), \
+                    CaptureQueriesContext(replica) as replica_queries:
+                self.client.get(reverse("list-create-images"))
+            self.assertFalse(replica_queries.captured_queries)
+
+            with patch('images_api_app.views.pin_to_primary') as pin_to_primary:
+                self.client.post(reverse("bulk-delete-images"), {'slugs': ['missing']}, format='json')
+            pin_to_primary.assert_called_once_with(self.user.id)
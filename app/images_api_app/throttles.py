@@ -0,0 +1,32 @@
+from rest_framework.throttling import BaseThrottle
+from .models import AccountTier
+from .ratelimit import take_token
+
+
+class TierTokenBucketThrottle(BaseThrottle):
+    """
+    Throttle POST requests of an user with a Redis token bucket refilled at the per-minute
+    rate of the most permissive granted tier. Runs before the request body is parsed.
+    """
+    scope = None
+    rate_field = None
+
+    def allow_request(self, request, view):
+        if request.method != 'POST' or not request.user.is_authenticated:
+            return True
+        per_minute = AccountTier.limits_for_user(request.user, [self.rate_field])[self.rate_field]
+        allowed, self.wait_seconds = take_token(self.scope, request.user.id, per_minute)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class UploadRateThrottle(TierTokenBucketThrottle):
+    scope = 'upload'
+    rate_field = 'uploads_per_minute'
+
+
+class ExpiringLinkRateThrottle(TierTokenBucketThrottle):
+    scope = 'expiring_link'
+    rate_field = 'expiring_links_per_minute'
@@ -0,0 +1,85 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from PIL import Image as PILImage
+from rest_framework.exceptions import ValidationError
+
+from .models import AccountTier
+
+IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'PNG',
+    b'\xff\xd8\xff': 'JPEG',
+}
+# Longest signature we need to see before sniffing the format.
+SIGNATURE_LENGTH = max(len(signature) for signature in IMAGE_SIGNATURES)
+
+
+def get_upload_limits(user):
+    """
+    Return the most permissive upload limits among the account tiers granted to an user.
+    """
+    return AccountTier.limits_for_user(user, ['max_upload_size', 'max_image_dimension', 'max_image_pixels'])
+
+
+class ImageHeaderUploadHandler(FileUploadHandler):
+    """
+    Upload handler validating images while they stream in, before any other handler stores them.
+
+    The real format is sniffed from magic bytes and only the image header is parsed, then size,
+    dimensions and pixel count are checked against the user's tier limits. The request is aborted
+    with a ValidationError as soon as a limit is exceeded.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.limits = get_upload_limits(getattr(self.request, 'user', None))
+        self.received = 0
+        self.header = b''
+        self.header_checked = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.limits['max_upload_size']:
+            self.reject(f"File exceeds the upload limit of {self.limits['max_upload_size']} bytes.")
+        if not self.header_checked:
+            self.header += raw_data
+            self.check_header()
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not self.header_checked:
+            self.reject("Upload a valid image. The file is truncated or not an image.")
+        return None
+
+    def check_header(self):
+        """
+        Identify the format from the magic bytes and validate the header once enough of it arrived.
+        """
+        if len(self.header) < SIGNATURE_LENGTH:
+            return
+        image_format = next(
+            (fmt for signature, fmt in IMAGE_SIGNATURES.items() if self.header.startswith(signature)), None
+        )
+        if image_format is None:
+            self.reject("Unsupported file format. Upload a PNG or JPEG image.")
+        try:
+            with PILImage.open(BytesIO(self.header), formats=[image_format]) as img:
+                width, height = img.size
+        except PILImage.DecompressionBombError as error:
+            self.reject(str(error))
+        except Exception:
+            # The header is not complete yet; wait for more data up to the configured cap.
+            if len(self.header) > settings.UPLOAD_HEADER_MAX_BYTES:
+                self.reject("Upload a valid image. The image header could not be read.")
+            return
+
+        if max(width, height) > self.limits['max_image_dimension']:
+            self.reject(f"Image dimensions exceed {self.limits['max_image_dimension']}px.")
+        if width * height > self.limits['max_image_pixels']:
+            self.reject(f"Image exceeds the limit of {self.limits['max_image_pixels']} pixels.")
+        self.header_checked = True
+        self.header = b''
+
+    def reject(self, message):
+        raise ValidationError({self.field_name: [message]})
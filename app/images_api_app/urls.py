@@ -1,9 +1,18 @@
 from django.urls import path
-from .views import ImageListCreateAPIView, ImageDetailDestroyAPIView, ExpiringLinkListCreateAPIView, ImagesApiOverview
+from .views import ImageListCreateAPIView, ImageDetailDestroyAPIView, ExpiringLinkListCreateAPIView, ImagesApiOverview, SimilarImagesAPIView, ThumbnailAtlasAPIView, ImageExportAPIView, ImageBulkDeleteAPIView, ImageEventsAPIView, ImageTilesAPIView, ImageTileAPIView, ImageOriginalAPIView, ImageFocalPointAPIView
 
 urlpatterns = [
     path('', ImagesApiOverview.as_view(), name='images-api-overview'),
     path('images', ImageListCreateAPIView.as_view(), name='list-create-images'),
+    path('images/bulk-delete/', ImageBulkDeleteAPIView.as_view(), name='bulk-delete-images'),
+    path('images/export/', ImageExportAPIView.as_view(), name='export-images'),
+    path('images/atlas/', ThumbnailAtlasAPIView.as_view(), name='thumbnail-atlas'),
+    path('images/events/', ImageEventsAPIView.as_view(), name='image-events'),
+    path('images/similar/', SimilarImagesAPIView.as_view(), name='similar-images'),
+    path('images/<slug:slug>/original/', ImageOriginalAPIView.as_view(), name='image-original'),
+    path('images/<slug:slug>/focal-point/', ImageFocalPointAPIView.as_view(), name='image-focal-point'),
+    path('images/<slug:slug>/tiles/', ImageTilesAPIView.as_view(), name='image-tiles'),
+    path('images/<slug:slug>/tiles/<int:level>/<int:column>_<int:row>.<str:extension>', ImageTileAPIView.as_view(), name='image-tile'),
     path('images/<slug:slug>/expiring/', ExpiringLinkListCreateAPIView.as_view(), name='expiring-list-create'),
     path('images/<slug:slug>/', ImageDetailDestroyAPIView.as_view(), name='image-detail-destroy'),
 ]
@@ -1,51 +1,144 @@
+import hashlib
+import json
+import os
+from io import BytesIO
+
+from PIL import Image as PILImage
 from rest_framework import generics, permissions
-from .permissions import CreateExpiringLinkPermission
-from .models import Image, GrantedTier, ExpiringLink
-from .serializers import ImageSerializer, ImageLinkToOriginalSerializer, ExpiringLinkSerializer
+from .permissions import CreateExpiringLinkPermission, StorageQuotaPermission
+from .models import AccountTier, Image, GrantedTier, ExpiringLink, Thumbnail, ThumbnailSize, batched_file_deletions
+from .serializers import ImageSerializer, ImageLinkToOriginalSerializer, ImageFocalPointSerializer, ExpiringLinkSerializer
 from rest_framework import status
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from django.conf import settings
 from django.core.cache import cache
-from .tasks import create_thumbnails, delete_expiring_link
+from django.core.files.storage import default_storage
+from django.db import transaction
+from .tasks import delete_expiring_link, schedule_thumbnails
+from .imaging import (EXTENSION_CONTENT_TYPES, TILE_SIZE, build_atlas, display_size, output_extension, pyramid_levels,
+                      read_image_metadata)
+from .upload_handlers import ImageHeaderUploadHandler
+from .phash import get_user_index, hash_image_file, to_unsigned
+from .exports import stream_user_export
+from .filters import ImageFilterBackend
+from .pagination import AtlasCursorPagination, ImageCursorPagination
+from .events import EventStreamRenderer, stream_image_events
+from .db_router import is_pinned_to_primary, pin_to_primary, start_replica_reads, stop_replica_reads
+from .ratelimit import release_storage, reserve_storage
+from .paths import hashed_path
+from .profiling import UserProfilingMixin
+from .storage_tiers import record_original_access, restore_original
+from .throttles import ExpiringLinkRateThrottle, UploadRateThrottle
 from django.core.files.base import ContentFile
-from django.http import Http404
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from rest_framework.views import APIView
 
 
-class ImagesApiOverview(APIView):
+class ImagesApiOverview(UserProfilingMixin, APIView):
     """
     Provides an overview of image-related routes.
 
     Routes:
     - 'For LOGIN visit -->': Authentication endpoint.
     - 'List-Create images': List and create images.
+    - 'Filter images': Filter and cursor-paginate the image list.
     - 'Image detail': View details of a specific image (use its slug).
     - 'Expiring link': Generate an expiring link for a specific image.
+    - 'Thumbnail atlas': One image packing the thumbnails of a page of images.
+    - 'Export': Download a ZIP archive of all images, thumbnails and their metadata.
+    - 'Bulk delete': Delete many images at once (POST a list of slugs).
+    - 'Similar images': Find near-duplicates of an image (use its slug) or of an uploaded file.
+    - 'Image events': Server-Sent Events announcing when thumbnails of pending images are ready.
+    - 'Deep zoom': DeepZoom tile pyramid of a very large image (use its slug).
+    - 'Original': The original file of an image (use its slug), moved back from cold storage if needed.
+    - 'Focal point': Set the point thumbnails of an image are cropped around (PUT, use its slug).
     """
 
     def get(self, request):
         routes = {
             "For LOGIN visit -->": request.build_absolute_uri(reverse(('authorization'))),
             "List-Create images": request.build_absolute_uri(reverse(('list-create-images'))),
+            "Filter images": request.build_absolute_uri(reverse(('list-create-images'))) + "?name=<prefix>&search=<text>&created_after=<datetime>&created_before=<datetime>&image_format=<format>&min_width=<int>&max_width=<int>&min_height=<int>&max_height=<int>&status=<status>&page_size=<int>",
             "Image detail": request.build_absolute_uri(reverse(('list-create-images'))) + "/<slug:slug>",
             "Expiring link": request.build_absolute_uri(reverse(('list-create-images'))) + "/<slug:slug>/expiring",
+            "Thumbnail atlas": request.build_absolute_uri(reverse(('thumbnail-atlas'))) + "?size=<name>&page=<int>&page_size=<int>",
+            "Export": request.build_absolute_uri(reverse(('export-images'))),
+            "Bulk delete": request.build_absolute_uri(reverse(('bulk-delete-images'))),
+            "Similar images": request.build_absolute_uri(reverse(('similar-images'))) + "?slug=<slug:slug>&distance=<int>",
+            "Image events": request.build_absolute_uri(reverse(('image-events'))) + "?slug=<slug:slug>",
+            "Deep zoom": request.build_absolute_uri(reverse(('list-create-images'))) + "/<slug:slug>/tiles",
+            "Original": request.build_absolute_uri(reverse(('list-create-images'))) + "/<slug:slug>/original",
+            "Focal point": request.build_absolute_uri(reverse(('list-create-images'))) + "/<slug:slug>/focal-point",
             "Review Code": "https://github.com/waisu88/docker_compose_production/tree/main/app/images_api"
         }
         return Response(routes)
 
 
-class ImageListCreateAPIView(generics.ListCreateAPIView):
+class ReplicaReadMixin:
+    """
+    Serve safe requests from a read replica, unless the user wrote within REPLICA_STICKY_SECONDS,
+    and pin the user to the primary after every successful unsafe request.
+    """
+    replica_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (settings.DATABASE_REPLICAS and request.method in permissions.SAFE_METHODS
+                and not is_pinned_to_primary(request.user.id)):
+            self.replica_token = start_replica_reads()
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self.replica_token is not None:
+                stop_replica_reads(self.replica_token)
+                self.replica_token = None
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if (request.method not in permissions.SAFE_METHODS and response.status_code < 400
+                and request.user.is_authenticated):
+            pin_to_primary(request.user.id)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ImageHeaderValidationMixin:
+    """
+    Validate uploaded images from their header while the request body streams in,
+    so invalid files are rejected before they are stored.
+    """
+
+    def initialize_request(self, request, *args, **kwargs):
+        if request.method == 'POST':
+            request.upload_handlers.insert(0, ImageHeaderUploadHandler(request))
+        return super().initialize_request(request, *args, **kwargs)
+
+
+class ImageListCreateAPIView(UserProfilingMixin, ReplicaReadMixin, ImageHeaderValidationMixin,
+                             generics.ListCreateAPIView):
     """
     API view for listing and creating images.
 
     - For listing, it returns images uploaded by the authenticated user.
-    - For creation, it allows the user to upload an image and automatically generates thumbnails using Celery task.
+    - For creation, it allows the user to upload an image and automatically generates thumbnails,
+      inline for small images and using Celery task otherwise.
 
     Optionally, if the user has the 'Link to Original' permission, the API returns additional information.
+    Uploads are rate limited and count against the storage quota of the user's tiers.
+
+    The list can be filtered with `name` (prefix), `search` (substring), `created_after`, `created_before`,
+    `image_format`, `min_width`, `max_width`, `min_height`, `max_height` and `status`, and is cursor-paginated
+    when `page_size` or `cursor` is given.
     """
     serializer_class = ImageSerializer
-    permission_classes = [permissions.IsAuthenticated]
-
+    permission_classes = [permissions.IsAuthenticated, StorageQuotaPermission]
+    throttle_classes = [UploadRateThrottle]
+    filter_backends = [ImageFilterBackend]
+    pagination_class = ImageCursorPagination
 
     def get_queryset(self, *args, **kwargs):
         """
@@ -68,25 +161,335 @@ class ImageListCreateAPIView(generics.ListCreateAPIView):
         
     def perform_create(self, image_serializer):
         """
-        Perform image creation and generate thumbnails in the background using Celery tasks.
+        Perform image creation and generate thumbnails, inline for small images
+        and in the background using Celery tasks otherwise.
         """
         if image_serializer.is_valid():
             user = self.request.user
-            image_instance = image_serializer.save(uploaded_by=user)
-            slug_str = f"{image_serializer.validated_data['name'].lower()}-{image_instance.id}"
-            image_instance.slug = slug_str
-            image_instance.save()
-            create_thumbnails.delay(user.id)        
+            image_metadata = read_image_metadata(image_serializer.validated_data['image'])
+            quota = AccountTier.limits_for_user(user, ['storage_quota'])['storage_quota']
+            if not reserve_storage(user.id, image_metadata['file_size'], quota):
+                raise PermissionDenied(StorageQuotaPermission.message)
+            try:
+                image_instance = image_serializer.save(uploaded_by=user, **image_metadata)
+                slug_str = f"{image_serializer.validated_data['name'].lower()}-{image_instance.id}"
+                image_instance.slug = slug_str
+                image_instance.save()
+            except Exception:
+                release_storage(user.id, image_metadata['file_size'])
+                raise
+            schedule_thumbnails(image_instance)
             return Response(image_serializer.data, status=status.HTTP_201_CREATED)
         return Response(image_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
 
-class ImageDetailDestroyAPIView(generics.RetrieveDestroyAPIView):
+class ImageEventsAPIView(UserProfilingMixin, APIView):
+    """
+    API view streaming Server-Sent Events about processing of the authenticated user's images.
+
+    An `image` event with the id, slug, processing status and thumbnail count is sent when an
+    image is ready or failed. Optional `slug` parameters select the images to watch, by default
+    all pending images are watched. The stream ends once all watched images were sent.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [JSONRenderer, EventStreamRenderer]
+
+    def get(self, request):
+        images = Image.objects.filter(uploaded_by=request.user).order_by('id')
+        slugs = request.query_params.getlist('slug')
+        if slugs:
+            images = images.filter(slug__in=slugs)
+        else:
+            images = images.filter(processing_status__in=Image.UNFINISHED_STATUSES)
+        response = StreamingHttpResponse(
+            stream_image_events(request.user, images.prefetch_related('thumbnails')),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class SimilarImagesAPIView(UserProfilingMixin, ImageHeaderValidationMixin, APIView):
+    """
+    API view for finding near-duplicates among the images of the authenticated user.
+
+    - GET with `?slug=<slug>` returns images similar to one of the user's images.
+    - POST with an `image` file returns images similar to the uploaded file.
+
+    The optional `distance` parameter sets the maximum Hamming distance between perceptual hashes.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    default_distance = 8
+    max_distance = 16
+    max_results = 100
+
+    def get(self, request):
+        image = get_object_or_404(Image, uploaded_by=request.user, slug=request.query_params.get('slug'))
+        if image.phash is None:
+            return Response({'detail': 'Perceptual hash of this image is not computed yet.'}, status=status.HTTP_409_CONFLICT)
+        return self.similar_images_response(to_unsigned(image.phash), request.query_params, exclude_id=image.id)
+
+    def post(self, request):
+        upload = request.FILES.get('image')
+        if upload is None:
+            return Response({'image': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+        return self.similar_images_response(hash_image_file(upload), request.data)
+
+    def similar_images_response(self, phash, params, exclude_id=None):
+        """
+        Search the user's hash index and serialize the matching images, closest first.
+        """
+        try:
+            distance = int(params.get('distance', self.default_distance))
+        except (TypeError, ValueError):
+            distance = -1
+        if not 0 <= distance <= self.max_distance:
+            return Response({'distance': [f"Must be an integer between 0 and {self.max_distance}."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        index = get_user_index(self.request.user.id)
+        with index.lock:
+            matches = [match for match in index.search(phash, distance) if match[1] != exclude_id][:self.max_results]
+        images = (Image.objects.select_related('uploaded_by').prefetch_related('thumbnails__created_by')
+                  .in_bulk([image_id for _, image_id in matches]))
+        results = []
+        for match_distance, image_id in matches:
+            if image_id in images:
+                results.append({'distance': match_distance, **ImageSerializer(images[image_id]).data})
+        return Response({'results': results})
+
+
+class ThumbnailAtlasAPIView(UserProfilingMixin, generics.GenericAPIView):
+    """
+    API view packing the thumbnails of a page of the user's images into one atlas image.
+
+    - `size` is the name of a ThumbnailSize. The page is selected exactly like a page of the image
+      list: with its filters, `page_size` (at most 100) and the `cursor` of the list or of the
+      `next` and `previous` links returned here.
+    - Returns the atlas URL with the box of every thumbnail inside it.
+
+    Atlases are stored under the fan-out path of a key derived from the size and the ids of the
+    member images and their thumbnails, so any change of a member produces a new atlas. The boxes
+    are stored next to the atlas as JSON, so an atlas is never decoded again. Serving an atlas
+    refreshes its modification time, and collect_idle_atlases deletes those not served for
+    ATLAS_IDLE_HOURS hours.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [ImageFilterBackend]
+    pagination_class = AtlasCursorPagination
+
+    def get_queryset(self):
+        return Image.objects.filter(uploaded_by=self.request.user).only('id', 'slug')
+
+    def get(self, request):
+        thumbnail_size = get_object_or_404(ThumbnailSize, name=request.query_params.get('size'))
+        images = [(image.id, image.slug) for image in self.paginate_queryset(self.filter_queryset(self.get_queryset()))]
+        thumbnails = {}
+        size_label = f"{thumbnail_size.width}x{thumbnail_size.height}px"
+        for thumbnail in (Thumbnail.objects.filter(base_image__in=[image_id for image_id, _ in images],
+                                                   thumbnail_size=size_label).order_by('id')):
+            thumbnails[thumbnail.base_image_id] = thumbnail
+        members = [(image_id, slug) for image_id, slug in images if image_id in thumbnails]
+
+        atlas_key = hashlib.sha1(
+            f"{size_label}|{','.join(f'{image_id}:{thumbnails[image_id].id}' for image_id, _ in members)}".encode()
+        ).hexdigest()[:32]
+        atlas_path = hashed_path('atlases', atlas_key, 'atlas.webp')
+        boxes_path = hashed_path('atlases', atlas_key, 'boxes.json')
+        coordinates = cache.get(f"atlas_{atlas_key}")
+        if coordinates is None or not default_storage.exists(atlas_path):
+            if default_storage.exists(atlas_path) and default_storage.exists(boxes_path):
+                with default_storage.open(boxes_path, 'rb') as boxes_file:
+                    coordinates = json.load(boxes_file)
+                os.utime(default_storage.path(atlas_path))
+            else:
+                coordinates = self.save_atlas(atlas_path, boxes_path, thumbnail_size, members, thumbnails)
+            cache.set(f"atlas_{atlas_key}", coordinates, settings.CACHE_TIMEOUT)
+
+        return Response({
+            'atlas': request.build_absolute_uri(default_storage.url(atlas_path)),
+            'size': thumbnail_size.name,
+            'coordinates': coordinates,
+            'missing': [image_id for image_id, _ in images if image_id not in thumbnails],
+            'next': self.paginator.get_next_link(),
+            'previous': self.paginator.get_previous_link(),
+        })
+
+    def save_atlas(self, atlas_path, boxes_path, thumbnail_size, members, thumbnails):
+        """
+        Pack the thumbnails of `members` into an atlas stored at `atlas_path`, with the box of
+        every member stored next to it at `boxes_path`. Return the boxes.
+        """
+        bitmaps = []
+        for image_id, _ in members:
+            with thumbnails[image_id].thumbnail_image.open('rb') as thumbnail_file:
+                bitmap = PILImage.open(thumbnail_file)
+                bitmap.load()
+                bitmaps.append(bitmap)
+        atlas, boxes = build_atlas(bitmaps, (thumbnail_size.width, thumbnail_size.height))
+        coordinates = [
+            {'id': image_id, 'slug': slug, 'x': x, 'y': y, 'width': width, 'height': height}
+            for (image_id, slug), (x, y, width, height) in zip(members, boxes)
+        ]
+        # The boxes go first, so an atlas is never stored without them.
+        if not default_storage.exists(boxes_path):
+            default_storage.save(boxes_path, ContentFile(json.dumps(coordinates).encode()))
+        if not default_storage.exists(atlas_path):
+            buffer = BytesIO()
+            atlas.save(buffer, format='WEBP', quality=85)
+            default_storage.save(atlas_path, ContentFile(buffer.getvalue()))
+        else:
+            os.utime(default_storage.path(atlas_path))
+        return coordinates
+
+
+class ImageOriginalAPIView(UserProfilingMixin, APIView):
+    """
+    API view serving the original file of an image of the authenticated user, if one of the user's
+    tiers offers links to originals. A cold original is moved back to the hot storage first.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, slug):
+        if not GrantedTier.objects.filter(user=request.user, granted_tiers__link_to_original=True).exists():
+            raise PermissionDenied("Your account tier does not offer links to originals.")
+        image = get_object_or_404(Image, uploaded_by=request.user, slug=slug)
+        record_original_access(image.id)
+        restore_original(image)
+        try:
+            source = image.image.open('rb')
+        except FileNotFoundError:
+            raise Http404
+        return FileResponse(source, content_type=PILImage.MIME.get(image.format, 'application/octet-stream'))
+
+
+class ImageFocalPointAPIView(UserProfilingMixin, ReplicaReadMixin, APIView):
+    """
+    API view setting the focal point of an image of the authenticated user, which every thumbnail
+    crop is centered on. `focal_x` and `focal_y` are fractions of the image width and height.
+    The thumbnails of the image are rendered again around the new focal point; while they are
+    still being rendered the focal point cannot be changed and 409 is returned.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def put(self, request, slug):
+        serializer = ImageFocalPointSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic(), batched_file_deletions():
+            image = get_object_or_404(Image.objects.select_for_update(), uploaded_by=request.user, slug=slug)
+            if image.processing_status in Image.UNFINISHED_STATUSES:
+                return Response({'detail': 'Thumbnails of this image are still being rendered.'},
+                                status=status.HTTP_409_CONFLICT)
+            image.thumbnails.all().delete()
+            image.focal_x, image.focal_y = serializer.validated_data['focal_x'], serializer.validated_data['focal_y']
+            image.processing_status = Image.PENDING
+            image.save(update_fields=['focal_x', 'focal_y', 'processing_status'])
+            transaction.on_commit(lambda: schedule_thumbnails(image))
+        cache.delete(f"image_detail_{slug}")
+        return Response(ImageFocalPointSerializer(image).data, status=status.HTTP_202_ACCEPTED)
+
+
+class ImageTilesAPIView(UserProfilingMixin, APIView):
+    """
+    API view describing the DeepZoom tile pyramid of a very large image of the authenticated user.
+
+    The `tile_source` object can be passed to OpenSeadragon as is; `tiles` is the URL template of tiles.
+    Dimensions are those of the orientated image the tiles are cut from.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, slug):
+        image = get_object_or_404(Image, uploaded_by=request.user, slug=slug)
+        if not image.tiles_path:
+            return Response({'detail': 'Tiles of this image are not available.'}, status=status.HTTP_404_NOT_FOUND)
+        extension = output_extension(image.format)
+        width, height = display_size(image)
+        tiles_url = request.build_absolute_uri(reverse('image-tiles', kwargs={'slug': slug}))
+        return Response({
+            'width': width,
+            'height': height,
+            'tile_size': TILE_SIZE,
+            'levels': len(pyramid_levels(width, height)),
+            'tiles': tiles_url + "<level>/<column>_<row>." + extension,
+            'tile_source': {
+                'Image': {
+                    'xmlns': 'http://schemas.microsoft.com/deepzoom/2008',
+                    'Url': tiles_url,
+                    'Format': extension,
+                    'Overlap': 0,
+                    'TileSize': TILE_SIZE,
+                    'Size': {'Width': width, 'Height': height},
+                },
+            },
+        })
+
+
+class ImageTileAPIView(UserProfilingMixin, APIView):
+    """
+    API view serving one tile of the DeepZoom pyramid of an image of the authenticated user.
+
+    A pyramid is stored in a new directory every time it is built, so tiles never change
+    and are served with long-lived cache headers.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, slug, level, column, row, extension):
+        cache_key = f"tiles_path_{request.user.id}_{slug}"
+        tiles_path = cache.get(cache_key)
+        if tiles_path is None:
+            tiles_path = Image.objects.filter(uploaded_by=request.user, slug=slug).values_list('tiles_path', flat=True).first()
+            cache.set(cache_key, tiles_path or '', settings.CACHE_TIMEOUT)
+        tile_path = f"{tiles_path}/{level}/{column}_{row}.{extension}"
+        if not tiles_path or extension not in EXTENSION_CONTENT_TYPES or not default_storage.exists(tile_path):
+            raise Http404
+        response = FileResponse(default_storage.open(tile_path, 'rb'), content_type=EXTENSION_CONTENT_TYPES[extension])
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+
+class ImageExportAPIView(UserProfilingMixin, APIView):
+    """
+    API view streaming a ZIP archive with all originals and thumbnails of the authenticated user
+    and a NDJSON manifest of their metadata.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        response = StreamingHttpResponse(stream_user_export(request.user), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{request.user.username}-images.zip"'
+        return response
+
+
+class ImageBulkDeleteAPIView(UserProfilingMixin, ReplicaReadMixin, APIView):
+    """
+    API view deleting many images of the authenticated user at once.
+
+    Expects a list of image slugs under `slugs`. Rows are deleted in one transaction,
+    files of the images and their thumbnails and expiring links are deleted in the background.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    max_slugs = 1000
+
+    def post(self, request):
+        slugs = request.data.get('slugs')
+        if not isinstance(slugs, list) or not 0 < len(slugs) <= self.max_slugs:
+            return Response({'slugs': [f"Provide a list of 1 to {self.max_slugs} image slugs."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic(), batched_file_deletions():
+            images = Image.objects.filter(uploaded_by=request.user, slug__in=slugs)
+            deleted_slugs = list(images.values_list('slug', flat=True))
+            images.delete()
+        cache.delete_many([f"image_detail_{slug}" for slug in deleted_slugs])
+        return Response({'deleted': deleted_slugs})
+
+
+class ImageDetailDestroyAPIView(UserProfilingMixin, ReplicaReadMixin, generics.RetrieveDestroyAPIView):
     """
     API view for retrieving and deleting images.
 
     - For retrieval, it returns detailed information about a specific image.
-    - For deletion, it removes the image and its associated thumbnails.
+    - For deletion, it removes the image and its associated thumbnails, their files are deleted in the background.
 
     Optionally, if the user has the 'Link to Original' permission, the API returns additional information.
     """
@@ -122,21 +525,24 @@ class ImageDetailDestroyAPIView(generics.RetrieveDestroyAPIView):
         cached_data = cache.get(cache_key)
 
         if cached_data is not None:
+            # Handing out the cached link counts as an access like a freshly serialized one.
+            if self.get_serializer_class() is ImageLinkToOriginalSerializer:
+                record_original_access(cached_data['id'])
             return Response({'data': cached_data})
 
         image_instance = self.get_object()
-        serializer = self.get_serializer(image_instance)
-        image_details = serializer.data
+        image_details = self.get_serializer(image_instance).data
         cache.set(cache_key, image_details)
         return Response({'data': image_details})
         
     def perform_destroy(self, instance):
         """
-        Perform image deletion, remove associated cache, and use signals to delete associated thumbnails.
+        Perform image deletion, remove associated cache, and use signals to queue deletion of associated files.
         """
         try: 
             image_slug = instance.slug
-            instance.delete()
+            with transaction.atomic(), batched_file_deletions():
+                instance.delete()
             cache_key_image = f"image_detail_{image_slug}"
             cache.delete(cache_key_image) 
             return Response(status=status.HTTP_204_NO_CONTENT)
@@ -144,17 +550,18 @@ class ImageDetailDestroyAPIView(generics.RetrieveDestroyAPIView):
             return Response(status=status.HTTP_404_NOT_FOUND)
 
 
-class ExpiringLinkListCreateAPIView(generics.ListCreateAPIView):
+class ExpiringLinkListCreateAPIView(UserProfilingMixin, generics.ListCreateAPIView):
     """
     API view for listing and creating expiring links associated with a specific image.
 
     - For listing, it returns expiring links for images uploaded by the authenticated user.
     - For creation, it allows the user to generate expiring links for a specific image.
 
-    Requires the 'Create Expiring Link' permission.
+    Requires the 'Create Expiring Link' permission. Creation is rate limited per user.
     """
     serializer_class = ExpiringLinkSerializer
     permission_classes = [permissions.IsAuthenticated, CreateExpiringLinkPermission]
+    throttle_classes = [ExpiringLinkRateThrottle]
 
     def get_queryset(self, *args, **kwargs):
         """
@@ -179,6 +586,8 @@ class ExpiringLinkListCreateAPIView(generics.ListCreateAPIView):
             return Response({'detail': 'Base image not found.'}, status=status.HTTP_404_NOT_FOUND)
 
         if expiring_link_serializer.is_valid():
+            record_original_access(base_image.id)
+            restore_original(base_image)
             picture_copy = ContentFile(base_image.image.read())
             new_picture_name = base_image.image.name.split("/")[-1]
             expiring_link_instance = expiring_link_serializer.save(base_image=base_image)